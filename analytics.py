@@ -0,0 +1,148 @@
+import atexit
+import hashlib
+import logging
+import math
+import threading
+from datetime import datetime
+
+from flask import request
+from flask_login import current_user
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Post, PostViewStats, PostViewTotal
+
+logger = logging.getLogger(__name__)
+
+
+class HyperLogLog:
+    """Distinct-count sketch with 2**p one-byte registers (1 KiB at p=10, about 3% error)"""
+
+    def __init__(self, p=10, registers=None):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.m)
+
+    def add(self, value):
+        x = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+        index = x >> (64 - self.p)
+        rest = x & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            # Linear counting is more accurate while many registers are still empty
+            estimate = self.m * math.log(self.m / zeros)
+        return round(estimate)
+
+    def to_bytes(self):
+        return bytes(self.registers)
+
+
+class ViewBuffer:
+    """Per-worker view counts and visitor sketches, keyed by (post_id, day) until the next flush"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.p = 10
+
+    def record(self, post_id, visitor):
+        key = (post_id, datetime.utcnow().date())
+        with self.lock:
+            entry = self.pending.get(key)
+            if entry is None:
+                entry = self.pending[key] = [0, HyperLogLog(self.p)]
+            entry[0] += 1
+            entry[1].add(visitor)
+
+    def take(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        return pending
+
+
+buffer = ViewBuffer()
+
+
+def record_view(post_id):
+    """Count a post view in memory; nothing is written until the next flush"""
+    if current_user.is_authenticated:
+        visitor = f'user:{current_user.id}'
+    else:
+        visitor = f'anon:{request.remote_addr}|{request.user_agent.string}'
+    buffer.record(post_id, visitor)
+
+
+def merge_counts(model, updates, retries=5):
+    """Add views and merge sketches into rows keyed by primary key tuples.
+
+    Sketches are merged in Python, so concurrent flushes from other workers are
+    detected with the version column and retried instead of overwriting each other.
+    """
+    for key, (views, sketch) in updates.items():
+        for _ in range(retries):
+            row = db.session.get(model, key, populate_existing=True)
+            if row is None:
+                pk = dict(zip((column.key for column in model.__mapper__.primary_key), key))
+                try:
+                    with db.session.begin_nested():
+                        db.session.add(model(views=views, uniques=sketch.count(), sketch=sketch.to_bytes(),
+                                             version=0, **pk))
+                    break
+                except IntegrityError:
+                    continue
+            merged = HyperLogLog(sketch.p, row.sketch)
+            merged.merge(sketch)
+            table = model.__table__
+            claimed = db.session.execute(
+                table.update().where(
+                    *[column == value for column, value in zip(model.__mapper__.primary_key, key)],
+                    table.c.version == row.version
+                ).values(views=table.c.views + views, uniques=merged.count(),
+                         sketch=merged.to_bytes(), version=row.version + 1)
+            ).rowcount
+            if claimed:
+                break
+        else:
+            logger.warning('Dropped %d views for %s %s after repeated write conflicts', views, model.__name__, key)
+
+
+def flush():
+    """Write buffered views to PostViewStats and PostViewTotal in one transaction"""
+    pending = buffer.take()
+    if not pending:
+        return 0
+    post_ids = {post_id for post_id, _ in pending}
+    existing = set(db.session.scalars(db.select(Post.id).where(Post.id.in_(post_ids))))
+
+    daily, totals = {}, {}
+    for (post_id, day), (views, sketch) in pending.items():
+        if post_id not in existing:
+            continue
+        daily[(post_id, day)] = (views, sketch)
+        total = totals.setdefault((post_id,), [0, HyperLogLog(sketch.p)])
+        total[0] += views
+        total[1].merge(sketch)
+
+    merge_counts(PostViewStats, daily)
+    merge_counts(PostViewTotal, {key: tuple(value) for key, value in totals.items()})
+    db.session.commit()
+    return sum(views for views, _ in daily.values())
+
+
+def init_app(app, scheduler):
+    buffer.p = app.config['ANALYTICS_HLL_PRECISION']
+    scheduler.add_job('analytics.flush', flush, app.config['ANALYTICS_FLUSH_INTERVAL'])
+
+    def flush_at_exit():
+        with app.app_context():
+            flush()
+    atexit.register(flush_at_exit)
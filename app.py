@@ -3,6 +3,12 @@ from flask_migrate import Migrate
 from flask_login import LoginManager, current_user
 from config import Config
 from models import db, User, Post
+from scheduler import scheduler
+from assets import assets
+from compression import compress
+from profiling import profiler
+import sessions
+import metrics
 from datetime import datetime
 
 # Initialize extensions
@@ -14,10 +20,26 @@ def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
     
-    # Initialize extensions with app
+    import uploads
+    uploads.init_app(app)
+    import template_cache
+    template_cache.init_app(app)
+    import server
+    server.init_app(app)
+    
+    # Initialize extensions with app; the profiler goes first so its hooks wrap the others
+    profiler.init_app(app)
+    metrics.init_app(app, scheduler)
     db.init_app(app)
+    metrics.init_engine(app)
     migrate.init_app(app, db)
     login_manager.init_app(app)
+    scheduler.init_app(app)
+    assets.init_app(app)
+    # Registered before the feature modules so it compresses what their after_request hooks return;
+    # only metrics, registered above, runs after it and records the final status
+    compress.init_app(app)
+    metrics.register_cache('compression', compress.cache)
     
     # Configure login manager
     login_manager.login_view = 'auth.login'
@@ -25,14 +47,17 @@ def create_app(config_class=Config):
     
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        return sessions.load_user_from_snapshot(int(user_id)) or User.query.get(int(user_id))
     
-    # Update user's last seen timestamp on each request
+    # Update user's last seen timestamp, at most once per LAST_SEEN_UPDATE_INTERVAL
     @app.before_request
     def before_request():
         if current_user.is_authenticated:
-            current_user.last_seen = datetime.utcnow()
-            db.session.commit()
+            now = datetime.utcnow()
+            if (current_user.last_seen is None or
+                    (now - current_user.last_seen).total_seconds() > app.config['LAST_SEEN_UPDATE_INTERVAL']):
+                current_user.last_seen = now
+                db.session.commit()
     
     # Register blueprints
     from blueprints.main import bp as main_bp
@@ -44,10 +69,51 @@ def create_app(config_class=Config):
     from blueprints.blog import bp as blog_bp
     app.register_blueprint(blog_bp, url_prefix='/blog')
     
+    # Register background jobs
+    import trending
+    trending.init_app(app, scheduler)
+    sessions.init_app(app, scheduler)
+    import changes
+    changes.init_app(app, scheduler)
+    import stats
+    stats.init_app(app)
+    import typeahead
+    typeahead.init_app(app, scheduler)
+    import analytics
+    analytics.init_app(app, scheduler)
+    import revisions
+    revisions.init_app(app, scheduler)
+    import tags
+    tags.init_app(app)
+    import archive
+    archive.init_app(app, scheduler)
+    import publishing
+    publishing.init_app(app, scheduler)
+    import ratelimit
+    ratelimit.init_app(app, scheduler)
+    import idempotency
+    idempotency.init_app(app, scheduler)
+    import backfill
+    backfill.init_app(app)
+    import dataset
+    dataset.init_app(app)
+    profiler.init_scheduler(scheduler, app.config['PROFILE_TOGGLE_REFRESH_INTERVAL'])
+    
     return app
 
-# Create app instance
-app = create_app()
+# App instance for 'flask --app app' and WSGI servers, created on first access
+_app = None
+
+
+def __getattr__(name):
+    """Build the module-level app on first use rather than at import time"""
+    global _app
+    if name == 'app':
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,274 @@
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, g, has_request_context, request
+from flask.cli import AppGroup
+from sqlalchemy.exc import IntegrityError
+
+from models import (
+    db, Post, Comment, Like, Tag, PostTag, PostRevision, PostScore, PostViewStats, PostViewTotal,
+    TimelineEntry, UserStats, ArchivedPost, ArchivedComment, post_attachment, bump_user_stats,
+    archived_post, archived_comment, archived_like, archived_post_tag, archived_post_attachment,
+    archived_post_revision, archived_post_view_total,
+)
+
+# Tables whose rows move with a post, parents first: (hot table, archive table, post id column)
+MOVES = (
+    (Post.__table__, archived_post, 'id'),
+    (Comment.__table__, archived_comment, 'post_id'),
+    (Like.__table__, archived_like, 'post_id'),
+    (PostTag.__table__, archived_post_tag, 'post_id'),
+    (post_attachment, archived_post_attachment, 'post_id'),
+    (PostRevision.__table__, archived_post_revision, 'post_id'),
+    (PostViewTotal.__table__, archived_post_view_total, 'post_id'),
+)
+
+# Hot-only rows that are dropped rather than archived: scores and timelines only matter for
+# recent posts, and daily views are already summed into PostViewTotal
+DROPPED = (PostScore.__table__, TimelineEntry.__table__, PostViewStats.__table__)
+
+
+def count_hot_rows(post_ids, sign):
+    """Add (sign 1) or remove (sign -1) the hot rows of posts to user statistics and tag counts.
+
+    Archived posts, and the comments and likes on them, are not listed anywhere,
+    so they are not counted either.
+    """
+    session = db.session
+    posts = db.select(Post.id).where(Post.id.in_(post_ids), Post.status == Post.PUBLISHED)
+    deltas = defaultdict(Counter)
+    for author, count in session.execute(
+        db.select(Post.user_id, db.func.count()).where(Post.id.in_(posts)).group_by(Post.user_id)
+    ):
+        deltas[author]['post_count'] += sign * count
+    for model, given, received in ((Comment, 'comment_count', 'comments_received'),
+                                   (Like, 'likes_given', 'likes_received')):
+        for user_id, count in session.execute(
+            db.select(model.user_id, db.func.count()).where(model.post_id.in_(post_ids)).group_by(model.user_id)
+        ):
+            deltas[user_id][given] += sign * count
+        for author, count in session.execute(
+            db.select(Post.user_id, db.func.count()).join(model, model.post_id == Post.id)
+            .where(Post.id.in_(post_ids)).group_by(Post.user_id)
+        ):
+            deltas[author][received] += sign * count
+    connection = session.connection()
+    for user_id, changes in deltas.items():
+        bump_user_stats(connection, user_id, **changes)
+
+    links = db.and_(PostTag.tag_id == Tag.id, PostTag.post_id.in_(posts))
+    tag_counts = db.select(db.func.count()).where(links).scalar_subquery()
+    session.execute(db.update(Tag).where(
+        Tag.id.in_(db.select(PostTag.tag_id).where(PostTag.post_id.in_(posts)))
+    ).values(post_count=Tag.post_count + sign * tag_counts))
+
+
+def refresh_last_post_at(post_ids):
+    """Recompute last_post_at for the authors of posts that just moved"""
+    authors = db.union(
+        db.select(Post.user_id).where(Post.id.in_(post_ids)),
+        db.select(archived_post.c.user_id).where(archived_post.c.id.in_(post_ids)),
+    )
+    latest = db.select(db.func.max(Post.published_at)).where(
+        Post.user_id == UserStats.user_id, Post.status == Post.PUBLISHED
+    ).scalar_subquery()
+    db.session.execute(db.update(UserStats).where(UserStats.user_id.in_(authors)).values(last_post_at=latest))
+
+
+def move_posts(post_ids, to_archive=True):
+    """Copy posts and their rows between the hot and archive tables, then delete the originals.
+
+    Plain INSERT ... SELECT and DELETE statements, so no mapper events fire and
+    the change log only records real edits; user statistics and tag counts are
+    adjusted here instead, so they only count hot rows.
+    """
+    session = db.session
+    if to_archive:
+        count_hot_rows(post_ids, -1)
+    for hot, cold, column in MOVES:
+        source, target = (hot, cold) if to_archive else (cold, hot)
+        names = [c.name for c in hot.columns]
+        rows = db.select(*[source.c[name] for name in names]).where(source.c[column].in_(post_ids))
+        if 'id' in source.c:
+            rows = rows.order_by(source.c.id)  # replies after the comments they answer
+        session.execute(target.insert().from_select(names, rows))
+    if to_archive:
+        for table in DROPPED:
+            session.execute(table.delete().where(table.c.post_id.in_(post_ids)))
+    for hot, cold, column in reversed(MOVES):
+        source = hot if to_archive else cold
+        session.execute(source.delete().where(source.c[column].in_(post_ids)))
+    if not to_archive:
+        count_hot_rows(post_ids, 1)
+    refresh_last_post_at(post_ids)
+
+
+def is_archived(post_id):
+    return db.session.execute(db.select(archived_post.c.id).where(archived_post.c.id == post_id)).first() is not None
+
+
+def restore_post(post_id):
+    """Move an archived post back into the hot tables; False if it isn't archived.
+
+    Runs in a savepoint of the caller's transaction and leaves the commit to it.
+    In a request, commit_restores commits once the view has succeeded, even if
+    the view itself had nothing to save (e.g. a rejected form).
+    """
+    if not is_archived(post_id):
+        return False
+    try:
+        with db.session.begin_nested():
+            move_posts([post_id], to_archive=False)
+    except IntegrityError:
+        # Restored by a concurrent request
+        return True
+    if has_request_context():
+        g.archive_restored = True
+    return True
+
+
+def commit_restores(response):
+    if g.pop('archive_restored', False) and response.status_code < 400:
+        db.session.commit()
+    return response
+
+
+def find_archived(model, ident):
+    """ArchiveQuery.get_or_404 hook for a Post or Comment missing from the hot tables.
+
+    Reads get a read-only ArchivedPost or ArchivedComment, so readers and crawlers
+    never move rows or make a post look active. Writes (comments, likes, edits)
+    restore the post first and get the hot row back.
+    """
+    if model is Post:
+        archived, post_id = ArchivedPost, ident
+    elif model is Comment:
+        archived = ArchivedComment
+        post_id = db.session.execute(
+            db.select(archived_comment.c.post_id).where(archived_comment.c.id == ident)
+        ).scalar()
+    else:
+        return None
+    if request.method in ('GET', 'HEAD', 'OPTIONS'):
+        return db.session.get(archived, ident)
+    if post_id is None or not restore_post(post_id):
+        return None
+    return db.session.get(model, ident)
+
+
+def find_cold_posts(after, limit):
+    """Ids of posts past ARCHIVE_AFTER_DAYS with no edits, comments, likes or views for ARCHIVE_IDLE_DAYS"""
+    now = datetime.utcnow()
+    old = now - timedelta(days=current_app.config['ARCHIVE_AFTER_DAYS'])
+    idle = now - timedelta(days=current_app.config['ARCHIVE_IDLE_DAYS'])
+
+    def active(model, column, since):
+        return db.exists().where(model.post_id == Post.id, column >= since)
+
+    query = db.session.query(Post.id).filter(
+        Post.id > after,
+        Post.status == Post.PUBLISHED,  # drafts stay where my_posts can list them
+        Post.created_at < old,
+        Post.updated_at < idle,
+        ~active(Comment, Comment.created_at, idle),
+        ~active(Like, Like.created_at, idle),
+        ~active(PostViewStats, PostViewStats.day, idle.date()),
+    ).order_by(Post.id).limit(limit)
+    # Lock the posts so a comment or like can't slip in between the copy and the delete. SQLite
+    # ignores FOR UPDATE and has no row locks; there the move's first INSERT takes the database
+    # write lock, which holds off other writers until the batch commits.
+    return [post_id for post_id, in query.with_for_update()]
+
+
+def archive_cold_posts(limit=None):
+    """Archive cold posts in batches of ARCHIVE_BATCH, one transaction per batch"""
+    batch_size = current_app.config['ARCHIVE_BATCH']
+    archived = 0
+    after = 0
+    while limit is None or archived < limit:
+        post_ids = find_cold_posts(after, batch_size if limit is None else min(batch_size, limit - archived))
+        if not post_ids:
+            db.session.rollback()
+            break
+        move_posts(post_ids)
+        db.session.commit()
+        archived += len(post_ids)
+        after = post_ids[-1]
+    return archived
+
+
+def with_archived(hot, *names):
+    """Subquery of the named columns from a hot table and its archive table together"""
+    cold = db.metadata.tables[f'archived_{hot.name}']
+    return db.union_all(
+        db.select(*[hot.c[name] for name in names]),
+        db.select(*[cold.c[name] for name in names]),
+    ).subquery()
+
+
+def purge_user(user_id):
+    """Delete a user's archived posts, comments and likes, as deleting the account does for hot rows.
+
+    Runs in the caller's transaction. Archived rows are not counted anywhere, so
+    no counters change.
+    """
+    session = db.session
+    post_ids = [post_id for post_id, in session.execute(
+        db.select(archived_post.c.id).where(archived_post.c.user_id == user_id)
+    )]
+
+    # Their comments on other posts go with every reply beneath them
+    comments = session.execute(db.select(archived_comment.c.post_id, archived_comment.c.path).where(
+        archived_comment.c.user_id == user_id, archived_comment.c.post_id.not_in(post_ids)
+    )).all()
+    doomed = set()
+    for post_id, path in comments:
+        doomed.update(comment_id for comment_id, in session.execute(db.select(archived_comment.c.id).where(
+            archived_comment.c.post_id == post_id,
+            archived_comment.c.path >= path,
+            archived_comment.c.path < Comment.path_upper_bound(path),
+        )))
+
+    session.execute(archived_comment.delete().where(archived_comment.c.id.in_(doomed)))
+    session.execute(archived_like.delete().where(
+        archived_like.c.user_id == user_id, archived_like.c.post_id.not_in(post_ids)
+    ))
+    for hot, cold, column in reversed(MOVES):
+        session.execute(cold.delete().where(cold.c[column].in_(post_ids)))
+
+
+archive_cli = AppGroup('archive', help='Move old posts between the hot and archive tables.')
+
+
+@archive_cli.command('run')
+@click.option('--limit', type=int, default=None, help='Archive at most this many posts.')
+def run_command(limit):
+    """Archive posts that are old and idle."""
+    click.echo(f'Archived {archive_cold_posts(limit)} posts')
+
+
+@archive_cli.command('restore')
+@click.argument('post_id', type=int)
+def restore_command(post_id):
+    """Move an archived post back into the hot tables."""
+    if not restore_post(post_id):
+        raise click.ClickException(f'Post {post_id} is not archived')
+    db.session.commit()
+    click.echo(f'Restored post {post_id}')
+
+
+@archive_cli.command('stats')
+def stats_command():
+    """Count hot and archived rows."""
+    for hot, cold, _ in MOVES:
+        hot_count = db.session.execute(db.select(db.func.count()).select_from(hot)).scalar()
+        cold_count = db.session.execute(db.select(db.func.count()).select_from(cold)).scalar()
+        click.echo(f'{hot.name}: {hot_count} hot, {cold_count} archived')
+
+
+def init_app(app, scheduler):
+    app.extensions['archive.find'] = find_archived
+    app.after_request(commit_restores)
+    app.cli.add_command(archive_cli)
+    scheduler.add_job('archive.run', archive_cold_posts, app.config['ARCHIVE_INTERVAL'])
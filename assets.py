@@ -0,0 +1,152 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+import click
+from flask import current_app, request, send_file
+from flask.cli import AppGroup
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip variants are always built
+    brotli = None
+
+DIST_DIR = 'dist'
+SKIP_DIRS = {DIST_DIR, 'uploads'}
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.txt', '.html'}
+
+# (Content-Encoding, file suffix) in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def minify_css(source):
+    """Conservative CSS minifier: drops comments and whitespace that cannot change meaning"""
+    source = re.sub(r'/\*.*?\*/', '', source, flags=re.S)
+    source = re.sub(r'\s+', ' ', source)
+    source = re.sub(r'\s*([{};,>])\s*', r'\1', source)
+    source = re.sub(r':\s+', ':', source)
+    return source.replace(';}', '}').strip()
+
+
+MINIFIERS = {'.css': minify_css}
+
+
+def iter_sources(static_folder):
+    for root, dirs, files in os.walk(static_folder):
+        if root == static_folder:
+            dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+        for name in files:
+            path = os.path.join(root, name)
+            yield os.path.relpath(path, static_folder).replace(os.sep, '/'), path
+
+
+def build(static_folder):
+    """Minify, fingerprint and precompress every static file; returns the manifest"""
+    dist = os.path.join(static_folder, DIST_DIR)
+    manifest = {}
+    for name, path in iter_sources(static_folder):
+        base, ext = os.path.splitext(name)
+        with open(path, 'rb') as f:
+            content = f.read()
+        if ext in MINIFIERS:
+            content = MINIFIERS[ext](content.decode('utf-8')).encode('utf-8')
+
+        hashed = f'{base}.{hashlib.sha256(content).hexdigest()[:12]}{ext}'
+        manifest[name] = hashed
+        target = os.path.join(dist, hashed)
+        if os.path.exists(target):
+            continue
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        _write(target, content)
+        if ext in COMPRESSIBLE_EXTENSIONS:
+            _write(target + '.gz', gzip.compress(content, compresslevel=9, mtime=0))
+            if brotli is not None:
+                _write(target + '.br', brotli.compress(content, quality=11))
+
+    _write(os.path.join(dist, 'manifest.json'), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+def _write(path, content):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def load_manifest(static_folder):
+    try:
+        with open(os.path.join(static_folder, DIST_DIR, 'manifest.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+class Assets:
+    def __init__(self, app=None):
+        self.manifest = {}
+        self.hashed = set()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['assets'] = self
+        app.cli.add_command(assets_cli)
+
+        if app.config.get('ASSETS_BUILD_ON_STARTUP'):
+            self.set_manifest(build(app.static_folder))
+        else:
+            self.set_manifest(load_manifest(app.static_folder))
+
+        self.max_age = app.config['ASSETS_MAX_AGE']
+        self.fallback = app.view_functions['static']
+        app.view_functions['static'] = self.send_static_file
+        app.url_defaults(self.rewrite_static_url)
+
+    def set_manifest(self, manifest):
+        self.manifest = manifest
+        self.hashed = {f'{DIST_DIR}/{hashed}' for hashed in manifest.values()}
+
+    def rewrite_static_url(self, endpoint, values):
+        """Make url_for('static', filename=...) point at the fingerprinted copy"""
+        if endpoint == 'static' and values.get('filename') in self.manifest:
+            values['filename'] = f"{DIST_DIR}/{self.manifest[values['filename']]}"
+
+    def send_static_file(self, filename):
+        if filename not in self.hashed:
+            return self.fallback(filename=filename)
+
+        path = os.path.join(current_app.static_folder, filename)
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        encoding = None
+        for name, suffix in ENCODINGS:
+            if request.accept_encodings[name] and os.path.exists(path + suffix):
+                path, encoding = path + suffix, name
+                break
+
+        response = send_file(path, mimetype=content_type, max_age=self.max_age, etag=False)
+        if encoding:
+            response.content_encoding = encoding
+        response.set_etag(f'{filename}-{encoding or "identity"}')
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response.make_conditional(request)
+
+
+assets = Assets()
+
+assets_cli = AppGroup('assets', help='Build fingerprinted, precompressed static assets.')
+
+
+@assets_cli.command('build')
+def build_command():
+    """Write static/dist and its manifest (run at deploy time)."""
+    manifest = build(current_app.static_folder)
+    assets.set_manifest(manifest)
+    for name, hashed in sorted(manifest.items()):
+        click.echo(f'{name} -> {DIST_DIR}/{hashed}')
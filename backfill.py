@@ -0,0 +1,192 @@
+"""Chunked, resumable data changes for tables too large to rewrite in one transaction.
+
+A schema change that needs new data rolls out in three steps: a migration adds
+the column as nullable (cheap), a Backfill fills it in short primary-key-ordered
+transactions while the site keeps serving, and a later migration adds the
+constraint. Each chunk commits together with its checkpoint, so an interrupted
+backfill resumes where it stopped and never applies a chunk twice.
+"""
+import logging
+import time
+from datetime import datetime
+
+import click
+from flask import current_app, has_app_context
+from flask.cli import AppGroup
+from sqlalchemy.exc import IntegrityError
+
+from models import db, JobCheckpoint
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BACKFILL_BATCH_SIZE': 1000,
+    'BACKFILL_THROTTLE': 1.0,
+    'BACKFILL_REPORT_INTERVAL': 10,
+}
+
+BACKFILLS = {}
+
+
+def _setting(name, value):
+    if value is not None:
+        return value
+    return current_app.config[name] if has_app_context() else DEFAULTS[name]
+
+
+class Backfill:
+    """Applies apply(connection, low, high) to rows with low < key <= high, one chunk at a time.
+
+    The key must be an integer column, normally the primary key. Chunks hold
+    batch_size rows; after each one the runner sleeps `throttle` times as long
+    as the chunk took, so 1.0 leaves the database idle half the time.
+    """
+
+    def __init__(self, name, table, apply, key='id'):
+        self.name = name
+        self.table = table
+        self.apply = apply
+        self.key = table.c[key]
+
+    @classmethod
+    def update(cls, name, table, values, *where, key='id'):
+        """Backfill that runs one UPDATE table SET values per chunk"""
+        def apply(connection, low, high):
+            column = table.c[key]
+            connection.execute(table.update().where(column > low, column <= high, *where).values(values))
+        return cls(name, table, apply, key)
+
+    @property
+    def checkpoint_name(self):
+        return f'backfill.{self.name}'
+
+    def position(self, connection):
+        checkpoints = JobCheckpoint.__table__
+        position = connection.execute(
+            db.select(checkpoints.c.position).where(checkpoints.c.name == self.checkpoint_name)
+        ).scalar()
+        if position is None:
+            try:
+                with connection.begin_nested():
+                    connection.execute(checkpoints.insert().values(
+                        name=self.checkpoint_name, position=0, updated_at=datetime.utcnow()
+                    ))
+            except IntegrityError:
+                # Created by a concurrent runner
+                return self.position(connection)
+            position = 0
+        return position
+
+    def reset(self, connection):
+        checkpoints = JobCheckpoint.__table__
+        connection.execute(checkpoints.delete().where(checkpoints.c.name == self.checkpoint_name))
+
+    def run(self, engine, batch_size=None, throttle=None, report=None, restart=False):
+        """Process every row after the checkpoint; returns the number of rows processed"""
+        batch_size = _setting('BACKFILL_BATCH_SIZE', batch_size)
+        throttle = _setting('BACKFILL_THROTTLE', throttle)
+        report_interval = _setting('BACKFILL_REPORT_INTERVAL', None)
+        report = report or logger.info
+        checkpoints = JobCheckpoint.__table__
+
+        with engine.begin() as connection:
+            if restart:
+                self.reset(connection)
+            position = self.position(connection)
+            total = connection.execute(
+                db.select(db.func.count()).select_from(self.table).where(self.key > position)
+            ).scalar()
+
+        done = reported = 0
+        started = last_report = time.monotonic()
+        while True:
+            chunk_started = time.monotonic()
+            with engine.begin() as connection:
+                keys = connection.execute(
+                    db.select(self.key).where(self.key > position).order_by(self.key).limit(batch_size)
+                ).scalars().all()
+                if not keys:
+                    break
+                self.apply(connection, position, keys[-1])
+                claimed = connection.execute(checkpoints.update().where(
+                    checkpoints.c.name == self.checkpoint_name, checkpoints.c.position == position
+                ).values(position=keys[-1], updated_at=datetime.utcnow())).rowcount
+                if not claimed:
+                    # Another runner moved the checkpoint; let it finish
+                    connection.rollback()
+                    report(f'{self.name}: checkpoint moved by another runner, stopping')
+                    break
+            position = keys[-1]
+            done += len(keys)
+
+            now = time.monotonic()
+            if now - last_report >= report_interval:
+                report(self.progress(done, total, now - started, position))
+                last_report, reported = now, done
+            if len(keys) < batch_size:
+                break
+            if throttle:
+                time.sleep((now - chunk_started) * throttle)
+
+        if reported < done or not done:
+            report(self.progress(done, max(total, done), time.monotonic() - started, position))
+        return done
+
+    def progress(self, done, total, elapsed, position):
+        rate = done / elapsed if elapsed else 0
+        percent = 100 * done / total if total else 100
+        left = f', about {(total - done) / rate:.0f}s left' if rate and total > done else ''
+        return f'{self.name}: {done}/{total} rows ({percent:.0f}%) up to key {position}, {rate:.0f} rows/s{left}'
+
+
+def register(backfill):
+    BACKFILLS[backfill.name] = backfill
+    return backfill
+
+
+def run_in_migration(backfill, **options):
+    """Run a backfill from an Alembic upgrade().
+
+    The migration's transaction is committed first, so the schema change is
+    visible and no lock is held while the chunks run in their own transactions.
+    """
+    from alembic import op
+    with op.get_context().autocommit_block():
+        return backfill.run(op.get_bind().engine, **options)
+
+
+backfill_cli = AppGroup('backfill', help='Run chunked, resumable data backfills.')
+
+
+@backfill_cli.command('run')
+@click.argument('name')
+@click.option('--batch-size', type=int, default=None, help='Rows per transaction (default BACKFILL_BATCH_SIZE).')
+@click.option('--throttle', type=float, default=None,
+              help='Sleep this many times as long as each chunk took (default BACKFILL_THROTTLE).')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint and start from the first row.')
+def run_command(name, batch_size, throttle, restart):
+    """Run the backfill NAME from its checkpoint."""
+    if name not in BACKFILLS:
+        raise click.ClickException(f'Unknown backfill {name}; choose from {", ".join(sorted(BACKFILLS))}')
+    BACKFILLS[name].run(db.engine, batch_size, throttle, report=click.echo, restart=restart)
+
+
+@backfill_cli.command('status')
+def status_command():
+    """Show how far each backfill has got."""
+    checkpoints = {checkpoint.name: checkpoint for checkpoint in JobCheckpoint.query.filter(
+        JobCheckpoint.name.startswith('backfill.')
+    )}
+    for name, backfill in sorted(BACKFILLS.items()):
+        checkpoint = checkpoints.get(backfill.checkpoint_name)
+        if checkpoint is None:
+            click.echo(f'{name}: not started')
+            continue
+        remaining = db.session.execute(
+            db.select(db.func.count()).select_from(backfill.table).where(backfill.key > checkpoint.position)
+        ).scalar()
+        click.echo(f'{name}: at key {checkpoint.position} ({checkpoint.updated_at:%Y-%m-%d %H:%M}), {remaining} rows after it')
+
+
+def init_app(app):
+    app.cli.add_command(backfill_cli)
@@ -0,0 +1,57 @@
+"""Measure cold start: interpreter launch -> import app -> first response.
+
+Each run is a fresh process, so it sees what a new worker sees. Run once with
+an empty template cache and once after 'flask templates compile' to compare.
+
+    python benchmarks/startup.py --runs 10 --path /about
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import app as module
+imported = time.perf_counter()
+application = module.app
+created = time.perf_counter()
+response = application.test_client().get(sys.argv[1])
+done = time.perf_counter()
+print(json.dumps({
+    "status": response.status_code,
+    "import": imported - start,
+    "create_app": created - imported,
+    "first_response": done - created,
+    "total": done - start,
+}))
+'''
+
+
+def run_once(path):
+    result = subprocess.run(
+        [sys.executable, '-c', PROBE, path], cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default='/about')
+    args = parser.parse_args()
+
+    samples = [run_once(args.path) for _ in range(args.runs)]
+    for key in ('import', 'create_app', 'first_response', 'total'):
+        values = [sample[key] * 1000 for sample in samples]
+        print(f'{key:>15}: median {statistics.median(values):8.1f} ms  min {min(values):8.1f} ms')
+    print(f'{"status":>15}: {sorted({sample["status"] for sample in samples})}')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,9 @@ from flask import render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, current_user, login_required
 from blueprints.auth import bp
 from models import db, User
+import archive
+import feed
+import sessions
 from blueprints.auth.forms import LoginForm, RegistrationForm, EditProfileForm, ChangePasswordForm, DeleteAccountForm
 
 @bp.route('/login', methods=['GET', 'POST'])
@@ -43,10 +46,9 @@ def register():
 @bp.route('/profile')
 @login_required
 def profile():
-    from models import Post
-    post_count = current_user.posts.count()
-    recent_posts = current_user.posts.order_by(Post.created_at.desc()).limit(3).all()
-    return render_template('auth/profile.html', title='Profile', user=current_user, post_count=post_count, recent_posts=recent_posts)
+    recent_posts = current_user.get_recent_posts(3)
+    return render_template('auth/profile.html', title='Profile', user=current_user,
+                           stats=current_user.get_stats(), recent_posts=recent_posts)
 
 @bp.route('/edit_profile', methods=['GET', 'POST'])
 @login_required
@@ -94,6 +96,7 @@ def change_password():
         if current_user.check_password(form.current_password.data):
             current_user.set_password(form.new_password.data)
             db.session.commit()
+            sessions.revoke_user_sessions(current_user.id, keep_current=True)
             flash('Your password has been changed successfully.', 'success')
             return redirect(url_for('auth.profile'))
         else:
@@ -109,12 +112,19 @@ def delete_account():
         if (form.confirm_username.data == current_user.username and 
             current_user.check_password(form.password.data)):
             
-            # Delete user's posts first
-            current_user.posts.delete()
+            # Delete user's follows, timeline entries and posts first; posts are deleted
+            # one by one so their comments and likes cascade and reach the change log
+            user_id = current_user.id
+            feed.remove_user(current_user)
+            for post in current_user.posts:
+                db.session.delete(post)
+            archive.purge_user(user_id)
             
-            # Delete the user
+            # Delete the user and end all of their sessions
             db.session.delete(current_user)
             db.session.commit()
+            sessions.revoke_user_sessions(user_id)
+            logout_user()
             
             flash('Your account has been deleted successfully.', 'info')
             return redirect(url_for('main.index'))
@@ -133,10 +143,35 @@ def public_profile(username):
         return redirect(url_for('main.index'))
     
     recent_posts = user.get_recent_posts(5)
-    post_count = user.get_post_count()
     
     return render_template('auth/public_profile.html', title=f'{user.full_name} - Profile', 
-                         user=user, recent_posts=recent_posts, post_count=post_count)
+                         user=user, recent_posts=recent_posts, stats=user.get_stats())
+
+@bp.route('/follow/<username>', methods=['POST'])
+@login_required
+def follow(username):
+    user = User.query.filter_by(username=username).first_or_404()
+    
+    if user == current_user:
+        flash('You cannot follow yourself!', 'error')
+    elif current_user.follow(user):
+        feed.add_author(current_user, user)
+        db.session.commit()
+        flash(f'You are now following {user.username}.', 'success')
+    
+    return redirect(url_for('auth.public_profile', username=username))
+
+@bp.route('/unfollow/<username>', methods=['POST'])
+@login_required
+def unfollow(username):
+    user = User.query.filter_by(username=username).first_or_404()
+    
+    if current_user.unfollow(user):
+        feed.remove_author(current_user, user)
+        db.session.commit()
+        flash(f'You have unfollowed {user.username}.', 'info')
+    
+    return redirect(url_for('auth.public_profile', username=username))
 
 @bp.route('/logout')
 def logout():
@@ -1,39 +1,142 @@
-from flask import render_template, redirect, url_for, flash, request, jsonify
+import os
+from flask import render_template, redirect, url_for, flash, request, jsonify, current_app, abort, send_file
 from flask_login import login_required, current_user
 from blueprints.blog import bp
-from models import db, Post, Comment, Like
+from models import db, Post, Comment, Like, Tag
 from forms import PostForm, SearchForm, CommentForm, ReplyForm, EditCommentForm
+import trending as trending_scores
+import feed
+import uploads
+import typeahead
+import analytics
+import revisions
+import tags
+import publishing
 
 @bp.route('/')
 def index():
     page = request.args.get('page', 1, type=int)
-    posts = Post.query.order_by(Post.created_at.desc()).paginate(
+    posts = Post.query.filter(publishing.published()).order_by(Post.published_at.desc()).paginate(
         page=page, per_page=5, error_out=False
     )
     return render_template('blog/index.html', title='Blog Posts', posts=posts)
 
+@bp.route('/trending')
+def trending():
+    try:
+        posts, next_cursor = trending_scores.get_trending_page(request.args.get('after'),
+                                                               current_app.config['POSTS_PER_PAGE'])
+    except ValueError:
+        abort(400)
+    return render_template('blog/trending.html', title='Trending Posts', posts=posts, next_cursor=next_cursor)
+
 @bp.route('/create', methods=['GET', 'POST'])
 @login_required
 def create():
     form = PostForm()
     if form.validate_on_submit():
-        post = Post(title=form.title.data, content=form.content.data, user_id=current_user.id)
+        post = Post(title=form.title.data, content=form.content.data, user_id=current_user.id,
+                    allow_comments=form.allow_comments.data)
+        publish_now = publishing.apply_form(post, form)
+        if form.attachment.data:
+            post.attachments.append(uploads.store_upload(form.attachment.data))
         db.session.add(post)
+        revisions.record_revision(post)
+        tags.set_post_tags(post, tags.parse_tags(form.tags.data))
+        db.session.flush()
+        if publish_now:
+            feed.fan_out(post)
         db.session.commit()
         
-        flash('Your post has been created!', 'success')
-        return redirect(url_for('blog.index'))
+        if post.status == Post.SCHEDULED:
+            flash(f'Your post is scheduled for {post.published_at:%B %d, %Y at %H:%M} UTC.', 'success')
+        elif post.status == Post.DRAFT:
+            flash('Your draft has been saved.', 'success')
+        else:
+            flash('Your post has been created!', 'success')
+            return redirect(url_for('blog.index'))
+        return redirect(url_for('blog.my_posts'))
     
     return render_template('blog/create.html', title='Create Post', form=form)
 
 @bp.route('/post/<int:id>')
 def post(id):
-    post = Post.query.get_or_404(id)
+    post = publishing.get_visible_post_or_404(id)
+    # Archived posts stay write-free; a view would also count as activity and keep them from being archived again
+    if not post.archived:
+        analytics.record_view(post.id)
     comment_form = CommentForm()
     reply_form = ReplyForm()
-    comments = post.get_top_level_comments()
+    # Only the first page of comments is rendered inline, the rest is fetched from post_comments
+    comments, next_cursor = post.get_comments_page(limit=current_app.config['COMMENTS_PER_PAGE'])
+    reply_previews = Comment.get_reply_previews(comments, current_app.config['REPLIES_PREVIEW_COUNT'])
     return render_template('blog/post.html', title=post.title, post=post, 
-                         comments=comments, comment_form=comment_form, reply_form=reply_form)
+                         comments=comments, reply_previews=reply_previews, next_cursor=next_cursor,
+                         comment_form=comment_form, reply_form=reply_form)
+
+@bp.route('/post/<int:id>/comments')
+def post_comments(id):
+    """API endpoint returning a page of top-level comments after the given cursor"""
+    post = publishing.get_visible_post_or_404(id)
+    limit = min(request.args.get('limit', current_app.config['COMMENTS_PER_PAGE'], type=int),
+                current_app.config['COMMENTS_PER_PAGE'])
+    try:
+        comments, next_cursor = post.get_comments_page(request.args.get('after'), max(limit, 1))
+    except ValueError:
+        abort(400)
+    reply_previews = Comment.get_reply_previews(comments, current_app.config['REPLIES_PREVIEW_COUNT'])
+    
+    return jsonify({
+        'post_id': post.id,
+        'comments': [
+            dict(comment.to_dict(),
+                 reply_count=reply_previews[comment.id]['count'],
+                 replies=[reply.to_dict() for reply in reply_previews[comment.id]['replies']])
+            for comment in comments
+        ],
+        'next_cursor': next_cursor,
+        'html': render_template('blog/comment_list.html', comments=comments, reply_previews=reply_previews)
+    })
+
+@bp.route('/comment/<int:comment_id>/replies')
+def comment_replies(comment_id):
+    """API endpoint returning a page of a comment's reply thread after the given cursor"""
+    comment = Comment.query.get_or_404(comment_id)
+    try:
+        replies, next_cursor = comment.get_descendants_page(request.args.get('after'),
+                                                            current_app.config['COMMENTS_PER_PAGE'])
+    except ValueError:
+        abort(400)
+    
+    return jsonify({
+        'comment_id': comment.id,
+        'replies': [reply.to_dict() for reply in replies],
+        'next_cursor': next_cursor,
+        'html': render_template('blog/reply_list.html', replies=replies)
+    })
+
+@bp.route('/uploads/<filename>')
+def uploaded_file(filename):
+    """Serve a content-addressed upload; the name changes whenever the content does"""
+    match = uploads.FILENAME_RE.match(filename)
+    if not match:
+        abort(404)
+    sha256, variant, ext = match.group('sha256', 'variant', 'ext')
+    path = uploads.upload_path(sha256, ext, variant)
+    immutable = True
+    if variant and not os.path.exists(path):
+        # Resized copy not generated (yet), fall back to the original without long caching
+        path = uploads.upload_path(sha256, ext)
+        immutable = False
+    if not os.path.exists(path):
+        abort(404)
+    
+    response = send_file(path, max_age=31536000 if immutable else 60, etag=False)
+    response.set_etag(filename)
+    response.cache_control.public = True
+    response.cache_control.immutable = immutable
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response.make_conditional(request)
 
 @bp.route('/post/<int:id>/edit', methods=['GET', 'POST'])
 @login_required
@@ -48,6 +151,16 @@ def edit(id):
     if form.validate_on_submit():
         post.title = form.title.data
         post.content = form.content.data
+        post.allow_comments = form.allow_comments.data
+        if form.attachment.data:
+            upload = uploads.store_upload(form.attachment.data)
+            if upload not in post.attachments:
+                post.attachments.append(upload)
+        revisions.record_revision(post)
+        tags.set_post_tags(post, tags.parse_tags(form.tags.data))
+        # Published posts stay published; the form only shows the publishing fields before that
+        if not post.is_published and publishing.apply_form(post, form):
+            publishing.publish(post)
         db.session.commit()
         
         flash('Your post has been updated!', 'success')
@@ -55,9 +168,57 @@ def edit(id):
     elif request.method == 'GET':
         form.title.data = post.title
         form.content.data = post.content
+        form.tags.data = ', '.join(tag.name for tag in post.tags)
+        form.allow_comments.data = post.allow_comments
+        form.is_published.data = post.is_published
+        if post.status == Post.SCHEDULED:
+            form.publish_at.data = post.published_at
     
     return render_template('blog/edit.html', title='Edit Post', form=form, post=post)
 
+@bp.route('/post/<int:id>/history')
+@login_required
+def history(id):
+    post = Post.query.get_or_404(id)
+    if post.author != current_user:
+        abort(403)
+    page = request.args.get('page', 1, type=int)
+    revision_model = revisions.revision_model(post)
+    revisions_page = post.revisions.order_by(revision_model.number.desc()).paginate(
+        page=page, per_page=20, error_out=False
+    )
+    return render_template('blog/history.html', title='Post History', post=post, revisions=revisions_page)
+
+@bp.route('/post/<int:id>/revisions/<int:number>')
+@login_required
+def revision(id, number):
+    post = Post.query.get_or_404(id)
+    if post.author != current_user:
+        abort(403)
+    current = post.revisions.filter_by(number=number).first_or_404()
+    against = request.args.get('against', type=int)
+    if against is None:
+        revision_model = revisions.revision_model(post)
+        older = post.revisions.filter(revision_model.number < number).order_by(revision_model.number.desc()).first()
+    else:
+        older = post.revisions.filter_by(number=against).first_or_404()
+    
+    content = revisions.revision_content(current)
+    diff = revisions.diff_lines(revisions.revision_content(older), content) if older else None
+    return render_template('blog/revision.html', title=f'Revision {number}', post=post,
+                           revision=current, older=older, content=content, diff=diff)
+
+@bp.route('/post/<int:id>/publish', methods=['POST'])
+@login_required
+def publish(id):
+    post = Post.query.get_or_404(id)
+    if post.author != current_user:
+        abort(403)
+    if publishing.publish(post):
+        db.session.commit()
+        flash('Your post has been published!', 'success')
+    return redirect(url_for('blog.post', id=id))
+
 @bp.route('/post/<int:id>/delete', methods=['POST'])
 @login_required
 def delete(id):
@@ -85,16 +246,20 @@ def my_posts():
 @bp.route('/search')
 def search():
     query = request.args.get('q', '').strip()
+    tag_names = list(dict.fromkeys(filter(None, map(tags.normalize, request.args.getlist('tag')))))
     page = request.args.get('page', 1, type=int)
     
-    if query:
-        # Search in both title and content
-        posts = Post.query.filter(
-            db.or_(
-                Post.title.contains(query),
-                Post.content.contains(query)
+    if query or tag_names:
+        posts = Post.query.filter(publishing.published())
+        if query:
+            # Search in both title and content
+            posts = posts.filter(
+                db.or_(
+                    Post.title.contains(query),
+                    Post.content.contains(query)
+                )
             )
-        ).order_by(Post.created_at.desc()).paginate(
+        posts = tags.filter_by_tags(posts, tag_names).order_by(Post.published_at.desc()).paginate(
             page=page, per_page=5, error_out=False
         )
     else:
@@ -104,16 +269,44 @@ def search():
         )
     
     return render_template('blog/search.html', title='Search Results', 
-                         posts=posts, query=query)
+                         posts=posts, query=query, tag_names=tag_names)
+
+@bp.route('/tags')
+def tag_index():
+    cloud = tags.tag_cloud(current_app.config['TAG_CLOUD_SIZE'])
+    return render_template('blog/tags.html', title='Tags', cloud=cloud)
+
+@bp.route('/tag/<name>')
+def tag(name):
+    tag = Tag.query.filter_by(name=name).first_or_404()
+    try:
+        posts, next_cursor = tags.get_tag_page(tag, request.args.get('after'), current_app.config['POSTS_PER_PAGE'])
+    except ValueError:
+        abort(400)
+    return render_template('blog/tag.html', title=f'Posts tagged {tag.name}', tag=tag,
+                           posts=posts, next_cursor=next_cursor)
+
+@bp.route('/autocomplete')
+def autocomplete():
+    """Typeahead suggestions: posts and users whose title or username has a word starting with q"""
+    query = request.args.get('q', '').strip()
+    limit = min(request.args.get('limit', current_app.config['TYPEAHEAD_RESULTS'], type=int), typeahead.MAX_RESULTS)
+    results = []
+    for kind, id, label in typeahead.search(query, limit):
+        url = url_for('blog.post', id=id) if kind == 'post' else url_for('auth.public_profile', username=label)
+        results.append({'type': kind, 'id': id, 'label': label, 'url': url})
+    return jsonify({'query': query, 'results': results})
 
 # Comment Routes
 @bp.route('/post/<int:post_id>/comment', methods=['POST'])
 @login_required
 def add_comment(post_id):
-    post = Post.query.get_or_404(post_id)
+    post = publishing.get_visible_post_or_404(post_id)
     form = CommentForm()
     
-    if form.validate_on_submit():
+    if not post.is_published or not post.allow_comments:
+        flash('Comments are closed for this post.', 'error')
+    elif form.validate_on_submit():
         comment = Comment(
             content=form.content.data,
             user_id=current_user.id,
@@ -135,7 +328,9 @@ def add_reply(comment_id):
     parent_comment = Comment.query.get_or_404(comment_id)
     form = ReplyForm()
     
-    if form.validate_on_submit():
+    if not parent_comment.post.allow_comments:
+        flash('Comments are closed for this post.', 'error')
+    elif form.validate_on_submit():
         reply = Comment(
             content=form.content.data,
             user_id=current_user.id,
@@ -187,7 +382,7 @@ def delete_comment(comment_id):
     post_id = comment.post_id
     
     # If comment has replies, replace content with deletion message
-    if comment.get_replies_count() > 0:
+    if comment.has_descendants():
         comment.content = "[This comment has been deleted]"
         comment.updated_at = db.func.now()
         db.session.commit()
@@ -205,6 +400,8 @@ def delete_comment(comment_id):
 @login_required
 def like_post(post_id):
     post = Post.query.get_or_404(post_id)
+    if not post.is_published:
+        abort(404)
     
     if current_user.has_liked_post(post):
         # Unlike the post
@@ -234,7 +431,7 @@ def like_post(post_id):
 @bp.route('/post/<int:post_id>/like-status')
 def like_status(post_id):
     """API endpoint to get like status for a post"""
-    post = Post.query.get_or_404(post_id)
+    post = publishing.get_visible_post_or_404(post_id)
     
     return jsonify({
         'like_count': post.get_like_count(),
@@ -1,11 +1,52 @@
-from flask import render_template
+from flask import render_template, request, current_app, abort, url_for
+from flask_login import current_user
 from blueprints.main import bp
+from models import User
+import feed
+import syndication
 
 @bp.route('/')
 @bp.route('/index')
 def index():
-    return render_template('index.html', title='Home')
+    if not current_user.is_authenticated:
+        return render_template('index.html', title='Home')
+    
+    try:
+        posts, next_cursor = feed.get_feed_page(current_user, request.args.get('after'),
+                                                current_app.config['POSTS_PER_PAGE'])
+    except ValueError:
+        abort(400)
+    return render_template('index.html', title='Home', posts=posts, next_cursor=next_cursor)
 
 @bp.route('/about')
 def about():
     return render_template('about.html', title='About')
+
+# Feeds and sitemaps
+@bp.route('/feed.<any(atom, rss):kind>')
+def site_feed(kind):
+    return syndication.feed_response(kind, 'Latest posts', url_for('main.site_feed', kind=kind, _external=True))
+
+@bp.route('/author/<username>/feed.<any(atom, rss):kind>')
+def author_feed(username, kind):
+    user = User.query.filter_by(username=username).first_or_404()
+    if not user.profile_public:
+        abort(404)
+    return syndication.feed_response(kind, f'Posts by {user.username}',
+                                     url_for('main.author_feed', username=username, kind=kind, _external=True),
+                                     author=user)
+
+@bp.route('/sitemap.xml')
+def sitemap():
+    return syndication.sitemap_index_response()
+
+@bp.route('/sitemaps/pages.xml')
+def sitemap_pages():
+    return syndication.sitemap_pages_response()
+
+@bp.route('/sitemaps/posts-<int:shard>.xml')
+def sitemap_posts(shard):
+    response = syndication.sitemap_shard_response(shard)
+    if response is None:
+        abort(404)
+    return response
@@ -0,0 +1,85 @@
+import json
+from datetime import datetime, timedelta
+
+import click
+from flask import abort, current_app, jsonify, request
+from flask.cli import AppGroup
+
+from models import db, ChangeLog
+
+ENTITIES = ('post', 'comment', 'like')
+
+
+def get_changes(since=0, limit=100, entities=None):
+    """Changes with an id greater than `since`, oldest first, and the cursor to read from next.
+
+    Ids are handed out in commit order on SQLite, where writers are serialized;
+    on a database with concurrent writers a consumer should stay a few seconds
+    behind the head to avoid skipping a transaction that commits late.
+    """
+    query = ChangeLog.query.filter(ChangeLog.id > since)
+    if entities:
+        query = query.filter(ChangeLog.entity.in_(entities))
+    changes = query.order_by(ChangeLog.id).limit(limit).all()
+    return changes, changes[-1].id if changes else since
+
+
+def iter_changes(since=0, entities=None, batch_size=500):
+    """Yield every change after `since` in id order, one batch query at a time"""
+    while True:
+        changes, since = get_changes(since, batch_size, entities)
+        yield from changes
+        if len(changes) < batch_size:
+            return
+
+
+def prune_changes(older_than):
+    deleted = ChangeLog.query.filter(ChangeLog.created_at < older_than).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def prune_expired():
+    days = current_app.config['CHANGE_LOG_RETENTION_DAYS']
+    return prune_changes(datetime.utcnow() - timedelta(days=days))
+
+
+def changes_view():
+    token = current_app.config['CHANGES_API_TOKEN']
+    # Closed unless a token is configured: the log mirrors every post, comment and like
+    if not token or request.headers.get('Authorization') != f'Bearer {token}':
+        abort(403)
+    since = request.args.get('since', 0, type=int)
+    limit = min(request.args.get('limit', 100, type=int), current_app.config['CHANGES_API_MAX_LIMIT'])
+    entities = [entity for entity in request.args.getlist('entity') if entity in ENTITIES]
+
+    changes, next_since = get_changes(since, limit, entities)
+    return jsonify({
+        'changes': [change.to_dict() for change in changes],
+        'next': next_since,
+        'has_more': len(changes) == limit,
+    })
+
+
+changes_cli = AppGroup('changes', help='Inspect and prune the change log.')
+
+
+@changes_cli.command('tail')
+@click.option('--since', type=int, default=0)
+@click.option('--entity', 'entities', multiple=True, type=click.Choice(ENTITIES))
+def tail_command(since, entities):
+    """Print changes after SINCE as JSON lines."""
+    for change in iter_changes(since, entities):
+        click.echo(json.dumps(change.to_dict()))
+
+
+@changes_cli.command('prune')
+def prune_command():
+    """Delete changes older than CHANGE_LOG_RETENTION_DAYS."""
+    click.echo(f'Deleted {prune_expired()} changes')
+
+
+def init_app(app, scheduler):
+    app.add_url_rule('/api/changes', 'changes', changes_view)
+    app.cli.add_command(changes_cli)
+    scheduler.add_job('changes.prune', prune_expired, app.config['CHANGE_LOG_PRUNE_INTERVAL'])
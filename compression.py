@@ -0,0 +1,146 @@
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict
+
+from flask import request
+from werkzeug.wsgi import ClosingIterator
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+
+class CompressedCache:
+    """LRU of compressed bodies keyed by (encoding, hash of the uncompressed body), bounded in bytes"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class Compress:
+    """Negotiated gzip/brotli compression of dynamic responses"""
+
+    def __init__(self, app=None):
+        self.cache = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['compress'] = self
+        self.min_size = app.config['COMPRESS_MIN_SIZE']
+        self.mimetypes = set(app.config['COMPRESS_MIMETYPES'])
+        self.gzip_level = app.config['COMPRESS_LEVEL']
+        self.brotli_quality = app.config['COMPRESS_BROTLI_QUALITY']
+        self.cache = CompressedCache(app.config['COMPRESS_CACHE_BYTES'])
+        app.after_request(self.compress_response)
+
+    def choose_encoding(self):
+        accept = request.accept_encodings
+        if brotli is not None and accept['br']:
+            return 'br'
+        if accept['gzip']:
+            return 'gzip'
+        return None
+
+    def compressor(self, encoding):
+        if encoding == 'br':
+            return brotli.Compressor(quality=self.brotli_quality)
+        return zlib.compressobj(self.gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, body, encoding):
+        compressor = self.compressor(encoding)
+        if encoding == 'br':
+            return compressor.process(body) + compressor.finish()
+        return compressor.compress(body) + compressor.flush()
+
+    def stream(self, chunks, encoding):
+        """Compress a streamed body chunk by chunk, flushing so each chunk reaches the client"""
+        compressor = self.compressor(encoding)
+        for chunk in chunks:
+            if encoding == 'br':
+                data = compressor.process(chunk) + compressor.flush()
+            else:
+                data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.finish() if encoding == 'br' else compressor.flush()
+
+    def should_compress(self, response):
+        return (
+            request.method != 'HEAD'
+            and 200 <= response.status_code < 300
+            and response.status_code not in (204, 206)
+            and 'Content-Encoding' not in response.headers
+            and response.mimetype in self.mimetypes
+            # send_file responses (static files, uploads) are either precompressed or not worth it
+            and not response.direct_passthrough
+        )
+
+    def compress_response(self, response):
+        if not self.should_compress(response):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = self.choose_encoding()
+        if encoding is None:
+            return response
+        if not response.is_streamed and len(response.get_data()) < self.min_size:
+            return response
+
+        etag, weak = response.get_etag()
+        if etag:
+            # Each encoding is its own representation with its own tag. The view compared If-None-Match
+            # against the bare tag, so a client sending back the tag it was given is answered here.
+            response.set_etag(f'{etag}-{encoding}', weak)
+            response.make_conditional(request)
+            if response.status_code == 304:
+                return response
+
+        if response.is_streamed:
+            original = response.response
+            chunks = response.iter_encoded()
+            response.response = ClosingIterator(self.stream(chunks, encoding), getattr(original, 'close', None))
+            response.headers.pop('Content-Length', None)
+        else:
+            body = response.get_data()
+            # Hashing is far cheaper than compressing, so identical pages are compressed once
+            key = (encoding, hashlib.sha1(body).digest())
+            compressed = self.cache.get(key)
+            if compressed is None:
+                compressed = self.compress(body, encoding)
+                self.cache.put(key, compressed)
+            response.set_data(compressed)
+
+        response.content_encoding = encoding
+        return response
+
+
+compress = Compress()
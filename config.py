@@ -11,6 +11,23 @@ class Config:
     POSTS_PER_PAGE = 5
     USERS_PER_PAGE = 10
     COMMENTS_PER_PAGE = 10
+    REPLIES_PREVIEW_COUNT = 3  # Replies shown under each comment before "show more"
+    
+    # Background jobs
+    SCHEDULER_ENABLED = True
+    
+    # Trending settings
+    TRENDING_HALF_LIFE_HOURS = 24
+    TRENDING_LIKE_WEIGHT = 1.0
+    TRENDING_COMMENT_WEIGHT = 2.0
+    TRENDING_UPDATE_INTERVAL = 60  # seconds between incremental score updates
+    TRENDING_REBUILD_INTERVAL = 24 * 3600  # full rebuild drops activity from unlikes and deletions
+    TRENDING_BATCH_SIZE = 1000
+    TRENDING_WINDOW_DAYS = 14  # activity older than this is ignored by full rebuilds
+    
+    # Home feed settings
+    FEED_FANOUT_LIMIT = 1000  # authors with more followers are merged in at read time instead
+    FEED_BACKFILL_POSTS = 20  # recent posts copied into a timeline when following someone
     
     # Blog settings
     MAX_POST_TITLE_LENGTH = 200
@@ -20,10 +37,149 @@ class Config:
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'uploads')
     ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif'}
+    UPLOAD_IMAGE_VARIANTS = {'thumb': (320, 320), 'medium': (1024, 1024)}  # needs Pillow installed
+    UPLOAD_IMAGE_WORKERS = 2  # processes resizing images
+    UPLOAD_IMAGE_QUEUE_SIZE = 32  # resize jobs allowed in flight before new ones are skipped
+    
+    # Static asset settings
+    ASSETS_BUILD_ON_STARTUP = True  # set False when 'flask assets build' runs at deploy time
+    ASSETS_MAX_AGE = 365 * 24 * 3600  # fingerprinted files never change, so cache them for a year
+    
+    # Response compression settings
+    COMPRESS_MIN_SIZE = 500  # bytes; smaller bodies gain less than the header overhead
+    COMPRESS_MIMETYPES = ['text/html', 'text/css', 'text/plain', 'text/xml', 'application/json',
+                          'application/javascript', 'application/xml', 'application/atom+xml',
+                          'application/rss+xml', 'image/svg+xml']
+    COMPRESS_LEVEL = 6  # gzip level; higher costs CPU for little gain on dynamic pages
+    COMPRESS_BROTLI_QUALITY = 4  # brotli quality used when the brotli package is installed
+    COMPRESS_CACHE_BYTES = 16 * 1024 * 1024  # compressed bodies kept per process for repeat hits
+    
+    # Template settings
+    TEMPLATE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'jinja_cache')  # None disables
+    
+    # Production server settings ('flask serve' / gunicorn)
+    SERVER_BIND = os.environ.get('BIND', '127.0.0.1:8000')
+    # sync, gthread, gevent or eventlet; gevent and eventlet are not in requirements.txt, install one to use it
+    SERVER_WORKER_CLASS = os.environ.get('WORKER_CLASS', 'gthread')
+    SERVER_WORKERS = None  # processes; None sizes from the CPU count
+    SERVER_THREADS = None  # gthread threads per process; None sizes from the CPU count and DB pool
+    SERVER_WORKER_CONNECTIONS = 1000  # concurrent clients per gevent/eventlet process
+    SERVER_DB_MAX_CONNECTIONS = None  # database connection limit; caps processes so pools fit under it
+    SERVER_MAX_REQUESTS = 1000  # recycle a worker after this many requests to cap memory growth
+    SERVER_MAX_REQUESTS_JITTER = 100  # spread recycling so workers don't restart together
+    SERVER_TIMEOUT = 30
+    SERVER_GRACEFUL_TIMEOUT = 30  # seconds in-flight requests get on reload or shutdown
+    SERVER_KEEPALIVE = 5
+    # Reverse proxies (e.g. nginx) in front of the app whose X-Forwarded-For/-Proto are trusted. Must be
+    # set behind a proxy, or every client has the proxy's address (and shares one rate limit bucket);
+    # must stay 0 when clients connect directly, or they could spoof their address.
+    SERVER_TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+    
+    # Profiling settings ('flask profile token' / 'flask profile on ENDPOINT')
+    PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'profiles')
+    PROFILE_HEADER = 'X-Profile'  # carries a signed token from 'flask profile token'
+    PROFILE_TOKEN_MAX_AGE = 24 * 3600
+    PROFILE_SAMPLE_RATE = 0.0  # fraction of all requests to profile; 0 disables sampling
+    PROFILE_SAMPLE_MODE = 'sampling'  # 'sampling' (collapsed stacks) or 'cprofile' (pstats)
+    PROFILE_SAMPLE_INTERVAL = 0.005  # seconds between stack samples
+    PROFILE_TOGGLE_REFRESH_INTERVAL = 10  # seconds before workers notice 'flask profile on/off'
+    
+    # Metrics settings (/metrics)
+    METRICS_DIR = os.environ.get('METRICS_DIR') or \
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'metrics')  # shared by all workers
+    METRICS_FLUSH_INTERVAL = 5  # seconds between each worker writing its totals to METRICS_DIR
+    METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # if set, scrapes need 'Authorization: Bearer <token>'
+    
+    # Change log settings (/api/changes)
+    CHANGES_API_TOKEN = os.environ.get('CHANGES_API_TOKEN')  # reads need 'Authorization: Bearer <token>'; unset disables the API
+    CHANGES_API_MAX_LIMIT = 1000  # most changes returned by one request
+    CHANGE_LOG_RETENTION_DAYS = 30  # consumers must read within this window
+    CHANGE_LOG_PRUNE_INTERVAL = 3600  # seconds between deletes of expired changes
+    
+    # Typeahead settings (/blog/autocomplete)
+    TYPEAHEAD_RESULTS = 8
+    TYPEAHEAD_MAX_ITEMS = 100000  # most popular posts and users kept in each worker's index
+    TYPEAHEAD_CACHE_PREFIX_LENGTH = 2  # top results for prefixes this short are precomputed
+    TYPEAHEAD_SYNC_INTERVAL = 5  # seconds between reads of new post and like changes (not users)
+    TYPEAHEAD_SYNC_BATCH = 1000
+    TYPEAHEAD_REBUILD_INTERVAL = 600  # full rebuild is when new users, username and follower changes appear
+    
+    # View analytics settings
+    ANALYTICS_FLUSH_INTERVAL = 60  # seconds views stay buffered in a worker before being written
+    ANALYTICS_HLL_PRECISION = 10  # 2**10 one-byte registers per post and day, about 3% error
+    
+    # Feed and sitemap settings
+    FEED_ENTRIES = 20  # posts in each Atom/RSS feed
+    FEED_MAX_AGE = 300  # seconds clients and proxies may reuse feeds and sitemaps
+    SITEMAP_SHARD_SIZE = 10000  # post ids per sitemap file (the protocol allows up to 50,000 URLs)
+    SITEMAP_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'sitemaps')
+    
+    # Tag settings
+    TAGS_PER_POST = 8
+    TAG_MAX_LENGTH = 30
+    TAG_CLOUD_SIZE = 50  # most used tags shown on /blog/tags
+    
+    # Post revision settings
+    REVISION_SNAPSHOT_INTERVAL = 10  # a full copy every this many revisions bounds the deltas replayed
+    REVISION_COMPACT_AFTER_DAYS = 30  # older revisions are thinned to the last one per day
+    REVISION_COMPACT_INTERVAL = 3600  # seconds between compaction runs
+    REVISION_COMPACT_BATCH = 500
+    
+    # Archive settings
+    ARCHIVE_AFTER_DAYS = 365  # posts older than this are archived once idle
+    ARCHIVE_IDLE_DAYS = 90  # ...with no edit, comment, like or view for this long
+    ARCHIVE_BATCH = 200  # posts moved per transaction
+    ARCHIVE_INTERVAL = 86400  # seconds between archive runs
+
+    # Publishing settings
+    PUBLISH_INTERVAL = 30  # seconds between scans for scheduled posts that are due
+    PUBLISH_BATCH = 100
+
+    # Rate limiting settings
+    RATELIMIT_STORE = os.environ.get('RATELIMIT_STORE', 'sqlite')  # 'sqlite' (shared by workers), 'memory' or '' to disable
+    RATELIMIT_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'ratelimit.db')
+    RATELIMIT_SWEEP_INTERVAL = 300  # seconds between dropping buckets that have refilled
+    # '[METHOD ]endpoint' -> 'N/period' (second, minute, hour or day): bursts of N, refilled evenly over
+    # the period. Anonymous clients are limited per IP address, which needs SERVER_TRUSTED_PROXIES behind a proxy.
+    RATELIMITS = {
+        'POST auth.login': '10/minute',  # showing the login form is not limited
+        'POST blog.add_comment': '10/minute',
+        'POST blog.add_reply': '10/minute',
+        'POST blog.like_post': '30/minute',
+        'blog.search': '30/minute',
+    }
+
+    # Idempotency settings
+    IDEMPOTENCY_STORE = os.environ.get('IDEMPOTENCY_STORE', 'sqlite')  # 'sqlite' (shared by workers), 'memory' or '' to disable
+    IDEMPOTENCY_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'idempotency.db')
+    IDEMPOTENCY_HEADER = 'Idempotency-Key'  # optional client-supplied key, mixed into the request hash
+    # Endpoint -> seconds a response is replayed to duplicate submissions
+    IDEMPOTENCY_TTLS = {
+        'blog.create': 300,
+        'blog.add_comment': 120,
+        'blog.add_reply': 120,
+        'blog.like_post': 10,  # short, so liking and unliking from one page without JS still works
+    }
+    IDEMPOTENCY_LOCK_TIMEOUT = 30  # seconds before a request that never finished stops blocking its duplicates
+    IDEMPOTENCY_WAIT = 5  # seconds a duplicate waits for the original to finish before getting a 409
+    IDEMPOTENCY_SWEEP_INTERVAL = 300
+
+    # Backfill settings
+    BACKFILL_BATCH_SIZE = 1000  # rows per transaction
+    BACKFILL_THROTTLE = 1.0  # sleep this many times as long as each chunk took; 0 runs flat out
+    BACKFILL_REPORT_INTERVAL = 10  # seconds between progress lines
+
+    # Dataset export/import settings
+    DATASET_BATCH_SIZE = 5000  # rows fetched per cursor batch on export and inserted per executemany on import
     
     # Security settings
     WTF_CSRF_ENABLED = True
     WTF_CSRF_TIME_LIMIT = None  # No time limit for CSRF tokens
     
     # Session settings
-    PERMANENT_SESSION_LIFETIME = 3600  # 1 hour in seconds
\ No newline at end of file
+    PERMANENT_SESSION_LIFETIME = 3600  # 1 hour in seconds
+    SESSION_STORE = os.environ.get('SESSION_STORE', 'sql')  # 'sql', 'filesystem', 'memory' or '' for cookies
+    SESSION_FILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'sessions')
+    SESSION_SWEEP_INTERVAL = 300  # seconds between expired-session sweeps
+    LAST_SEEN_UPDATE_INTERVAL = 60  # seconds; avoids a write (and user reload) on every request
\ No newline at end of file
@@ -0,0 +1,281 @@
+"""Export the blog's content as NDJSON and import it into another instance.
+
+The file is a header line followed by one {"table": ..., "row": ...} object per
+row, parents before children. It holds users (password hashes included),
+follows, tags, posts with their tags and revisions, comments and likes, hot and
+archived alike. Uploads, sessions, the change log and derived tables such as
+scores, timelines and view counts are not exported.
+"""
+import base64
+import contextlib
+import gzip
+import json
+import sys
+from collections import defaultdict
+from datetime import date, datetime
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from models import (
+    db, User, Follow, Tag, Post, PostTag, PostRevision, Comment, Like,
+    archived_post, archived_post_tag, archived_post_revision, archived_comment, archived_like,
+)
+
+FORMAT = 'blog-dataset'
+VERSION = 1
+
+# Export order, and which id space each table's ids belong to
+TABLES = (
+    (User.__table__, 'user'),
+    (Follow.__table__, None),
+    (Tag.__table__, 'tag'),
+    (Post.__table__, 'post'),
+    (archived_post, 'post'),
+    (PostTag.__table__, None),
+    (archived_post_tag, None),
+    (PostRevision.__table__, 'revision'),
+    (archived_post_revision, 'revision'),
+    (Comment.__table__, 'comment'),
+    (archived_comment, 'comment'),
+    (Like.__table__, 'like'),
+    (archived_like, 'like'),
+)
+ENTITIES = {table.name: entity for table, entity in TABLES}
+
+# Foreign key columns and the id space they point into
+REFERENCES = {
+    'user_id': 'user', 'follower_id': 'user', 'followed_id': 'user',
+    'tag_id': 'tag', 'post_id': 'post', 'parent_id': 'comment',
+}
+
+
+def _dump(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode('ascii')
+    return value
+
+
+def _loader(column):
+    if isinstance(column.type, db.DateTime):
+        return datetime.fromisoformat
+    if isinstance(column.type, db.Date):
+        return date.fromisoformat
+    if isinstance(column.type, db.LargeBinary):
+        return base64.b64decode
+    return None
+
+
+def open_dataset(path, mode):
+    """Text stream for path, gzip-compressed if it ends in .gz; '-' is stdin or stdout"""
+    if path == '-':
+        return contextlib.nullcontext(sys.stdout if mode == 'w' else sys.stdin)
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def export_dataset(out):
+    """Write every table to out, streaming rows in primary-key order; returns the row counts"""
+    batch_size = current_app.config['DATASET_BATCH_SIZE']
+    out.write(json.dumps({'format': FORMAT, 'version': VERSION, 'exported_at': datetime.utcnow().isoformat()}) + '\n')
+    counts = {}
+    for table, _ in TABLES:
+        names = [column.name for column in table.columns]
+        rows = db.session.execute(
+            db.select(table).order_by(*table.primary_key.columns).execution_options(yield_per=batch_size)
+        )
+        count = 0
+        for row in rows:
+            record = {'table': table.name, 'row': {name: _dump(value) for name, value in zip(names, row)}}
+            out.write(json.dumps(record, separators=(',', ':')) + '\n')
+            count += 1
+        counts[table.name] = count
+    db.session.rollback()
+    return counts
+
+
+class IdMap:
+    """Old id to new id: shifted past the ids already in the target, unless matched to an existing row.
+
+    A constant offset keeps the map O(1) in memory and preserves id order, so
+    replies still sort after their parents and keyset cursors keep working.
+    """
+
+    def __init__(self, connection, tables):
+        self.offset = max(
+            connection.execute(db.select(db.func.coalesce(db.func.max(table.c.id), 0))).scalar()
+            for table in tables
+        )
+        self.matched = {}
+
+    def __call__(self, old):
+        if old is None:
+            return None
+        return self.matched.get(old, old + self.offset)
+
+
+def _match_existing(connection, table, rows, ids):
+    """Map imported tags onto existing ones with the same name, and users onto the account with the same
+    username and email; a user sharing only one of them with an account stops the import"""
+    if table.name == 'user':
+        keys = ('username', 'email')
+    elif table.name == 'tag':
+        keys = ('name',)
+    else:
+        return rows
+    existing = {}
+    for key in keys:
+        values = [row[key] for row in rows]
+        for row_id, value in connection.execute(db.select(table.c.id, table.c[key]).where(table.c[key].in_(values))):
+            existing[(key, value)] = row_id
+    fresh, conflicts = [], []
+    for row in rows:
+        matches = [existing.get((key, row[key])) for key in keys]
+        if not any(matches):
+            fresh.append(row)
+        elif len(set(matches)) == 1:
+            ids.matched[row['id']] = matches[0]
+        else:
+            # Merging would hand their content to someone else's account
+            conflicts.append(row[keys[0]])
+    if conflicts:
+        raise ValueError(
+            f'{len(conflicts)} imported users share a username or email, but not both, with an existing account: '
+            + ', '.join(conflicts[:10]) + (', ...' if len(conflicts) > 10 else '')
+        )
+    return fresh
+
+
+def _remap(table, rows, maps):
+    own = ENTITIES[table.name]
+    for row in rows:
+        if own is not None:
+            row['id'] = maps[own](row['id'])
+        for name, entity in REFERENCES.items():
+            if name in row:
+                row[name] = maps[entity](row[name])
+        if row.get('path'):
+            row['path'] = ''.join(
+                Comment.path_segment(maps['comment'](int(segment))) for segment in row['path'].split('/') if segment
+            )
+    return rows
+
+
+def _drop_existing_follows(connection, rows):
+    """Follows between two users that both already existed may be in the target already"""
+    follows = Follow.__table__
+    pairs = [(row['follower_id'], row['followed_id']) for row in rows]
+    existing = set(connection.execute(db.select(follows.c.follower_id, follows.c.followed_id).where(
+        db.tuple_(follows.c.follower_id, follows.c.followed_id).in_(pairs)
+    )).all())
+    return [row for row in rows if (row['follower_id'], row['followed_id']) not in existing]
+
+
+def _insert(connection, table, rows, maps):
+    rows = _match_existing(connection, table, rows, maps.get(ENTITIES[table.name]))
+    rows = _remap(table, rows, maps)
+    if table.name == 'follow':
+        rows = _drop_existing_follows(connection, rows)
+    if rows:
+        connection.execute(table.insert(), rows)
+    return len(rows)
+
+
+def import_dataset(lines):
+    """Insert an exported dataset in one transaction, then rebuild the counters.
+
+    Rows go in with batched executemany INSERTs that bypass the mapper events,
+    so the change log and per-row counter updates are skipped; user statistics,
+    follower and tag counts and trending scores are recomputed at the end.
+    Returns the number of rows inserted per table.
+    """
+    batch_size = current_app.config['DATASET_BATCH_SIZE']
+    try:
+        header = json.loads(next(lines, ''))
+    except ValueError:
+        header = None
+    if not isinstance(header, dict) or header.get('format') != FORMAT:
+        raise ValueError('Not a blog dataset export')
+    if header.get('version') != VERSION:
+        raise ValueError(f'Unsupported dataset version {header.get("version")}')
+
+    tables = {table.name: table for table, _ in TABLES}
+    counts = defaultdict(int)
+    with db.engine.begin() as connection:
+        maps = {}
+        for table, entity in TABLES:
+            if entity is not None and entity not in maps:
+                maps[entity] = IdMap(connection, [t for t, e in TABLES if e == entity])
+
+        table, loaders, rows = None, {}, []
+        for line in lines:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if table is None or record['table'] != table.name:
+                if rows:
+                    counts[table.name] += _insert(connection, table, rows, maps)
+                    rows = []
+                if record['table'] not in tables:
+                    raise ValueError(f'Unknown table {record["table"]!r}')
+                table = tables[record['table']]
+                loaders = {column.name: _loader(column) for column in table.columns}
+            row = {}
+            for name, value in record['row'].items():
+                if name in loaders:
+                    load = loaders[name]
+                    row[name] = load(value) if load is not None and value is not None else value
+            rows.append(row)
+            if len(rows) >= batch_size:
+                counts[table.name] += _insert(connection, table, rows, maps)
+                rows = []
+        if rows:
+            counts[table.name] += _insert(connection, table, rows, maps)
+
+    rebuild_counters()
+    return dict(counts)
+
+
+def rebuild_counters():
+    import stats
+    import tags
+    import trending
+    users = User.__table__
+    followers = db.select(db.func.count()).where(Follow.followed_id == users.c.id).scalar_subquery()
+    db.session.execute(users.update().values(follower_count=followers))
+    db.session.commit()
+    stats.rebuild_stats()
+    tags.rebuild_counts()
+    trending.rebuild_scores()
+
+
+dataset_cli = AppGroup('dataset', help='Export and import the blog content as NDJSON.')
+
+
+@dataset_cli.command('export')
+@click.argument('path', default='-')
+def export_command(path):
+    """Write users, posts, comments and likes to PATH (.gz compresses, - is stdout)."""
+    with open_dataset(path, 'w') as out:
+        counts = export_dataset(out)
+    click.echo(', '.join(f'{count} {name}' for name, count in counts.items()), err=True)
+
+
+@dataset_cli.command('import')
+@click.argument('path', default='-')
+def import_command(path):
+    """Add the content of an export to this database, giving every row a new id."""
+    with open_dataset(path, 'r') as lines:
+        try:
+            counts = import_dataset(iter(lines))
+        except ValueError as e:
+            raise click.ClickException(str(e))
+    click.echo(', '.join(f'{count} {name}' for name, count in counts.items()), err=True)
+
+
+def init_app(app):
+    app.cli.add_command(dataset_cli)
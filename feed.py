@@ -0,0 +1,113 @@
+from datetime import datetime
+
+from flask import current_app
+
+from models import db, User, Post, Follow, TimelineEntry
+
+
+def parse_cursor(cursor):
+    """Turn a feed cursor back into a (published_at, post_id) tuple, raising ValueError if malformed"""
+    created_at, post_id = cursor.rsplit('|', 1)
+    return datetime.fromisoformat(created_at), int(post_id)
+
+
+def make_cursor(created_at, post_id):
+    return f'{created_at.isoformat()}|{post_id}'
+
+
+def is_fanned_out(author):
+    """Posts by authors with very many followers are pulled at read time rather than copied"""
+    return author.follower_count <= current_app.config['FEED_FANOUT_LIMIT']
+
+
+def fan_out(post):
+    """Copy a newly published post into every follower's timeline with one INSERT ... SELECT"""
+    if not is_fanned_out(post.author):
+        return 0
+    followers = db.select(
+        Follow.follower_id, db.literal(post.id), db.literal(post.published_at, db.DateTime)
+    ).where(Follow.followed_id == post.user_id)
+    result = db.session.execute(
+        db.insert(TimelineEntry).from_select(['user_id', 'post_id', 'created_at'], followers)
+    )
+    return result.rowcount
+
+
+def add_author(user, author):
+    """Seed a new follower's timeline with the author's recent posts"""
+    if not is_fanned_out(author):
+        return
+    recent = db.select(
+        db.literal(user.id), Post.id, Post.published_at
+    ).where(Post.user_id == author.id, Post.status == Post.PUBLISHED).order_by(Post.published_at.desc()).limit(
+        current_app.config['FEED_BACKFILL_POSTS']
+    )
+    db.session.execute(
+        db.insert(TimelineEntry).prefix_with('OR IGNORE', dialect='sqlite').from_select(
+            ['user_id', 'post_id', 'created_at'], recent
+        )
+    )
+
+
+def remove_author(user, author):
+    authored = db.select(Post.id).where(Post.user_id == author.id)
+    TimelineEntry.query.filter(
+        TimelineEntry.user_id == user.id, TimelineEntry.post_id.in_(authored)
+    ).delete(synchronize_session=False)
+
+
+def remove_user(user):
+    """Drop a user's timeline, follow edges and fanned-out posts before the account is deleted"""
+    authored = db.select(Post.id).where(Post.user_id == user.id)
+    TimelineEntry.query.filter(
+        db.or_(TimelineEntry.user_id == user.id, TimelineEntry.post_id.in_(authored))
+    ).delete(synchronize_session=False)
+
+    followed = db.select(Follow.followed_id).where(Follow.follower_id == user.id)
+    User.query.filter(User.id.in_(followed)).update(
+        {User.follower_count: User.follower_count - 1}, synchronize_session=False
+    )
+    Follow.query.filter(
+        db.or_(Follow.follower_id == user.id, Follow.followed_id == user.id)
+    ).delete(synchronize_session=False)
+
+
+def get_feed_page(user, after=None, limit=10):
+    """Keyset page of the user's home feed, newest first.
+
+    Fanned-out posts come from one range scan of the user's timeline. Posts by
+    authors above FEED_FANOUT_LIMIT followers are read from the post table per
+    author and merged in.
+    """
+    cursor = parse_cursor(after) if after else None
+
+    entries = db.session.query(TimelineEntry.created_at, TimelineEntry.post_id).filter(
+        TimelineEntry.user_id == user.id
+    )
+    if cursor:
+        entries = entries.filter(db.tuple_(TimelineEntry.created_at, TimelineEntry.post_id) < cursor)
+    candidates = entries.order_by(
+        TimelineEntry.created_at.desc(), TimelineEntry.post_id.desc()
+    ).limit(limit + 1).all()
+
+    pulled_authors = [author_id for author_id, in db.session.query(Follow.followed_id).join(
+        User, User.id == Follow.followed_id
+    ).filter(
+        Follow.follower_id == user.id,
+        User.follower_count > current_app.config['FEED_FANOUT_LIMIT']
+    )]
+    if pulled_authors:
+        pulled = db.session.query(Post.published_at, Post.id).filter(
+            Post.user_id.in_(pulled_authors), Post.status == Post.PUBLISHED
+        )
+        if cursor:
+            pulled = pulled.filter(db.tuple_(Post.published_at, Post.id) < cursor)
+        candidates += pulled.order_by(Post.published_at.desc(), Post.id.desc()).limit(limit + 1).all()
+
+    # An author who crossed the threshold can have a post in both lists
+    keys = sorted({tuple(candidate) for candidate in candidates}, reverse=True)[:limit + 1]
+    next_cursor = make_cursor(*keys[limit - 1]) if len(keys) > limit else None
+    keys = keys[:limit]
+
+    posts = {post.id: post for post in Post.query.filter(Post.id.in_([post_id for _, post_id in keys]))}
+    return [posts[post_id] for _, post_id in keys if post_id in posts], next_cursor
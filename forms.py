@@ -1,7 +1,10 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, TextAreaField, SubmitField, BooleanField, SelectField, DateField
+from flask_wtf.file import FileField, FileAllowed
+from wtforms import StringField, TextAreaField, SubmitField, BooleanField, SelectField, DateField, DateTimeLocalField
 from wtforms.validators import DataRequired, Length, Optional, ValidationError
-from datetime import date
+from datetime import date, datetime
+from config import Config
+from tags import parse_tags
 
 # Blog-related forms only (Auth forms moved to blueprints/auth/forms.py)
 
@@ -21,10 +24,31 @@ class PostForm(FlaskForm):
         Length(max=300, message='Excerpt cannot exceed 300 characters')
     ], render_kw={'rows': 3, 'placeholder': 'Brief summary of your post...', 'class': 'form-control'})
     
+    tags = StringField('Tags (Optional)', validators=[
+        Optional(),
+        Length(max=300, message='Tags cannot exceed 300 characters')
+    ], render_kw={'placeholder': 'python, web-development, tips', 'class': 'form-control'})
+    
+    attachment = FileField('Attachment (Optional)', validators=[
+        FileAllowed(Config.ALLOWED_EXTENSIONS, message='That file type is not allowed')
+    ], render_kw={'class': 'form-control'})
+    
     allow_comments = BooleanField('Allow comments', default=True)
     is_published = BooleanField('Publish immediately', default=True)
+    publish_at = DateTimeLocalField('Or schedule for (UTC)', format='%Y-%m-%dT%H:%M', validators=[Optional()],
+                                    render_kw={'class': 'form-control'})
     
     submit = SubmitField('Publish Post', render_kw={'class': 'btn btn-primary'})
+    
+    def validate_tags(self, field):
+        try:
+            parse_tags(field.data)
+        except ValueError as e:
+            raise ValidationError(str(e))
+    
+    def validate_publish_at(self, field):
+        if field.data and not self.is_published.data and field.data <= datetime.utcnow():
+            raise ValidationError('Choose a time in the future, or publish immediately')
 
 class SearchForm(FlaskForm):
     query = StringField('Search', validators=[
@@ -0,0 +1,218 @@
+"""Absorb duplicate submissions of endpoints that write.
+
+Each POST to an endpoint in IDEMPOTENCY_TTLS is identified by a hash of the
+user, endpoint, URL arguments, form fields, uploaded files and the optional
+Idempotency-Key header. Forms carry a key generated when the page was rendered,
+so a double click or a retried request matches the first submission while
+posting the same text again from a fresh page does not. The first request
+claims the hash; duplicates wait for it to finish and get its response replayed
+from the store without running the view.
+
+Stores keep (status, headers, body) responses keyed by request hash. claim()
+reserves a key for the current request and returns None, or returns the stored
+response, or PENDING while the first request is still running; complete()
+stores the response, release() drops an unfinished claim so a retry can run
+again, and sweep() deletes expired entries and returns how many it removed.
+Claims expire after their lock timeout, so a crashed request cannot block its
+key for long, and responses after their TTL.
+"""
+import hashlib
+import json
+import secrets
+import threading
+import time
+
+from flask import current_app, g, request
+from flask_login import current_user
+from markupsafe import Markup
+from werkzeug.exceptions import Conflict
+from werkzeug.wrappers import Response
+
+import local_sqlite
+
+FIELD = 'idempotency_key'
+PENDING = object()  # claimed by a request that has not finished yet
+REPLAYED_HEADERS = ('Content-Type', 'Location')
+
+
+class MemoryIdempotencyStore:
+    """Entries in a dict. Duplicates that reach different worker processes are not caught."""
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def claim(self, key, lock_seconds, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                return PENDING if entry[1] is None else entry[1]
+            self.entries[key] = (now + lock_seconds, None)
+            return None
+
+    def complete(self, key, response, ttl, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            self.entries[key] = (now + ttl, response)
+
+    def release(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] is None:
+                del self.entries[key]
+
+    def sweep(self, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            expired = [key for key, (expires, _) in self.entries.items() if expires <= now]
+            for key in expired:
+                del self.entries[key]
+        return len(expired)
+
+
+class SQLiteIdempotencyStore:
+    """Responses visible to every worker on the host, kept in a LocalSQLite file.
+
+    A claim is one UPSERT that only takes over a missing or expired key.
+    """
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS result ('
+        'key TEXT PRIMARY KEY, expires REAL NOT NULL, '
+        'status INTEGER, headers TEXT, body BLOB) WITHOUT ROWID'
+    )
+
+    def __init__(self, path):
+        self.db = local_sqlite.LocalSQLite(path, self.SCHEMA)
+
+    def claim(self, key, lock_seconds, now=None):
+        now = time.time() if now is None else now
+        connection = self.db.connection()
+        while True:
+            claimed = connection.execute(
+                'INSERT INTO result (key, expires) VALUES (:key, :expires) '
+                'ON CONFLICT (key) DO UPDATE SET expires = :expires, status = NULL, headers = NULL, body = NULL '
+                'WHERE result.expires <= :now '
+                'RETURNING key',
+                {'key': key, 'expires': now + lock_seconds, 'now': now}
+            ).fetchone()
+            if claimed:
+                return None
+            row = connection.execute('SELECT status, headers, body FROM result WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                # Released between the two statements; try to claim it again
+                continue
+            status, headers, body = row
+            return PENDING if status is None else (status, json.loads(headers), body)
+
+    def complete(self, key, response, ttl, now=None):
+        now = time.time() if now is None else now
+        status, headers, body = response
+        self.db.connection().execute(
+            'UPDATE result SET expires = ?, status = ?, headers = ?, body = ? WHERE key = ?',
+            (now + ttl, status, json.dumps(headers), body, key)
+        )
+
+    def release(self, key):
+        self.db.connection().execute('DELETE FROM result WHERE key = ? AND status IS NULL', (key,))
+
+    def sweep(self, now=None):
+        now = time.time() if now is None else now
+        return self.db.connection().execute('DELETE FROM result WHERE expires <= ?', (now,)).rowcount
+
+
+def create_store(app):
+    kind = app.config['IDEMPOTENCY_STORE']
+    if kind == 'sqlite':
+        local_sqlite.check_version('IDEMPOTENCY_STORE')
+        return SQLiteIdempotencyStore(app.config['IDEMPOTENCY_DB'])
+    if kind == 'memory':
+        return MemoryIdempotencyStore()
+    raise ValueError(f'Unknown IDEMPOTENCY_STORE {kind!r}')
+
+
+def idempotency_field():
+    """Hidden input with a fresh key, rendered into each form whose submissions should be deduplicated"""
+    return Markup(f'<input type="hidden" name="{FIELD}" value="{secrets.token_urlsafe(16)}">')
+
+
+def request_hash():
+    """Hash of everything that makes a submission distinct, csrf_token aside since it is per session"""
+    files = []
+    for name, upload in request.files.items(multi=True):
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: upload.stream.read(65536), b''):
+            digest.update(chunk)
+        upload.stream.seek(0)
+        files.append((name, upload.filename, digest.hexdigest()))
+    payload = [
+        current_user.id,
+        request.endpoint,
+        sorted(request.view_args.items()),
+        request.headers.get(current_app.config['IDEMPOTENCY_HEADER'], ''),
+        sorted((name, value) for name, value in request.form.items(multi=True) if name != 'csrf_token'),
+        sorted(files),
+    ]
+    return hashlib.sha256(json.dumps(payload, default=str).encode()).hexdigest()
+
+
+def replay(stored):
+    status, headers, body = stored
+    response = Response(body, status, headers)
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def check_duplicate():
+    if request.method != 'POST' or request.endpoint not in current_app.config['IDEMPOTENCY_TTLS']:
+        return None
+    if not current_user.is_authenticated:
+        return None
+    store = current_app.extensions['idempotency']
+    key = request_hash()
+    deadline = time.monotonic() + current_app.config['IDEMPOTENCY_WAIT']
+    while True:
+        stored = store.claim(key, current_app.config['IDEMPOTENCY_LOCK_TIMEOUT'])
+        if stored is None:
+            g.idempotency_key = key
+            return None
+        if stored is not PENDING:
+            return replay(stored)
+        # The first submission is still running; its response is what this one should get
+        if time.monotonic() >= deadline:
+            raise Conflict('This request is already being processed. Please wait a moment and reload.')
+        time.sleep(0.05)
+
+
+def store_response(response):
+    key = g.pop('idempotency_key', None)
+    if key is None:
+        return response
+    store = current_app.extensions['idempotency']
+    # Errors and rejections (CSRF failures, 404s, 429s) are left for a retry to run again
+    if response.status_code < 400 and not response.is_streamed:
+        headers = [(name, response.headers[name]) for name in REPLAYED_HEADERS if name in response.headers]
+        store.complete(key, (response.status_code, headers, response.get_data()),
+                       current_app.config['IDEMPOTENCY_TTLS'][request.endpoint])
+    else:
+        store.release(key)
+    return response
+
+
+def release_claim(exc):
+    key = g.pop('idempotency_key', None)
+    if key is not None:
+        current_app.extensions['idempotency'].release(key)
+
+
+def init_app(app, scheduler):
+    app.jinja_env.globals['idempotency_field'] = idempotency_field
+    if not app.config.get('IDEMPOTENCY_STORE'):
+        return
+    store = create_store(app)
+    app.extensions['idempotency'] = store
+    app.before_request(check_duplicate)
+    app.after_request(store_response)
+    app.teardown_request(release_claim)
+    scheduler.add_job('idempotency.sweep', store.sweep, app.config['IDEMPOTENCY_SWEEP_INTERVAL'])
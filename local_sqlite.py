@@ -0,0 +1,41 @@
+"""Small SQLite files shared by the workers on one host.
+
+The rate limiter and the idempotency store keep their state here rather than
+in the main database, so their writes never wait on its lock. Durability is
+traded for speed: losing the last writes in a crash only resets rate limits
+or lets a duplicate submission through.
+"""
+import os
+import sqlite3
+import threading
+
+# Both stores write with UPSERT ... RETURNING
+MIN_VERSION = (3, 35)
+
+
+def check_version(setting):
+    """Raise at startup, rather than on every request, if this SQLite is too old for the stores"""
+    if sqlite3.sqlite_version_info < MIN_VERSION:
+        required = '.'.join(map(str, MIN_VERSION))
+        raise RuntimeError(f"{setting} 'sqlite' needs SQLite {required} or newer, found {sqlite3.sqlite_version}; "
+                           "upgrade SQLite or use 'memory'")
+
+
+class LocalSQLite:
+    """One connection per thread to the file at path, opened on first use and again after a fork"""
+
+    def __init__(self, path, schema):
+        self.path = path
+        self.schema = schema
+        self.local = threading.local()
+
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None or self.local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute(self.schema)
+            self.local.connection, self.local.pid = connection, os.getpid()
+        return connection
@@ -0,0 +1,287 @@
+import atexit
+import fcntl
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from flask import Response, abort, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+from models import db
+
+ARCHIVE_FILE = 'archive.json'
+
+
+def _labels(**labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class Registry:
+    """Process-local counters, gauges and histograms.
+
+    Every process periodically writes its absolute totals to METRICS_DIR/<pid>.json;
+    a scrape merges all files, so any worker can answer /metrics for the whole
+    server. Counters of exited workers are folded into an archive file so totals
+    never go backwards; their gauges are dropped.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.kinds = {}
+        self.help = {}
+        self.buckets = {}
+        self.values = defaultdict(float)
+        self.histograms = {}
+        self.callbacks = []
+        self.caches = {}
+        self.directory = None
+
+    def describe(self, name, kind, help, buckets=None):
+        self.kinds[name] = kind
+        self.help[name] = help
+        if buckets:
+            self.buckets[name] = tuple(buckets)
+
+    def inc(self, name, labels=(), amount=1):
+        with self.lock:
+            self.values[(name, labels)] += amount
+
+    def set(self, name, labels, value):
+        with self.lock:
+            self.values[(name, labels)] = value
+
+    def observe(self, name, labels, value):
+        buckets = self.buckets[name]
+        with self.lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                # one count per bucket plus +Inf, then the running sum
+                histogram = self.histograms[(name, labels)] = [0] * (len(buckets) + 1) + [0.0]
+            histogram[bisect_left(buckets, value)] += 1
+            histogram[-1] += value
+
+    def register_gauge(self, name, help, func):
+        """Report func() as a gauge at every flush, e.g. the depth of a work queue"""
+        self.describe(name, 'gauge', help)
+        self.callbacks.append((name, func))
+
+    def register_cache(self, name, cache):
+        """Export hit/miss counts of any object with ``hits`` and ``misses`` attributes"""
+        self.caches[name] = cache
+
+    def snapshot(self):
+        for name, func in self.callbacks:
+            self.set(name, (), func())
+        for name, cache in self.caches.items():
+            self.set('cache_hits_total', _labels(cache=name), cache.hits)
+            self.set('cache_misses_total', _labels(cache=name), cache.misses)
+        with self.lock:
+            return {
+                'values': [[name, labels, value] for (name, labels), value in self.values.items()],
+                'histograms': [[name, labels, counts] for (name, labels), counts in self.histograms.items()],
+            }
+
+    def flush(self):
+        if self.directory is None:
+            return
+        _write_json(os.path.join(self.directory, f'{os.getpid()}.json'), self.snapshot())
+
+    def collect(self):
+        """Merge every process's file into one snapshot"""
+        self.flush()
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            archive = _read_json(os.path.join(self.directory, ARCHIVE_FILE))
+            live = []
+            for filename in os.listdir(self.directory):
+                pid = filename[:-5]
+                if not filename.endswith('.json') or not pid.isdigit():
+                    continue
+                snapshot = _read_json(os.path.join(self.directory, filename))
+                if _is_alive(int(pid)):
+                    live.append(snapshot)
+                else:
+                    archive = self.merge([archive, snapshot], gauges=False)
+                    _write_json(os.path.join(self.directory, ARCHIVE_FILE), archive)
+                    os.remove(os.path.join(self.directory, filename))
+        return self.merge([archive] + live)
+
+    def merge(self, snapshots, gauges=True):
+        values = defaultdict(float)
+        histograms = {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot.get('values', []):
+                if gauges or self.kinds.get(name) != 'gauge':
+                    values[(name, tuple(map(tuple, labels)))] += value
+            for name, labels, counts in snapshot.get('histograms', []):
+                key = (name, tuple(map(tuple, labels)))
+                if key in histograms:
+                    counts = [a + b for a, b in zip(histograms[key], counts)]
+                histograms[key] = counts
+        return {
+            'values': [[name, labels, value] for (name, labels), value in values.items()],
+            'histograms': [[name, labels, counts] for (name, labels), counts in histograms.items()],
+        }
+
+    def render(self, snapshot):
+        """Prometheus text exposition format"""
+        series = defaultdict(list)
+        for name, labels, value in snapshot['values']:
+            series[name].append(f'{name}{_format_labels(labels)} {value:g}')
+        for name, labels, counts in snapshot['histograms']:
+            cumulative = 0
+            for bound, count in zip(self.buckets[name] + ('+Inf',), counts):
+                cumulative += count
+                bucket_labels = list(labels) + [('le', f'{bound:g}' if bound != '+Inf' else bound)]
+                series[name].append(f'{name}_bucket{_format_labels(bucket_labels)} {cumulative}')
+            series[name].append(f'{name}_sum{_format_labels(labels)} {counts[-1]:g}')
+            series[name].append(f'{name}_count{_format_labels(labels)} {cumulative}')
+
+        lines = []
+        for name in sorted(series):
+            lines.append(f'# HELP {name} {self.help.get(name, name)}')
+            lines.append(f'# TYPE {name} {self.kinds.get(name, "untyped")}')
+            lines.extend(sorted(series[name]))
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _write_json(path, data):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+registry = Registry()
+register_gauge = registry.register_gauge
+register_cache = registry.register_cache
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long callers wait for a connection"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            registry.observe('db_pool_wait_seconds', (), time.perf_counter() - start)
+
+
+def current_endpoint():
+    if has_request_context():
+        return request.endpoint or 'unknown'
+    return 'background'
+
+
+def before_request():
+    g._metrics_start = time.perf_counter()
+    registry.inc('http_requests_in_flight')
+
+
+def after_request(response):
+    g._metrics_status = response.status_code
+    return response
+
+
+def teardown_request(exc=None):
+    start = g.pop('_metrics_start', None)
+    if start is None:
+        return
+    registry.inc('http_requests_in_flight', amount=-1)
+    endpoint = current_endpoint()
+    status = g.pop('_metrics_status', 500)
+    registry.observe(
+        'http_request_duration_seconds', _labels(endpoint=endpoint, method=request.method),
+        time.perf_counter() - start
+    )
+    registry.inc('http_requests_total', _labels(endpoint=endpoint, method=request.method, status=status))
+
+
+def metrics_view():
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(403)
+    return Response(registry.render(registry.collect()), mimetype='text/plain; version=0.0.4')
+
+
+def instrument_engine(engine):
+    @event.listens_for(engine, 'before_cursor_execute')
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        registry.inc('db_statements_total', _labels(endpoint=current_endpoint()))
+
+    @event.listens_for(engine, 'checkout')
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info['metrics_checkout'] = time.perf_counter()
+
+    @event.listens_for(engine, 'checkin')
+    def checkin(dbapi_connection, connection_record):
+        start = connection_record.info.pop('metrics_checkout', None)
+        if start is not None:
+            registry.observe('db_pool_hold_seconds', (), time.perf_counter() - start)
+
+
+def init_app(app, scheduler):
+    """Call before db.init_app so the engine is created with the timed pool"""
+    registry.directory = app.config['METRICS_DIR']
+    os.makedirs(registry.directory, exist_ok=True)
+    buckets = app.config['METRICS_LATENCY_BUCKETS']
+    registry.describe('http_request_duration_seconds', 'histogram', 'Request latency by endpoint', buckets)
+    registry.describe('http_requests_total', 'counter', 'Requests by endpoint, method and status')
+    registry.describe('http_requests_in_flight', 'gauge', 'Requests currently being handled')
+    registry.describe('db_statements_total', 'counter', 'SQL statements executed by endpoint')
+    registry.describe('db_pool_wait_seconds', 'histogram', 'Time spent waiting for a pooled connection', buckets)
+    registry.describe('db_pool_hold_seconds', 'histogram', 'Time a pooled connection was checked out', buckets)
+    registry.describe('cache_hits_total', 'counter', 'Cache hits by cache')
+    registry.describe('cache_misses_total', 'counter', 'Cache misses by cache')
+
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    if not (url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')):
+        options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+        options.setdefault('poolclass', TimedQueuePool)
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.teardown_request(teardown_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+    scheduler.add_job('metrics.flush', registry.flush, app.config['METRICS_FLUSH_INTERVAL'])
+    atexit.register(registry.flush)
+
+
+def init_engine(app):
+    with app.app_context():
+        instrument_engine(db.engine)
@@ -0,0 +1,56 @@
+"""Add materialized path and depth to comments
+
+Revision ID: b7d91c3e5f20
+Revises: 8c2f4e1a9b37
+Create Date: 2026-10-18 10:03:17.442981
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d91c3e5f20'
+down_revision = '8c2f4e1a9b37'
+branch_labels = None
+depends_on = None
+
+PATH_SEGMENT_WIDTH = 10
+
+
+def upgrade():
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('path', sa.String(length=255), nullable=True))
+        batch_op.add_column(sa.Column('depth', sa.Integer(), nullable=False, server_default='0'))
+
+    # Backfill: parents always have smaller ids than their replies, so one pass in id order suffices
+    comment = sa.table('comment',
+        sa.column('id', sa.Integer),
+        sa.column('parent_id', sa.Integer),
+        sa.column('path', sa.String),
+        sa.column('depth', sa.Integer)
+    )
+    connection = op.get_bind()
+    paths = {}
+    rows = connection.execute(sa.select(comment.c.id, comment.c.parent_id).order_by(comment.c.id)).all()
+    for comment_id, parent_id in rows:
+        parent_path, parent_depth = paths.get(parent_id, ('', -1))
+        paths[comment_id] = (parent_path + f'{comment_id:0{PATH_SEGMENT_WIDTH}d}/', parent_depth + 1)
+    if paths:
+        connection.execute(
+            comment.update().where(comment.c.id == sa.bindparam('comment_id')).values(
+                path=sa.bindparam('new_path'), depth=sa.bindparam('new_depth')
+            ),
+            [{'comment_id': comment_id, 'new_path': path, 'new_depth': depth}
+             for comment_id, (path, depth) in paths.items()]
+        )
+
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.create_index('ix_comment_post_path', ['post_id', 'path'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.drop_index('ix_comment_post_path')
+        batch_op.drop_column('depth')
+        batch_op.drop_column('path')
@@ -0,0 +1,29 @@
+"""Add a version to cached session user snapshots
+
+Revision ID: c3e8a1f5b297
+Revises: 5b9e2d7c1a84
+Create Date: 2026-10-18 23:40:12.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3e8a1f5b297'
+down_revision = '5b9e2d7c1a84'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user_session_state', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('snapshot_version', sa.Integer(), nullable=False, server_default='0'))
+
+    # Existing snapshots include password_hash, which is no longer cached
+    op.execute("UPDATE user_session_state SET snapshot = NULL")
+
+
+def downgrade():
+    with op.batch_alter_table('user_session_state', schema=None) as batch_op:
+        batch_op.drop_column('snapshot_version')
@@ -0,0 +1,37 @@
+"""Redact draft and scheduled posts already in the change log
+
+Revision ID: e7b4c2d9f013
+Revises: c3e8a1f5b297
+Create Date: 2026-10-19 10:12:47.503118
+
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b4c2d9f013'
+down_revision = 'c3e8a1f5b297'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Entries written before unpublished posts were redacted carry their content
+    connection = op.get_bind()
+    change_log = sa.table('change_log', sa.column('id', sa.Integer), sa.column('entity', sa.String),
+                          sa.column('payload', sa.Text))
+    rows = connection.execute(sa.select(change_log.c.id, change_log.c.payload).where(change_log.c.entity == 'post'))
+    for change_id, payload in rows.all():
+        data = json.loads(payload) if payload else {}
+        if data.get('status', 'published') != 'published':
+            connection.execute(change_log.update().where(change_log.c.id == change_id).values(
+                payload=json.dumps({'id': data.get('id'), 'status': data['status']})
+            ))
+
+
+def downgrade():
+    # The redacted content is gone
+    pass
@@ -1,11 +1,28 @@
+import json
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
+from flask import abort, current_app
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.query import Query
 from flask_login import UserMixin
+from sqlalchemy.orm.attributes import set_committed_value
 
 # Create db instance that will be imported by app.py
 db = SQLAlchemy()
 
+class ArchiveQuery(Query):
+    """Query whose get_or_404 looks in the archive tables before giving up (see archive.py)"""
+    
+    def get_or_404(self, ident, description=None):
+        rv = self.get(ident)
+        if rv is None:
+            find_archived = current_app.extensions.get('archive.find')
+            if find_archived is not None:
+                rv = find_archived(self.column_descriptions[0]['entity'], ident)
+        if rv is None:
+            abort(404, description=description)
+        return rv
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -32,6 +49,9 @@ class User(UserMixin, db.Model):
     profile_public = db.Column(db.Boolean, default=True)
     show_email = db.Column(db.Boolean, default=False)
     
+    # Denormalized so feed reads can tell fanned-out authors from pulled ones without counting
+    follower_count = db.Column(db.Integer, default=0, nullable=False)
+    
     # Relationship with posts
     posts = db.relationship('Post', backref='author', lazy='dynamic')
     
@@ -61,6 +81,35 @@ class User(UserMixin, db.Model):
             return True
         return False
     
+    # Precomputed counters, written by the mapper events at the bottom of this module
+    stats = db.relationship('UserStats', uselist=False, viewonly=True)
+    
+    # Relationships with follows
+    following = db.relationship('Follow', foreign_keys='Follow.follower_id', backref='follower', lazy='dynamic')
+    followers = db.relationship('Follow', foreign_keys='Follow.followed_id', backref='followed', lazy='dynamic')
+    
+    def is_following(self, user):
+        return db.session.get(Follow, (self.id, user.id)) is not None
+    
+    def follow(self, user):
+        if user.id == self.id or self.is_following(user):
+            return None
+        follow = Follow(follower_id=self.id, followed_id=user.id)
+        db.session.add(follow)
+        User.query.filter_by(id=user.id).update({User.follower_count: User.follower_count + 1})
+        return follow
+    
+    def unfollow(self, user):
+        follow = db.session.get(Follow, (self.id, user.id))
+        if follow:
+            db.session.delete(follow)
+            User.query.filter_by(id=user.id).update({User.follower_count: User.follower_count - 1})
+            return True
+        return False
+    
+    def get_following_count(self):
+        return self.following.count()
+    
     def get_liked_posts(self, limit=None):
         query = Post.query.join(Like).filter(Like.user_id == self.id).order_by(Like.created_at.desc())
         if limit:
@@ -68,7 +117,7 @@ class User(UserMixin, db.Model):
         return query.all()
     
     def get_liked_posts_count(self):
-        return self.liked_posts.count()
+        return self.get_stats().likes_given
     
     @property
     def full_name(self):
@@ -90,15 +139,24 @@ class User(UserMixin, db.Model):
         db.session.commit()
     
     def get_post_count(self):
-        return self.posts.count()
+        return self.get_stats().post_count
+    
+    def get_stats(self):
+        return self.stats or UserStats.empty(self.id)
     
     def get_recent_posts(self, limit=5):
-        return self.posts.order_by(Post.created_at.desc()).limit(limit).all()
+        return self.posts.filter(Post.status == Post.PUBLISHED).order_by(Post.published_at.desc()).limit(limit).all()
     
     def __repr__(self):
         return f'<User {self.username}>'
 
+def published_at_default(context):
+    """Posts inserted as published go live now; drafts and scheduled posts get theirs later"""
+    return datetime.utcnow() if context.get_current_parameters()['status'] == 'published' else None
+
 class Post(db.Model):
+    query_class = ArchiveQuery
+    
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     content = db.Column(db.Text, nullable=False)
@@ -108,12 +166,55 @@ class Post(db.Model):
     # Foreign key to User
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     
+    # Drafts and scheduled posts are seen only by their author until publishing.publish
+    # makes them public; published_at is the due time while scheduled
+    status = db.Column(db.String(10), nullable=False, default='published', server_default='published')
+    published_at = db.Column(db.DateTime, default=published_at_default)
+    allow_comments = db.Column(db.Boolean, nullable=False, default=True, server_default=db.true())
+    
+    DRAFT, SCHEDULED, PUBLISHED = 'draft', 'scheduled', 'published'
+    
+    archived = False  # True for the read-only ArchivedPost copies
+    
     # Relationship with comments
     comments = db.relationship('Comment', backref='post', lazy='dynamic', cascade='all, delete-orphan')
     
     # Relationship with likes
     likes = db.relationship('Like', backref='post', lazy='dynamic', cascade='all, delete-orphan')
     
+    # Stored trending score, maintained by trending.update_scores
+    trending_score = db.relationship('PostScore', backref='post', uselist=False, cascade='all, delete-orphan')
+    
+    # View counts, flushed in bulk from per-worker buffers by analytics.flush
+    view_stats = db.relationship('PostViewStats', lazy='dynamic', cascade='all, delete-orphan')
+    view_total = db.relationship('PostViewTotal', uselist=False, cascade='all, delete-orphan')
+    
+    # Tags; links are edited through tags.set_post_tags so the per-tag counts stay current
+    tag_links = db.relationship('PostTag', backref='post', cascade='all, delete-orphan')
+    tags = db.relationship('Tag', secondary='post_tag', viewonly=True, lazy='selectin', order_by='Tag.name')
+    
+    # Earlier versions, written by revisions.record_revision
+    revisions = db.relationship('PostRevision', backref='post', lazy='dynamic', cascade='all, delete-orphan')
+    
+    # Uploaded images and files, shared between posts when the content is identical
+    attachments = db.relationship('Upload', secondary='post_attachment', lazy='selectin',
+                                  order_by='Upload.id')
+    
+    # (status, published_at) serves both the public listings, read newest first, and the
+    # publish job's due queue, a range scan over the scheduled entries only
+    __table_args__ = (
+        db.Index('ix_post_user_created', 'user_id', 'created_at'),
+        db.Index('ix_post_status_published', 'status', 'published_at'),
+        db.Index('ix_post_user_status_published', 'user_id', 'status', 'published_at'),
+    )
+    
+    @property
+    def is_published(self):
+        return self.status == Post.PUBLISHED
+    
+    def is_visible_to(self, user):
+        return self.is_published or (user is not None and user.is_authenticated and user.id == self.user_id)
+    
     def get_comment_count(self):
         return self.comments.filter_by(parent_id=None).count()
     
@@ -123,6 +224,11 @@ class Post(db.Model):
     def get_top_level_comments(self):
         return self.comments.filter_by(parent_id=None).order_by(Comment.created_at.asc()).all()
     
+    def get_comments_page(self, after=None, limit=10):
+        """Return one keyset page of top-level comments and the cursor for the next page"""
+        query = self.comments.filter_by(parent_id=None)
+        return Comment.paginate_after(query, after, limit)
+    
     def get_like_count(self):
         return self.likes.count()
     
@@ -151,7 +257,226 @@ class Like(db.Model):
     def __repr__(self):
         return f'<Like {self.id}: User {self.user_id} likes Post {self.post_id}>'
 
+class Upload(db.Model):
+    """A stored file, addressed by the SHA-256 of its content"""
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), nullable=False)
+    ext = db.Column(db.String(10), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    content_type = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (db.UniqueConstraint('sha256', 'ext', name='unique_upload_content'),)
+    
+    @property
+    def filename(self):
+        return f'{self.sha256}.{self.ext}'
+    
+    @property
+    def is_image(self):
+        return self.ext in ('png', 'jpg', 'jpeg', 'gif')
+    
+    def variant_filename(self, variant):
+        return f'{self.sha256}_{variant}.{self.ext}'
+    
+    def __repr__(self):
+        return f'<Upload {self.sha256[:12]}.{self.ext}>'
+
+post_attachment = db.Table('post_attachment',
+    db.Column('post_id', db.Integer, db.ForeignKey('post.id'), primary_key=True),
+    db.Column('upload_id', db.Integer, db.ForeignKey('upload.id'), primary_key=True)
+)
+
+class Tag(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(30), unique=True, nullable=False)  # normalized by tags.parse_tags
+    post_count = db.Column(db.Integer, nullable=False, default=0, index=True)  # kept by the PostTag events
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<Tag {self.name}: {self.post_count}>'
+
+class PostTag(db.Model):
+    """A tag on a post; the primary key finds a post's tags, the tag index a tag's posts"""
+    __tablename__ = 'post_tag'
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), primary_key=True)
+    tag_id = db.Column(db.Integer, db.ForeignKey('tag.id'), primary_key=True)
+    
+    tag = db.relationship('Tag')
+    
+    __table_args__ = (db.Index('ix_post_tag_tag_post', 'tag_id', 'post_id'),)
+    
+    def __repr__(self):
+        return f'<PostTag {self.post_id}:{self.tag_id}>'
+
+class Follow(db.Model):
+    follower_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    followed_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # The primary key covers "who do I follow", this covers "who follows me" for fan-out
+    __table_args__ = (db.Index('ix_follow_followed', 'followed_id', 'follower_id'),)
+    
+    def __repr__(self):
+        return f'<Follow {self.follower_id} -> {self.followed_id}>'
+
+class TimelineEntry(db.Model):
+    """A post delivered to a follower's home feed, written when the post is published"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False)  # the post's published_at
+    
+    __table_args__ = (db.Index('ix_timeline_user_created', 'user_id', 'created_at', 'post_id'),)
+    
+    def __repr__(self):
+        return f'<TimelineEntry {self.user_id}: Post {self.post_id}>'
+
+class PostScore(db.Model):
+    """Time-decayed popularity of a post, stored as log(sum(weight * e^((t - epoch) / tau))).
+    
+    Normalizing every event to a fixed epoch means old scores never need decaying:
+    the ranking is the same as with decay applied at read time, so new activity can
+    simply be added in with logaddexp.
+    """
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (db.Index('ix_post_score_rank', 'score', 'post_id'),)
+    
+    def get_cursor(self):
+        return f'{self.score!r}|{self.post_id}'
+    
+    @staticmethod
+    def parse_cursor(cursor):
+        score, post_id = cursor.rsplit('|', 1)
+        return float(score), int(post_id)
+    
+    def __repr__(self):
+        return f'<PostScore {self.post_id}: {self.score}>'
+
+class ViewCounterMixin:
+    """Views and a HyperLogLog sketch of distinct visitors, merged in by analytics.flush"""
+    views = db.Column(db.Integer, nullable=False, default=0)
+    uniques = db.Column(db.Integer, nullable=False, default=0)  # estimate from the sketch, kept for reads
+    sketch = db.Column(db.LargeBinary, nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=0)  # compare-and-set guard for sketch merges
+
+class PostViewStats(ViewCounterMixin, db.Model):
+    """Views of a post on one day (UTC)"""
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    
+    def __repr__(self):
+        return f'<PostViewStats {self.post_id} {self.day}: {self.views} views>'
+
+class PostViewTotal(ViewCounterMixin, db.Model):
+    """All-time views of a post; unique visitors can't be summed across days, so they're merged here"""
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), primary_key=True)
+    
+    def __repr__(self):
+        return f'<PostViewTotal {self.post_id}: {self.views} views>'
+
+class PostRevision(db.Model):
+    """One saved version of a post.
+
+    Content is stored zlib-compressed, either in full (a snapshot) or as a line
+    delta against the previous revision of the same post; see revisions.py.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
+    number = db.Column(db.Integer, nullable=False)  # 1 for the original; may have gaps after compaction
+    title = db.Column(db.String(200), nullable=False)
+    is_snapshot = db.Column(db.Boolean, nullable=False, default=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    size = db.Column(db.Integer, nullable=False)  # length of the full content in characters
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (db.UniqueConstraint('post_id', 'number', name='uq_post_revision_number'),)
+    
+    def __repr__(self):
+        return f'<PostRevision {self.post_id}#{self.number}>'
+
+class UserSession(db.Model):
+    """Server-side session data, used when SESSION_STORE = 'sql'"""
+    sid = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.Text, nullable=False)
+    user_id = db.Column(db.Integer, nullable=True)
+    generation = db.Column(db.Integer, nullable=False, default=0)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f'<UserSession {self.sid[:8]} user={self.user_id}>'
+
+class UserSessionState(db.Model):
+    """Per-user session generation (bumped to revoke all sessions) and cached user snapshot"""
+    user_id = db.Column(db.Integer, primary_key=True)
+    generation = db.Column(db.Integer, nullable=False, default=0)
+    snapshot = db.Column(db.Text, nullable=True)
+    snapshot_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # bumped on invalidation
+    
+    def __repr__(self):
+        return f'<UserSessionState {self.user_id}: generation {self.generation}>'
+
+class UserStats(db.Model):
+    """Per-user counters for profile pages, kept current on every write and rebuilt by 'flask stats rebuild'"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    post_count = db.Column(db.Integer, nullable=False, default=0)
+    comment_count = db.Column(db.Integer, nullable=False, default=0)  # comments written
+    likes_given = db.Column(db.Integer, nullable=False, default=0)
+    likes_received = db.Column(db.Integer, nullable=False, default=0)
+    comments_received = db.Column(db.Integer, nullable=False, default=0)
+    last_post_at = db.Column(db.DateTime)
+    
+    COUNTERS = ('post_count', 'comment_count', 'likes_given', 'likes_received', 'comments_received')
+    
+    @classmethod
+    def empty(cls, user_id):
+        return cls(user_id=user_id, **{name: 0 for name in cls.COUNTERS})
+    
+    def __repr__(self):
+        return f'<UserStats {self.user_id}: {self.post_count} posts>'
+
+class JobCheckpoint(db.Model):
+    """Position reached by an incremental background job, e.g. the last processed row id"""
+    name = db.Column(db.String(100), primary_key=True)
+    position = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<JobCheckpoint {self.name}: {self.position}>'
+
+class ChangeLog(db.Model):
+    """Outbox of row changes to posts, comments and likes, written in the same transaction.
+
+    Consumers keep the last id they processed and read forward from it.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)  # 'post', 'comment' or 'like'
+    entity_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)  # 'insert', 'update' or 'delete'
+    # JSON of the row after the change (before it, for deletes); just id and status for unpublished posts
+    payload = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    __table_args__ = (db.Index('ix_change_log_entity_id', 'entity', 'id'),)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'entity': self.entity,
+            'entity_id': self.entity_id,
+            'op': self.op,
+            'data': json.loads(self.payload) if self.payload else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        }
+    
+    def __repr__(self):
+        return f'<ChangeLog {self.id}: {self.op} {self.entity} {self.entity_id}>'
+
 class Comment(db.Model):
+    query_class = ArchiveQuery
+    
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -167,22 +492,361 @@ class Comment(db.Model):
     replies = db.relationship('Comment', backref=db.backref('parent', remote_side=[id]), 
                              lazy='dynamic', cascade='all, delete-orphan')
     
+    # Materialized path: zero-padded ids from the root down to this comment, e.g. '0000000004/0000000009/'
+    path = db.Column(db.String(255))
+    depth = db.Column(db.Integer, default=0, nullable=False)
+    
+    # Indexes backing keyset pagination of top-level comments and subtree range scans
+    __table_args__ = (
+        db.Index('ix_comment_post_parent_created', 'post_id', 'parent_id', 'created_at', 'id'),
+        db.Index('ix_comment_parent_created', 'parent_id', 'created_at', 'id'),
+        db.Index('ix_comment_post_path', 'post_id', 'path'),
+    )
+    
+    PATH_SEGMENT_WIDTH = 10
+    
+    archived = False  # True for the read-only ArchivedComment copies
+    
+    @staticmethod
+    def path_segment(comment_id):
+        return f'{comment_id:0{Comment.PATH_SEGMENT_WIDTH}d}/'
+    
+    @staticmethod
+    def path_upper_bound(path):
+        """Smallest string greater than every path under the given prefix ('/' sorts just before '0')"""
+        return path[:-1] + '0'
+    
+    def _descendants_query(self):
+        model = type(self)
+        return model.query.filter(
+            model.post_id == self.post_id,
+            model.path > self.path,
+            model.path < Comment.path_upper_bound(self.path)
+        )
+    
     def get_replies(self):
-        return self.replies.order_by(Comment.created_at.asc()).all()
+        return self.replies.order_by(type(self).created_at.asc()).all()
     
     def get_replies_count(self):
         return self.replies.count()
     
+    def get_descendants(self):
+        """Whole reply thread under this comment in display order, as one index range scan"""
+        return self._descendants_query().order_by(type(self).path.asc()).all()
+    
+    def get_descendants_count(self):
+        return self._descendants_query().count()
+    
+    def has_descendants(self):
+        return self._descendants_query().first() is not None
+    
+    def get_descendants_page(self, after=None, limit=10):
+        """Keyset page of the reply thread, using the (unique, ordered) path as the cursor"""
+        model = type(self)
+        query = self._descendants_query()
+        if after:
+            if not after.startswith(self.path):
+                raise ValueError(f'Cursor {after!r} is outside this thread')
+            query = query.filter(model.path > after)
+        replies = query.order_by(model.path.asc()).limit(limit + 1).all()
+        next_cursor = replies[limit - 1].path if len(replies) > limit else None
+        return replies[:limit], next_cursor
+    
+    def get_cursor(self):
+        return f'{self.created_at.isoformat()}|{self.id}'
+    
+    @staticmethod
+    def parse_cursor(cursor):
+        """Turn a cursor string back into a (created_at, id) tuple, raising ValueError if malformed"""
+        created_at, comment_id = cursor.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(comment_id)
+    
+    @staticmethod
+    def paginate_after(query, after, limit):
+        """Keyset pagination on (created_at, id) so deep pages cost the same as the first"""
+        model = query.column_descriptions[0]['entity']  # Comment or ArchivedComment
+        if after:
+            query = query.filter(db.tuple_(model.created_at, model.id) > Comment.parse_cursor(after))
+        comments = query.order_by(model.created_at.asc(), model.id.asc()).limit(limit + 1).all()
+        next_cursor = comments[limit - 1].get_cursor() if len(comments) > limit else None
+        return comments[:limit], next_cursor
+    
+    @staticmethod
+    def get_reply_previews(comments, limit=3):
+        """Thread sizes and the first few replies of each thread for a page of top-level comments"""
+        previews = {comment.id: {'count': 0, 'replies': []} for comment in comments}
+        if not comments:
+            return previews
+        
+        model = type(comments[0])  # Comment or ArchivedComment
+        roots = {comment.path: comment.id for comment in comments}
+        root_path = db.func.substr(model.path, 1, Comment.PATH_SEGMENT_WIDTH + 1)
+        in_threads = (
+            model.post_id == comments[0].post_id,
+            model.path > min(roots),
+            model.path < Comment.path_upper_bound(max(roots)),
+            model.depth > 0,
+            root_path.in_(list(roots))
+        )
+        
+        counts = db.session.query(root_path, db.func.count(model.id)).filter(*in_threads).group_by(root_path)
+        for path, count in counts:
+            previews[roots[path]]['count'] = count
+        
+        position = db.func.row_number().over(partition_by=root_path, order_by=model.path.asc()).label('position')
+        ranked = db.session.query(model.id, position).filter(*in_threads).subquery()
+        replies = model.query.join(ranked, model.id == ranked.c.id).filter(
+            ranked.c.position <= limit
+        ).order_by(model.path.asc())
+        for reply in replies:
+            previews[roots[reply.path[:Comment.PATH_SEGMENT_WIDTH + 1]]]['replies'].append(reply)
+        return previews
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'content': self.content,
+            'author': self.author.username,
+            'author_avatar': self.author.avatar,
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'parent_id': self.parent_id,
+            'depth': self.depth
+        }
+    
     def is_reply(self):
         return self.parent_id is not None
     
     def get_thread_depth(self):
-        depth = 0
-        parent = self.parent
-        while parent:
-            depth += 1
-            parent = parent.parent
-        return depth
+        return self.depth
     
     def __repr__(self):
-        return f'<Comment {self.id} by {self.author.username}>'
\ No newline at end of file
+        return f'<Comment {self.id} by {self.author.username}>'
+
+def archive_table(table, *indexes):
+    """Cold copy of a table: the same columns without foreign keys, for rows moved by archive.py"""
+    columns = [db.Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable,
+                         server_default=column.server_default.arg if column.server_default else None,
+                         autoincrement=False) for column in table.columns]
+    return db.Table(f'archived_{table.name}', *columns, *indexes)
+
+# Old posts and everything that belongs to them. Reads go to the Archived* classes below;
+# writes to an archived post move it back into the tables above first (see archive.py).
+archived_post = archive_table(Post.__table__, db.Index('ix_archived_post_user', 'user_id'))
+archived_comment = archive_table(
+    Comment.__table__,
+    db.Index('ix_archived_comment_post', 'post_id'),
+    db.Index('ix_archived_comment_user', 'user_id'),
+)
+archived_like = archive_table(
+    Like.__table__,
+    db.Index('ix_archived_like_post', 'post_id'),
+    db.Index('ix_archived_like_user', 'user_id'),
+)
+archived_post_tag = archive_table(PostTag.__table__)
+archived_post_attachment = archive_table(post_attachment)
+archived_post_revision = archive_table(PostRevision.__table__, db.Index('ix_archived_post_revision_post', 'post_id'))
+archived_post_view_total = archive_table(PostViewTotal.__table__)
+
+
+class ArchivedLike(db.Model):
+    __table__ = archived_like
+
+
+class ArchivedPostViewTotal(db.Model):
+    __table__ = archived_post_view_total
+
+
+class ArchivedPostRevision(db.Model):
+    __table__ = archived_post_revision
+
+
+class ArchivedComment(Comment):
+    """A comment on an archived post, loaded for reading only"""
+    __table__ = archived_comment
+    __mapper_args__ = {'concrete': True}
+    
+    archived = True
+    
+    author = db.relationship('User', primaryjoin='foreign(ArchivedComment.user_id) == User.id', viewonly=True)
+    replies = db.relationship('ArchivedComment', primaryjoin='ArchivedComment.id == foreign(ArchivedComment.parent_id)',
+                              lazy='dynamic', viewonly=True)
+
+
+class ArchivedPost(Post):
+    """An archived post, loaded for reading only, so that opening one writes nothing.
+
+    Post's methods work on it because its relationships point at the archive
+    tables; attributes of hot-only rows (trending_score, view_stats, tag_links)
+    are not mapped.
+    """
+    __table__ = archived_post
+    __mapper_args__ = {'concrete': True}
+    
+    archived = True
+    
+    author = db.relationship('User', primaryjoin='foreign(ArchivedPost.user_id) == User.id', viewonly=True)
+    comments = db.relationship('ArchivedComment', primaryjoin='ArchivedPost.id == foreign(ArchivedComment.post_id)',
+                               lazy='dynamic', viewonly=True)
+    likes = db.relationship('ArchivedLike', primaryjoin='ArchivedPost.id == foreign(ArchivedLike.post_id)',
+                            lazy='dynamic', viewonly=True)
+    view_total = db.relationship('ArchivedPostViewTotal', uselist=False, viewonly=True,
+                                 primaryjoin='ArchivedPost.id == foreign(ArchivedPostViewTotal.post_id)')
+    tags = db.relationship('Tag', secondary=archived_post_tag, viewonly=True, lazy='selectin', order_by='Tag.name',
+                           primaryjoin=lambda: ArchivedPost.id == db.foreign(archived_post_tag.c.post_id),
+                           secondaryjoin=lambda: Tag.id == db.foreign(archived_post_tag.c.tag_id))
+    revisions = db.relationship('ArchivedPostRevision', lazy='dynamic', viewonly=True,
+                                primaryjoin='ArchivedPost.id == foreign(ArchivedPostRevision.post_id)')
+    attachments = db.relationship('Upload', secondary=archived_post_attachment, viewonly=True, lazy='selectin',
+                                  order_by='Upload.id',
+                                  primaryjoin=lambda: ArchivedPost.id == db.foreign(archived_post_attachment.c.post_id),
+                                  secondaryjoin=lambda: Upload.id == db.foreign(archived_post_attachment.c.upload_id))
+
+
+@db.event.listens_for(Comment, 'after_insert')
+def set_comment_path(mapper, connection, target):
+    """Derive path and depth from the parent row once the new comment has its id"""
+    comments = Comment.__table__
+    path, depth = '', 0
+    if target.parent_id is not None:
+        parent = connection.execute(
+            db.select(comments.c.path, comments.c.depth).where(comments.c.id == target.parent_id)
+        ).one()
+        path, depth = parent.path, parent.depth + 1
+    path += Comment.path_segment(target.id)
+    
+    # Assigning updated_at to itself keeps its onupdate hook from marking the comment as edited
+    connection.execute(comments.update().where(comments.c.id == target.id).values(
+        path=path, depth=depth, updated_at=comments.c.updated_at
+    ))
+    set_committed_value(target, 'path', path)
+    set_committed_value(target, 'depth', depth)
+
+
+@db.event.listens_for(Post, 'after_delete')
+def remove_post_from_timelines(mapper, connection, target):
+    connection.execute(TimelineEntry.__table__.delete().where(TimelineEntry.post_id == target.id))
+
+
+def bump_user_stats(connection, user_id, **deltas):
+    """Add deltas to a user's counters, creating the row on first use"""
+    if user_id is None:
+        return
+    stats = UserStats.__table__
+    values = {name: stats.c[name] + delta for name, delta in deltas.items()}
+    if connection.execute(stats.update().where(stats.c.user_id == user_id).values(**values)).rowcount:
+        return
+    row = {name: 0 for name in UserStats.COUNTERS}
+    row.update(deltas)
+    connection.execute(stats.insert().values(user_id=user_id, **row))
+
+
+def post_author_id(connection, post_id):
+    return connection.execute(db.select(Post.user_id).where(Post.id == post_id)).scalar()
+
+
+def post_is_published(connection, post_id):
+    return connection.execute(db.select(Post.status).where(Post.id == post_id)).scalar() == Post.PUBLISHED
+
+
+def count_published_post(connection, post_id, user_id, published_at):
+    """Counters for a post going public: its author's post count and latest post, and its tags"""
+    bump_user_stats(connection, user_id, post_count=1)
+    stats = UserStats.__table__
+    connection.execute(stats.update().where(stats.c.user_id == user_id).values(
+        last_post_at=db.case((stats.c.last_post_at > published_at, stats.c.last_post_at), else_=published_at)
+    ))
+    tagged = db.select(PostTag.tag_id).where(PostTag.post_id == post_id)
+    connection.execute(Tag.__table__.update().where(Tag.id.in_(tagged)).values(post_count=Tag.post_count + 1))
+
+
+@db.event.listens_for(Post, 'after_insert')
+def count_post(mapper, connection, target):
+    if target.status == Post.PUBLISHED:
+        count_published_post(connection, target.id, target.user_id, target.published_at)
+
+
+@db.event.listens_for(Post, 'after_delete')
+def uncount_post(mapper, connection, target):
+    if target.status != Post.PUBLISHED:
+        return
+    bump_user_stats(connection, target.user_id, post_count=-1)
+    stats = UserStats.__table__
+    latest = db.select(db.func.max(Post.published_at)).where(
+        Post.user_id == target.user_id, Post.status == Post.PUBLISHED
+    ).scalar_subquery()
+    connection.execute(stats.update().where(stats.c.user_id == target.user_id).values(last_post_at=latest))
+
+
+@db.event.listens_for(Comment, 'after_insert')
+def count_comment(mapper, connection, target):
+    bump_user_stats(connection, target.user_id, comment_count=1)
+    bump_user_stats(connection, post_author_id(connection, target.post_id), comments_received=1)
+
+
+@db.event.listens_for(Comment, 'after_delete')
+def uncount_comment(mapper, connection, target):
+    bump_user_stats(connection, target.user_id, comment_count=-1)
+    bump_user_stats(connection, post_author_id(connection, target.post_id), comments_received=-1)
+
+
+@db.event.listens_for(Like, 'after_insert')
+def count_like(mapper, connection, target):
+    bump_user_stats(connection, target.user_id, likes_given=1)
+    bump_user_stats(connection, post_author_id(connection, target.post_id), likes_received=1)
+
+
+@db.event.listens_for(Like, 'after_delete')
+def uncount_like(mapper, connection, target):
+    bump_user_stats(connection, target.user_id, likes_given=-1)
+    bump_user_stats(connection, post_author_id(connection, target.post_id), likes_received=-1)
+
+
+# Tags count published posts only; a draft's tags are counted when it is published
+@db.event.listens_for(PostTag, 'after_insert')
+def count_tagged_post(mapper, connection, target):
+    if post_is_published(connection, target.post_id):
+        connection.execute(Tag.__table__.update().where(Tag.id == target.tag_id).values(
+            post_count=Tag.post_count + 1
+        ))
+
+
+@db.event.listens_for(PostTag, 'after_delete')
+def uncount_tagged_post(mapper, connection, target):
+    if post_is_published(connection, target.post_id):
+        connection.execute(Tag.__table__.update().where(Tag.id == target.tag_id).values(
+            post_count=Tag.post_count - 1
+        ))
+
+
+@db.event.listens_for(User, 'after_delete')
+def remove_user_stats(mapper, connection, target):
+    connection.execute(UserStats.__table__.delete().where(UserStats.user_id == target.id))
+
+
+# All a change log reader learns about a draft or scheduled post; publishing logs the full row
+UNPUBLISHED_POST_FIELDS = ('id', 'status')
+
+
+def record_change(entity, op):
+    """Mapper event handler that appends the row to the change log on the flush's connection"""
+    def handler(mapper, connection, target):
+        if op == 'update':
+            state = db.inspect(target)
+            if not any(state.attrs[attr.key].history.has_changes() for attr in mapper.column_attrs):
+                return
+        if entity == 'post' and target.status != Post.PUBLISHED:
+            payload = {key: getattr(target, key) for key in UNPUBLISHED_POST_FIELDS}
+        else:
+            payload = {attr.key: getattr(target, attr.key) for attr in mapper.column_attrs}
+        connection.execute(ChangeLog.__table__.insert().values(
+            entity=entity, entity_id=target.id, op=op, payload=json.dumps(payload, default=str),
+            created_at=datetime.utcnow()
+        ))
+    return handler
+
+
+# Registered after set_comment_path so inserted comments are logged with their path and depth
+for _model, _entity in ((Post, 'post'), (Comment, 'comment'), (Like, 'like')):
+    for _op in ('insert', 'update', 'delete'):
+        db.event.listen(_model, f'after_{_op}', record_change(_entity, _op))
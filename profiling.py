@@ -0,0 +1,209 @@
+import cProfile
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+import click
+from flask import current_app, g, request
+from flask.cli import AppGroup
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+MODES = ('cprofile', 'sampling')
+TOGGLE_FILE = 'enabled.json'
+
+# From Python 3.12 cProfile can only be enabled once per process, not once per thread
+_cprofile_lock = threading.Lock()
+
+
+class SamplingProfiler:
+    """Samples one thread's stack from a helper thread; output is in collapsed-stack format"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        target = threading.get_ident()
+        self._thread = threading.Thread(target=self._run, args=(target,), name='profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self, target):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+class CProfiler:
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        """Returns False when another request (or another tool) is already using cProfile"""
+        if not _cprofile_lock.acquire(blocking=False):
+            return False
+        try:
+            self.profile.enable()
+        except ValueError:
+            _cprofile_lock.release()
+            return False
+        return True
+
+    def stop(self):
+        self.profile.disable()
+        _cprofile_lock.release()
+
+    def dump(self, path):
+        self.profile.dump_stats(path)
+
+
+class Profiler:
+    """Profiles selected requests: a signed header, an operator toggle, or random sampling.
+
+    Unprofiled requests pay for one header lookup, one dict lookup and, when
+    PROFILE_SAMPLE_RATE is set, one random number.
+    """
+
+    def __init__(self, app=None):
+        self.toggles = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['profiler'] = self
+        app.cli.add_command(profile_cli)
+        self.directory = app.config['PROFILE_DIR']
+        self.header = app.config['PROFILE_HEADER']
+        self.sample_rate = app.config['PROFILE_SAMPLE_RATE']
+        self.sample_mode = app.config['PROFILE_SAMPLE_MODE']
+        self.interval = app.config['PROFILE_SAMPLE_INTERVAL']
+        self.token_max_age = app.config['PROFILE_TOKEN_MAX_AGE']
+        self.serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'], salt='profile')
+        app.before_request(self.start)
+        app.teardown_request(self.finish)
+
+    def init_scheduler(self, scheduler, interval):
+        # Toggles live in a file so every worker sees them; each worker re-reads it periodically
+        self.refresh_toggles()
+        scheduler.add_job('profiling.refresh', self.refresh_toggles, interval)
+
+    def refresh_toggles(self):
+        try:
+            with open(os.path.join(self.directory, TOGGLE_FILE)) as f:
+                toggles = json.load(f)
+        except (FileNotFoundError, ValueError):
+            toggles = {}
+        now = time.time()
+        self.toggles = {endpoint: entry for endpoint, entry in toggles.items() if entry['until'] > now}
+
+    def make_token(self, mode):
+        return self.serializer.dumps(mode)
+
+    def choose_mode(self):
+        token = request.headers.get(self.header)
+        if token:
+            try:
+                return self.serializer.loads(token, max_age=self.token_max_age)
+            except BadSignature:
+                return None
+        if self.toggles:
+            entry = self.toggles.get(request.endpoint)
+            if entry and entry['until'] > time.time():
+                return entry['mode']
+        if self.sample_rate and random.random() < self.sample_rate:
+            return self.sample_mode
+        return None
+
+    def start(self):
+        mode = self.choose_mode()
+        if mode not in MODES:
+            return
+        profiler = CProfiler() if mode == 'cprofile' else None
+        if profiler is None or not profiler.start():
+            # cProfile is busy with another request, so sample this one instead
+            profiler = SamplingProfiler(self.interval)
+            profiler.start()
+        g._profiler = (profiler, time.perf_counter())
+
+    def finish(self, exc=None):
+        state = g.pop('_profiler', None)
+        if state is None:
+            return
+        profiler, started = state
+        profiler.stop()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        os.makedirs(self.directory, exist_ok=True)
+        name = '{}-{}-{:.0f}ms-{}-{}'.format(
+            time.strftime('%Y%m%d-%H%M%S'), request.endpoint or 'unknown', elapsed_ms,
+            os.getpid(), os.urandom(3).hex()
+        )
+        suffix = '.pstats' if isinstance(profiler, CProfiler) else '.collapsed'
+        path = os.path.join(self.directory, name + suffix)
+        profiler.dump(path)
+        current_app.logger.info('Profiled %s %s in %.0f ms -> %s', request.method, request.path, elapsed_ms, path)
+
+
+profiler = Profiler()
+
+profile_cli = AppGroup('profile', help='Profile requests in a running deployment.')
+
+
+@profile_cli.command('token')
+@click.option('--mode', type=click.Choice(MODES), default='cprofile')
+def token_command(mode):
+    """Print a signed value for the profiling header."""
+    click.echo(f'{profiler.header}: {profiler.make_token(mode)}')
+
+
+@profile_cli.command('on')
+@click.argument('endpoint')
+@click.option('--mode', type=click.Choice(MODES), default='sampling')
+@click.option('--minutes', type=float, default=5, help='How long to profile every request to ENDPOINT.')
+def on_command(endpoint, mode, minutes):
+    """Profile every request to ENDPOINT (e.g. blog.post) for a while."""
+    if endpoint not in current_app.view_functions:
+        raise click.ClickException(f'Unknown endpoint {endpoint}')
+    _update_toggles(lambda toggles: toggles.update({endpoint: {'mode': mode, 'until': time.time() + minutes * 60}}))
+    click.echo(f'Profiling {endpoint} ({mode}) for {minutes:g} minutes; output in {profiler.directory}')
+
+
+@profile_cli.command('off')
+@click.argument('endpoint', required=False)
+def off_command(endpoint):
+    """Stop profiling ENDPOINT, or every endpoint."""
+    _update_toggles(lambda toggles: toggles.pop(endpoint, None) if endpoint else toggles.clear())
+
+
+def _update_toggles(change):
+    path = os.path.join(profiler.directory, TOGGLE_FILE)
+    os.makedirs(profiler.directory, exist_ok=True)
+    try:
+        with open(path) as f:
+            toggles = json.load(f)
+    except (FileNotFoundError, ValueError):
+        toggles = {}
+    change(toggles)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(toggles, f)
+    os.replace(tmp_path, path)
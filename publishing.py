@@ -0,0 +1,76 @@
+from datetime import datetime
+
+from flask import abort, current_app
+from flask_login import current_user
+
+import feed
+from models import db, Post, count_published_post
+
+
+def published():
+    """Filter for public listings; pair with an order on Post.published_at to stay on its index"""
+    return Post.status == Post.PUBLISHED
+
+
+def get_visible_post_or_404(post_id):
+    """The post, unless it is a draft or scheduled post and the current user is not its author"""
+    post = Post.query.get_or_404(post_id)
+    if not post.is_visible_to(current_user):
+        abort(404)
+    return post
+
+
+def apply_form(post, form):
+    """Set a new or unpublished post's status from the form; True if it should be published now"""
+    if form.is_published.data:
+        return True
+    if form.publish_at.data:
+        post.status, post.published_at = Post.SCHEDULED, form.publish_at.data
+    else:
+        post.status, post.published_at = Post.DRAFT, None
+    return False
+
+
+def publish(post, when=None):
+    """Make a draft or scheduled post public and fan it out; False if it already was.
+
+    The status is claimed with a compare-and-set UPDATE first, so when several
+    workers pick up the same due post only one of them counts and fans it out.
+    Runs in the caller's transaction.
+    """
+    when = when or datetime.utcnow()
+    claimed = Post.query.filter(Post.id == post.id, Post.status != Post.PUBLISHED).update(
+        {Post.status: Post.PUBLISHED, Post.published_at: when}, synchronize_session=False
+    )
+    if not claimed:
+        return False
+    # Assigned again so the flush records the change for the change log readers
+    post.status, post.published_at = Post.PUBLISHED, when
+    count_published_post(db.session.connection(), post.id, post.user_id, when)
+    feed.fan_out(post)
+    return True
+
+
+def publish_due_posts():
+    """Publish scheduled posts whose time has come, scanning only the scheduled part of ix_post_status_published"""
+    batch_size = current_app.config['PUBLISH_BATCH']
+    published_count = 0
+    while True:
+        posts = Post.query.filter(
+            Post.status == Post.SCHEDULED, Post.published_at <= datetime.utcnow()
+        ).order_by(Post.published_at).limit(batch_size).all()
+        if not posts:
+            db.session.rollback()
+            break
+        for post in posts:
+            # Published at its scheduled time, not when this run happened to notice it
+            if publish(post, post.published_at):
+                published_count += 1
+        db.session.commit()
+        if len(posts) < batch_size:
+            break
+    return published_count
+
+
+def init_app(app, scheduler):
+    scheduler.add_job('publishing.publish_due', publish_due_posts, app.config['PUBLISH_INTERVAL'])
@@ -0,0 +1,145 @@
+"""Token-bucket rate limits for the endpoints in RATELIMITS.
+
+A bucket holds up to capacity tokens and refills continuously at rate tokens
+per second; each request takes one. Every store offers hit(key, capacity, rate),
+a single O(1) read-modify-write returning (allowed, seconds until a token is
+available), and sweep(), which forgets buckets that have refilled completely
+and returns how many it removed.
+"""
+import math
+import threading
+import time
+
+from flask import current_app, jsonify, request
+from flask_login import current_user
+from werkzeug.exceptions import TooManyRequests
+
+import local_sqlite
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+def parse_rule(rule):
+    """'10/minute' -> (capacity 10, refill rate in tokens per second)"""
+    count, period = rule.split('/')
+    return int(count), int(count) / PERIODS[period.strip()]
+
+
+class MemoryRateLimitStore:
+    """Buckets in a dict. Each worker process keeps its own, so each one allows the full rate."""
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def hit(self, key, capacity, rate, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            tokens, updated, _ = self.buckets.get(key, (capacity, now, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+    def sweep(self, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            # A full bucket behaves exactly like a missing one
+            full = [key for key, (_, _, full_at) in self.buckets.items() if full_at <= now]
+            for key in full:
+                del self.buckets[key]
+        return len(full)
+
+
+class SQLiteRateLimitStore:
+    """Buckets shared by every worker on the host through a LocalSQLite file.
+
+    Each hit is one UPSERT ... RETURNING that refills, takes a token and reports
+    the result atomically.
+    """
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS bucket ('
+        'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, '
+        'full_at REAL NOT NULL, allowed INTEGER NOT NULL) WITHOUT ROWID'
+    )
+
+    def __init__(self, path):
+        self.db = local_sqlite.LocalSQLite(path, self.SCHEMA)
+
+    def hit(self, key, capacity, rate, now=None):
+        now = time.time() if now is None else now
+        refilled = 'min(:capacity, tokens + (:now - updated) * :rate)'
+        taken = f'({refilled} >= 1)'  # SQLite booleans are 0 or 1
+        tokens, allowed = self.db.connection().execute(
+            'INSERT INTO bucket (key, tokens, updated, full_at, allowed) '
+            'VALUES (:key, :capacity - 1, :now, :now + 1 / :rate, 1) '
+            'ON CONFLICT (key) DO UPDATE SET '
+            f'tokens = {refilled} - {taken}, '
+            f'full_at = :now + (:capacity - {refilled} + {taken}) / :rate, '
+            f'allowed = {taken}, '
+            'updated = :now '
+            'RETURNING tokens, allowed',
+            {'key': key, 'capacity': capacity, 'rate': rate, 'now': now}
+        ).fetchone()
+        return bool(allowed), 0 if allowed else (1 - tokens) / rate
+
+    def sweep(self, now=None):
+        now = time.time() if now is None else now
+        return self.db.connection().execute('DELETE FROM bucket WHERE full_at <= ?', (now,)).rowcount
+
+
+def create_store(app):
+    kind = app.config['RATELIMIT_STORE']
+    if kind == 'sqlite':
+        local_sqlite.check_version('RATELIMIT_STORE')
+        return SQLiteRateLimitStore(app.config['RATELIMIT_DB'])
+    if kind == 'memory':
+        return MemoryRateLimitStore()
+    raise ValueError(f'Unknown RATELIMIT_STORE {kind!r}')
+
+
+def client_key():
+    """Signed-in users are limited per account, everyone else per IP address.
+
+    Behind a reverse proxy remote_addr is only the client's address when
+    SERVER_TRUSTED_PROXIES is set; otherwise all anonymous clients share a bucket.
+    """
+    if current_user.is_authenticated:
+        return f'user:{current_user.id}'
+    return f'ip:{request.remote_addr}'
+
+
+def check_rate_limit():
+    rules = current_app.extensions['ratelimit.rules']
+    # A rule for 'METHOD endpoint' wins over one for the endpoint with any method
+    name = f'{request.method} {request.endpoint}'
+    if name not in rules:
+        name = request.endpoint
+    rule = rules.get(name)
+    if rule is None:
+        return None
+    capacity, rate = rule
+    allowed, retry_after = current_app.extensions['ratelimit'].hit(f'{name}|{client_key()}', capacity, rate)
+    if allowed:
+        return None
+    message = 'Too many requests. Please slow down and try again shortly.'
+    retry_after = math.ceil(retry_after)
+    # The like button's AJAX calls expect JSON back
+    if request.headers.get('Content-Type') == 'application/json':
+        return jsonify({'success': False, 'error': message}), 429, {'Retry-After': str(retry_after)}
+    raise TooManyRequests(message, retry_after=retry_after)
+
+
+def init_app(app, scheduler):
+    if not app.config.get('RATELIMIT_STORE'):
+        return
+    store = create_store(app)
+    app.extensions['ratelimit'] = store
+    app.extensions['ratelimit.rules'] = {
+        name: parse_rule(rule) for name, rule in app.config['RATELIMITS'].items()
+    }
+    app.before_request(check_rate_limit)
+    scheduler.add_job('ratelimit.sweep', store.sweep, app.config['RATELIMIT_SWEEP_INTERVAL'])
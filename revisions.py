@@ -0,0 +1,220 @@
+import difflib
+import json
+import zlib
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from models import db, PostRevision, ArchivedPostRevision, JobCheckpoint
+from trending import get_checkpoint
+
+
+def make_delta(old, new):
+    """Line delta from old to new: [start, end] copies old lines, a string inserts text"""
+    a = old.splitlines(keepends=True)
+    b = new.splitlines(keepends=True)
+    ops = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append(''.join(b[j1:j2]))
+    return ops
+
+
+def apply_delta(old, ops):
+    lines = old.splitlines(keepends=True)
+    parts = []
+    for op in ops:
+        if isinstance(op, list):
+            parts.extend(lines[op[0]:op[1]])
+        else:
+            parts.append(op)
+    return ''.join(parts)
+
+
+def encode(previous, content, chain_length):
+    """(is_snapshot, data) for content, given the previous revision's content and how
+    many deltas already follow the last snapshot. A snapshot is stored every
+    REVISION_SNAPSHOT_INTERVAL revisions, and whenever the delta is no smaller.
+    """
+    full = zlib.compress(content.encode('utf-8'), 9)
+    if previous is None or chain_length + 1 >= current_app.config['REVISION_SNAPSHOT_INTERVAL']:
+        return True, full
+    delta = zlib.compress(json.dumps(make_delta(previous, content), separators=(',', ':')).encode('utf-8'), 9)
+    if len(delta) >= len(full):
+        return True, full
+    return False, delta
+
+
+def decode(revision, previous):
+    """Content of a revision, given the content of the one before it (unused for snapshots)"""
+    data = zlib.decompress(revision.data).decode('utf-8')
+    return data if revision.is_snapshot else apply_delta(previous, json.loads(data))
+
+
+def replay(revisions):
+    """Content of the last of revisions, which must start at a snapshot and be in order"""
+    content = None
+    for revision in revisions:
+        content = decode(revision, content)
+    return content
+
+
+def latest_chain(post):
+    """The newest snapshot of a post and every revision after it"""
+    if post.id is None:
+        return []
+    start = db.session.query(db.func.max(PostRevision.number)).filter(
+        PostRevision.post_id == post.id, PostRevision.is_snapshot.is_(True)
+    ).scalar()
+    if start is None:
+        return []
+    return post.revisions.filter(PostRevision.number >= start).order_by(PostRevision.number).all()
+
+
+def revision_model(post):
+    """PostRevision, or ArchivedPostRevision for a post read from the archive"""
+    return ArchivedPostRevision if post.archived else PostRevision
+
+
+def revision_content(revision):
+    """Rebuild one revision from its snapshot, applying fewer than REVISION_SNAPSHOT_INTERVAL deltas"""
+    model = type(revision)
+    start = db.session.query(db.func.max(model.number)).filter(
+        model.post_id == revision.post_id,
+        model.is_snapshot.is_(True),
+        model.number <= revision.number,
+    ).scalar()
+    return replay(model.query.filter(
+        model.post_id == revision.post_id,
+        model.number.between(start, revision.number),
+    ).order_by(model.number))
+
+
+def _add_revision(post, number, title, content, previous, chain_length, created_at=None):
+    is_snapshot, data = encode(previous, content, chain_length)
+    revision = PostRevision(post=post, number=number, title=title, is_snapshot=is_snapshot,
+                            data=data, size=len(content), created_at=created_at or datetime.utcnow())
+    db.session.add(revision)
+    return revision
+
+
+def _original_value(post, name):
+    history = db.inspect(post).attrs[name].history
+    return history.deleted[0] if history.deleted else getattr(post, name)
+
+
+def record_revision(post):
+    """Save the post's current title and content as its newest revision, if they changed.
+
+    Call after assigning the new values and before committing. The delta is
+    taken against the stored previous revision rather than the form's old
+    text, so the chain stays correct even if the post was changed elsewhere.
+    """
+    with db.session.no_autoflush:
+        chain = latest_chain(post)
+        if chain:
+            previous = replay(chain)
+        elif db.inspect(post).persistent:
+            # Posts written before revisions existed keep their old text as revision 1
+            title, previous = _original_value(post, 'title'), _original_value(post, 'content')
+            chain = [_add_revision(post, 1, title, previous, None, 0, post.updated_at or post.created_at)]
+        else:
+            return _add_revision(post, 1, post.title, post.content, None, 0)
+
+        if chain[-1].title == post.title and previous == post.content:
+            return None
+        chain_length = len(chain) - 1
+        return _add_revision(post, chain[-1].number + 1, post.title, post.content, previous, chain_length)
+
+
+def diff_lines(old, new, context=3):
+    return list(difflib.unified_diff(old.splitlines(), new.splitlines(), lineterm='', n=context))
+
+
+def compact_post(post_id, cutoff):
+    """Keep one revision per day before cutoff (plus the first), then re-encode the chain.
+
+    Re-encoding also applies the current REVISION_SNAPSHOT_INTERVAL. Returns
+    the number of revisions removed.
+    """
+    revisions = PostRevision.query.filter_by(post_id=post_id).order_by(PostRevision.number).all()
+    removed = 0
+    content = previous = None
+    chain_length = 0
+    for i, revision in enumerate(revisions):
+        content = decode(revision, content)
+        following = revisions[i + 1] if i + 1 < len(revisions) else None
+        if (i > 0 and following is not None and following.created_at < cutoff
+                and following.created_at.date() == revision.created_at.date()):
+            db.session.delete(revision)
+            removed += 1
+            continue
+        is_snapshot, data = encode(previous, content, chain_length)
+        if (is_snapshot, data) != (revision.is_snapshot, revision.data):
+            revision.is_snapshot, revision.data = is_snapshot, data
+        chain_length = 0 if is_snapshot else chain_length + 1
+        previous = content
+    return removed
+
+
+def compact_revisions():
+    """Compact posts whose revisions aged past REVISION_COMPACT_AFTER_DAYS since the last run"""
+    cutoff = datetime.utcnow() - timedelta(days=current_app.config['REVISION_COMPACT_AFTER_DAYS'])
+    batch_size = current_app.config['REVISION_COMPACT_BATCH']
+    removed = 0
+    while True:
+        checkpoint = get_checkpoint('revisions.compact')
+        position = checkpoint.position
+        rows = db.session.query(PostRevision.id, PostRevision.post_id).filter(
+            PostRevision.id > position, PostRevision.created_at < cutoff
+        ).order_by(PostRevision.id).limit(batch_size).all()
+        if not rows:
+            db.session.rollback()
+            break
+
+        claimed = JobCheckpoint.query.filter_by(name=checkpoint.name, position=position).update(
+            {'position': rows[-1].id}, synchronize_session=False
+        )
+        if not claimed:
+            db.session.rollback()
+            break
+        for post_id in sorted({post_id for _, post_id in rows}):
+            removed += compact_post(post_id, cutoff)
+        db.session.commit()
+    return removed
+
+
+revisions_cli = AppGroup('revisions', help='Maintain post revision history.')
+
+
+@revisions_cli.command('compact')
+@click.option('--post', 'post_id', type=int, help='Compact one post now instead of newly aged revisions.')
+def compact_command(post_id):
+    """Thin out old revisions to one per day and re-encode their deltas."""
+    if post_id is None:
+        removed = compact_revisions()
+    else:
+        cutoff = datetime.utcnow() - timedelta(days=current_app.config['REVISION_COMPACT_AFTER_DAYS'])
+        removed = compact_post(post_id, cutoff)
+        db.session.commit()
+    click.echo(f'Removed {removed} revisions')
+
+
+@revisions_cli.command('stats')
+def stats_command():
+    """Show how much space revisions take compared with full copies."""
+    count, stored, full, snapshots = db.session.query(
+        db.func.count(), db.func.sum(db.func.length(PostRevision.data)),
+        db.func.sum(PostRevision.size), db.func.sum(db.case((PostRevision.is_snapshot, 1), else_=0))
+    ).one()
+    click.echo(f'{count} revisions ({snapshots or 0} snapshots): {stored or 0} bytes stored '
+               f'for {full or 0} characters of content')
+
+
+def init_app(app, scheduler):
+    app.cli.add_command(revisions_cli)
+    scheduler.add_job('revisions.compact', compact_revisions, app.config['REVISION_COMPACT_INTERVAL'])
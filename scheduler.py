@@ -0,0 +1,106 @@
+import logging
+import os
+import threading
+import time
+
+import click
+from flask.cli import AppGroup
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    def __init__(self, name, func, interval):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.next_run = time.monotonic() + interval
+
+
+class Scheduler:
+    """Minimal in-process scheduler running periodic jobs in a daemon thread.
+
+    Jobs run inside an application context. Every worker process runs its own
+    scheduler, so jobs must be safe to run concurrently (claim work through the
+    database rather than relying on being the only runner).
+    """
+
+    def __init__(self, app=None):
+        self.jobs = {}
+        self.app = None
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['scheduler'] = self
+
+        app.cli.add_command(jobs_cli)
+        if app.config.get('SCHEDULER_ENABLED') and not app.testing:
+            # Started lazily so the thread is created in the worker process, not a pre-fork parent
+            app.before_request(self.ensure_started)
+
+    def add_job(self, name, func, interval):
+        self.jobs[name] = Job(name, func, interval)
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            # Made in the worker, so it is gevent/eventlet's Event when they patched threading after the fork
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._loop, name='scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_job(self, name):
+        """Run a single job now, in the current thread"""
+        job = self.jobs[name]
+        with self.app.app_context():
+            return job.func()
+
+    def run_pending(self):
+        now = time.monotonic()
+        for job in list(self.jobs.values()):
+            if job.next_run > now:
+                continue
+            job.next_run = now + job.interval
+            try:
+                self.run_job(job.name)
+            except Exception:
+                logger.exception('Scheduled job %s failed', job.name)
+
+    def _loop(self):
+        while not self._stop.wait(1):
+            self.run_pending()
+
+
+scheduler = Scheduler()
+
+
+jobs_cli = AppGroup('jobs', help='Inspect and run scheduled background jobs.')
+
+
+@jobs_cli.command('list')
+def list_jobs():
+    for job in scheduler.jobs.values():
+        click.echo(f'{job.name}\tevery {job.interval}s')
+
+
+@jobs_cli.command('run')
+@click.argument('name')
+def run_job(name):
+    """Run one scheduled job immediately (e.g. from cron)."""
+    if name not in scheduler.jobs:
+        raise click.BadParameter(f'Unknown job {name!r}', param_hint='NAME')
+    result = scheduler.run_job(name)
+    click.echo(f'{name}: {result}')
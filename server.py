@@ -0,0 +1,142 @@
+import os
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from models import db
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # only needed for 'flask serve'; pinned in requirements.txt
+    BaseApplication = None
+
+# sync: one request per process; gthread: a thread pool per process;
+# gevent/eventlet: greenlets, patched by gunicorn's worker after the fork
+WORKER_CLASSES = ('sync', 'gthread', 'gevent', 'eventlet')
+# The master imports the app once and forks it. Greenlet workers must import it after patching the
+# standard library instead, or its sockets and locks stay blocking.
+PRELOADED_WORKER_CLASSES = ('sync', 'gthread')
+
+
+def pool_capacity(config):
+    """Connections one process can hold: SQLAlchemy's QueuePool defaults are 5 + 10 overflow"""
+    options = config.get('SQLALCHEMY_ENGINE_OPTIONS') or {}
+    return options.get('pool_size', 5) + options.get('max_overflow', 10)
+
+
+def plan_workers(config, worker_class, cpus=None):
+    """Size processes and threads from the CPU count without asking for more connections than exist.
+
+    Returns (workers, threads, worker_connections). Explicit SERVER_WORKERS and
+    SERVER_THREADS win; SERVER_DB_MAX_CONNECTIONS, when set, caps the number of
+    processes so that every process can fill its pool.
+    """
+    cpus = cpus or os.cpu_count() or 1
+    capacity = pool_capacity(config)
+    threads = 1
+    worker_connections = None
+
+    if worker_class == 'sync':
+        workers = 2 * cpus + 1
+        per_worker = 1
+    elif worker_class == 'gthread':
+        workers = cpus + 1
+        # A thread beyond the pool size would only wait for a connection
+        threads = config['SERVER_THREADS'] or min(4 * cpus, capacity)
+        per_worker = threads
+    else:
+        # Greenlets are cheap, but at most `capacity` of them talk to the database at once
+        workers = cpus
+        worker_connections = config['SERVER_WORKER_CONNECTIONS']
+        per_worker = capacity
+
+    workers = config['SERVER_WORKERS'] or workers
+    max_connections = config['SERVER_DB_MAX_CONNECTIONS']
+    if max_connections:
+        workers = max(1, min(workers, max_connections // per_worker))
+    return workers, threads, worker_connections
+
+
+def gunicorn_options(config, worker_class, bind):
+    workers, threads, worker_connections = plan_workers(config, worker_class)
+    options = {
+        'bind': bind,
+        'worker_class': worker_class,
+        'workers': workers,
+        'threads': threads,
+        'preload_app': worker_class in PRELOADED_WORKER_CLASSES,
+        'max_requests': config['SERVER_MAX_REQUESTS'],
+        'max_requests_jitter': config['SERVER_MAX_REQUESTS_JITTER'],
+        'timeout': config['SERVER_TIMEOUT'],
+        'graceful_timeout': config['SERVER_GRACEFUL_TIMEOUT'],
+        'keepalive': config['SERVER_KEEPALIVE'],
+        'post_fork': post_fork,
+    }
+    if worker_connections:
+        options['worker_connections'] = worker_connections
+    return options
+
+
+def post_fork(server, worker):
+    """Drop database connections inherited from the master, which holds the app when it preloads"""
+    app = server.app.application
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
+if BaseApplication is not None:
+    class GunicornServer(BaseApplication):
+        def __init__(self, application, options):
+            self.application = application
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            if self.cfg.preload_app:
+                return self.application
+            # Called in the worker once gevent/eventlet has patched; build the app afresh there
+            from wsgi import app
+            return app
+
+
+@click.command('serve')
+@click.option('--bind', '-b', default=None, help='Address to listen on (default SERVER_BIND).')
+@click.option('--worker-class', '-k', type=click.Choice(WORKER_CLASSES), default=None,
+              help='sync (processes), gthread (thread pools), gevent or eventlet (default SERVER_WORKER_CLASS).')
+@click.option('--dry-run', is_flag=True, help='Print the computed settings and exit.')
+@with_appcontext
+def serve_command(bind, worker_class, dry_run):
+    """Run the app under gunicorn with workers sized for this machine.
+
+    sync and gthread workers fork from a master that preloaded the app;
+    gevent and eventlet workers each load wsgi:app after patching.
+
+    Workers are recycled after SERVER_MAX_REQUESTS (plus jitter) requests.
+    SIGHUP gracefully replaces the workers; for a code deploy send SIGUSR2 to
+    start a new master on the new code, then SIGQUIT to the old one.
+    """
+    config = current_app.config
+    worker_class = worker_class or config['SERVER_WORKER_CLASS']
+    options = gunicorn_options(config, worker_class, bind or config['SERVER_BIND'])
+    if dry_run:
+        for key, value in sorted(options.items()):
+            if key != 'post_fork':
+                click.echo(f'{key} = {value}')
+        return
+    if BaseApplication is None:
+        raise click.ClickException('gunicorn is not installed (pip install gunicorn)')
+    GunicornServer(current_app._get_current_object(), options).run()
+
+
+def init_app(app):
+    # Behind a reverse proxy remote_addr is the proxy; trust its X-Forwarded-For (and -Proto) instead
+    proxies = app.config['SERVER_TRUSTED_PROXIES']
+    if proxies:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies)
+    app.cli.add_command(serve_command)
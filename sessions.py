@@ -0,0 +1,510 @@
+"""Server-side sessions; the cookie only carries a signed session id.
+
+Every store offers get, save, delete, get_generation, revoke_user (returns the
+new generation), set_user_snapshot, invalidate_user_snapshots and sweep
+(returns how many expired sessions it removed).
+
+Revocation is O(1) per user: each user has a generation number and every
+session records the generation it was issued under. Bumping the generation
+invalidates all of the user's sessions without finding them. Stores also keep
+one cached snapshot of each user's row so requests can skip load_user's query.
+Invalidating a snapshot bumps its version, and a snapshot is only saved if the
+version is still the one read when the session was opened, so a request that
+loaded the user before a change cannot write the old row back.
+"""
+import fcntl
+import json
+import os
+import secrets
+import tempfile
+import threading
+from datetime import datetime
+
+from flask import current_app, has_app_context, session as flask_session
+from flask.sessions import SessionInterface, SessionMixin, session_json_serializer
+from itsdangerous import BadSignature, Signer
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import make_transient_to_detached
+from werkzeug.datastructures import CallbackDict
+
+from models import db, User, UserSession, UserSessionState
+
+# Never cached outside the user table; the filesystem store writes snapshots to disk
+SNAPSHOT_EXCLUDED = ('password_hash',)
+
+
+class StoredSession:
+    """What a store returns for a session id: its data plus the owner's revocation state"""
+
+    def __init__(self, data, expires_at, user_id=None, generation=0, current_generation=0, snapshot=None,
+                 snapshot_version=0):
+        self.data = data
+        self.expires_at = expires_at
+        self.user_id = user_id
+        self.generation = generation
+        self.current_generation = current_generation
+        self.snapshot = snapshot
+        self.snapshot_version = snapshot_version
+
+    @property
+    def revoked(self):
+        return self.user_id is not None and self.generation != self.current_generation
+
+
+class MemorySessionStore:
+    """Sessions in a dict. A worker cannot see sessions made by another, so this only suits a single process."""
+
+    def __init__(self):
+        self.sessions = {}
+        self.users = {}
+        self.lock = threading.Lock()
+
+    def get(self, sid):
+        with self.lock:
+            entry = self.sessions.get(sid)
+            if entry is None or entry['expires_at'] <= datetime.utcnow():
+                return None
+            state = self.users.get(entry['user_id'], {})
+            return StoredSession(entry['data'], entry['expires_at'], entry['user_id'], entry['generation'],
+                                 state.get('generation', 0), state.get('snapshot'), state.get('snapshot_version', 0))
+
+    def save(self, sid, data, expires_at, user_id=None, generation=0):
+        with self.lock:
+            self.sessions[sid] = {'data': data, 'expires_at': expires_at,
+                                  'user_id': user_id, 'generation': generation}
+
+    def delete(self, sid):
+        with self.lock:
+            self.sessions.pop(sid, None)
+
+    def get_generation(self, user_id):
+        with self.lock:
+            return self.users.get(user_id, {}).get('generation', 0)
+
+    def revoke_user(self, user_id):
+        with self.lock:
+            state = self.users.setdefault(user_id, {})
+            state['generation'] = state.get('generation', 0) + 1
+            state['snapshot'] = None
+            state['snapshot_version'] = state.get('snapshot_version', 0) + 1
+            return state['generation']
+
+    def set_user_snapshot(self, user_id, snapshot, version):
+        with self.lock:
+            state = self.users.setdefault(user_id, {})
+            if state.get('snapshot_version', 0) == version:
+                state['snapshot'] = snapshot
+
+    def invalidate_user_snapshots(self, user_ids):
+        with self.lock:
+            for user_id in user_ids:
+                state = self.users.setdefault(user_id, {})
+                state['snapshot'] = None
+                state['snapshot_version'] = state.get('snapshot_version', 0) + 1
+
+    def sweep(self, now=None):
+        now = now or datetime.utcnow()
+        with self.lock:
+            expired = [sid for sid, entry in self.sessions.items() if entry['expires_at'] <= now]
+            for sid in expired:
+                del self.sessions[sid]
+        return len(expired)
+
+
+class FilesystemSessionStore:
+    """One JSON file per session and per user, shared by all workers on the host"""
+
+    def __init__(self, directory):
+        self.session_dir = os.path.join(directory, 'data')
+        self.user_dir = os.path.join(directory, 'users')
+        os.makedirs(self.session_dir, exist_ok=True)
+        os.makedirs(self.user_dir, exist_ok=True)
+
+    def _read(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write(self, path, value):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+
+    def _session_path(self, sid):
+        return os.path.join(self.session_dir, sid)
+
+    def _user_path(self, user_id):
+        return os.path.join(self.user_dir, str(user_id))
+
+    def get(self, sid):
+        entry = self._read(self._session_path(sid))
+        if entry is None:
+            return None
+        expires_at = datetime.fromisoformat(entry['expires_at'])
+        if expires_at <= datetime.utcnow():
+            return None
+        state = {}
+        if entry['user_id'] is not None:
+            state = self._read(self._user_path(entry['user_id'])) or {}
+        return StoredSession(entry['data'], expires_at, entry['user_id'], entry['generation'],
+                             state.get('generation', 0), state.get('snapshot'), state.get('snapshot_version', 0))
+
+    def save(self, sid, data, expires_at, user_id=None, generation=0):
+        self._write(self._session_path(sid), {
+            'data': data, 'user_id': user_id, 'generation': generation,
+            'expires_at': expires_at.isoformat()
+        })
+
+    def delete(self, sid):
+        try:
+            os.remove(self._session_path(sid))
+        except FileNotFoundError:
+            pass
+
+    def _update_user(self, user_id, update):
+        """Apply update(state) to the user's file under an exclusive lock, so workers don't lose each other's writes"""
+        path = self._user_path(user_id)
+        with open(path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            state = self._read(path) or {}
+            if update(state) is not False:
+                self._write(path, state)
+        return state
+
+    def get_generation(self, user_id):
+        return (self._read(self._user_path(user_id)) or {}).get('generation', 0)
+
+    def revoke_user(self, user_id):
+        def update(state):
+            state['generation'] = state.get('generation', 0) + 1
+            state['snapshot'] = None
+            state['snapshot_version'] = state.get('snapshot_version', 0) + 1
+        return self._update_user(user_id, update)['generation']
+
+    def set_user_snapshot(self, user_id, snapshot, version):
+        def update(state):
+            if state.get('snapshot_version', 0) != version:
+                return False
+            state['snapshot'] = snapshot
+        self._update_user(user_id, update)
+
+    def invalidate_user_snapshots(self, user_ids):
+        def update(state):
+            state['snapshot'] = None
+            state['snapshot_version'] = state.get('snapshot_version', 0) + 1
+        for user_id in user_ids:
+            self._update_user(user_id, update)
+
+    def sweep(self, now=None):
+        now = now or datetime.utcnow()
+        removed = 0
+        with os.scandir(self.session_dir) as entries:
+            for entry in entries:
+                stored = self._read(entry.path)
+                if stored is not None and datetime.fromisoformat(stored['expires_at']) <= now:
+                    self.delete(entry.name)
+                    removed += 1
+        return removed
+
+
+class SQLSessionStore:
+    """Sessions in the application database, in transactions separate from the request's"""
+
+    def get(self, sid):
+        sessions, states = UserSession.__table__, UserSessionState.__table__
+        query = db.select(
+            sessions.c.data, sessions.c.expires_at, sessions.c.user_id, sessions.c.generation,
+            states.c.generation.label('current_generation'), states.c.snapshot, states.c.snapshot_version
+        ).select_from(
+            sessions.outerjoin(states, states.c.user_id == sessions.c.user_id)
+        ).where(sessions.c.sid == sid, sessions.c.expires_at > datetime.utcnow())
+        with db.engine.connect() as connection:
+            row = connection.execute(query).first()
+        if row is None:
+            return None
+        return StoredSession(row.data, row.expires_at, row.user_id, row.generation,
+                             row.current_generation or 0, json.loads(row.snapshot) if row.snapshot else None,
+                             row.snapshot_version or 0)
+
+    def _upsert(self, table, key_column, key, values):
+        with db.engine.begin() as connection:
+            updated = connection.execute(table.update().where(key_column == key).values(**values))
+            if not updated.rowcount:
+                connection.execute(table.insert().values({key_column.name: key, **values}))
+
+    def save(self, sid, data, expires_at, user_id=None, generation=0):
+        sessions = UserSession.__table__
+        self._upsert(sessions, sessions.c.sid, sid, {
+            'data': data, 'expires_at': expires_at, 'user_id': user_id, 'generation': generation
+        })
+
+    def delete(self, sid):
+        with db.engine.begin() as connection:
+            connection.execute(UserSession.__table__.delete().where(UserSession.__table__.c.sid == sid))
+
+    def get_generation(self, user_id):
+        states = UserSessionState.__table__
+        with db.engine.connect() as connection:
+            return connection.execute(
+                db.select(states.c.generation).where(states.c.user_id == user_id)
+            ).scalar() or 0
+
+    def revoke_user(self, user_id):
+        states = UserSessionState.__table__
+        with db.engine.begin() as connection:
+            updated = connection.execute(states.update().where(states.c.user_id == user_id).values(
+                generation=states.c.generation + 1, snapshot=None, snapshot_version=states.c.snapshot_version + 1
+            ))
+            if not updated.rowcount:
+                connection.execute(states.insert().values(user_id=user_id, generation=1))
+            return connection.execute(
+                db.select(states.c.generation).where(states.c.user_id == user_id)
+            ).scalar()
+
+    def set_user_snapshot(self, user_id, snapshot, version):
+        states = UserSessionState.__table__
+        with db.engine.begin() as connection:
+            updated = connection.execute(states.update().where(
+                states.c.user_id == user_id, states.c.snapshot_version == version
+            ).values(snapshot=json.dumps(snapshot)))
+            if updated.rowcount or version:
+                return
+            try:
+                with connection.begin_nested():
+                    connection.execute(states.insert().values(user_id=user_id, generation=0,
+                                                              snapshot=json.dumps(snapshot), snapshot_version=0))
+            except IntegrityError:
+                # The row appeared since the session was read, so the version no longer matches
+                pass
+
+    def invalidate_user_snapshots(self, user_ids):
+        states = UserSessionState.__table__
+        user_ids = list(user_ids)
+        with db.engine.begin() as connection:
+            for start in range(0, len(user_ids), 500):
+                chunk = user_ids[start:start + 500]
+                connection.execute(states.update().where(states.c.user_id.in_(chunk)).values(
+                    snapshot=None, snapshot_version=states.c.snapshot_version + 1
+                ))
+                # Users without a row yet get one, so a snapshot read before this can't be inserted afterwards
+                existing = set(connection.execute(
+                    db.select(states.c.user_id).where(states.c.user_id.in_(chunk))
+                ).scalars())
+                missing = [{'user_id': user_id, 'generation': 0, 'snapshot_version': 1}
+                           for user_id in chunk if user_id not in existing]
+                if missing:
+                    connection.execute(states.insert(), missing)
+
+    def sweep(self, now=None):
+        sessions = UserSession.__table__
+        with db.engine.begin() as connection:
+            result = connection.execute(sessions.delete().where(sessions.c.expires_at <= (now or datetime.utcnow())))
+        return result.rowcount
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, stored=None):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.stored = stored
+        self.modified = False
+        self.regenerate = False
+
+
+class ServerSessionInterface(SessionInterface):
+    """Keeps session data in a session store; the cookie only carries a signed session id"""
+
+    serializer = session_json_serializer
+
+    def __init__(self, store):
+        self.store = store
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='server-session')
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if not cookie or not app.secret_key:
+            return ServerSession(sid=secrets.token_urlsafe(32))
+        try:
+            sid = self._signer(app).unsign(cookie).decode()
+        except BadSignature:
+            return ServerSession(sid=secrets.token_urlsafe(32))
+
+        stored = self.store.get(sid)
+        if stored is None or stored.revoked:
+            return ServerSession(sid=secrets.token_urlsafe(32))
+        return ServerSession(self.serializer.loads(stored.data), sid=sid, stored=stored)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            if session.modified and session.stored is not None:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+                response.vary.add('Cookie')
+            return
+
+        user_id = session.get('_user_id')
+        user_id = int(user_id) if user_id is not None else None
+        stored = session.stored
+        now = datetime.utcnow()
+        lifetime = app.permanent_session_lifetime
+
+        # A new sid on login (or when asked) prevents session fixation
+        if stored is not None and (session.regenerate or stored.user_id != user_id):
+            self.store.delete(session.sid)
+            session.sid = secrets.token_urlsafe(32)
+            stored = None
+
+        if stored is not None and not session.modified:
+            # Only extend the expiry once half of the lifetime has passed, not on every request
+            if stored.expires_at - now > lifetime / 2:
+                self._save_snapshot(session, stored, user_id)
+                return
+
+        generation = stored.generation if stored is not None else (
+            self.store.get_generation(user_id) if user_id is not None else 0
+        )
+        self.store.save(session.sid, self.serializer.dumps(dict(session)), now + lifetime, user_id, generation)
+        self._save_snapshot(session, stored, user_id)
+
+        response.set_cookie(
+            name,
+            self._signer(app).sign(session.sid.encode()).decode(),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+        response.vary.add('Cookie')
+
+    def _save_snapshot(self, session, stored, user_id):
+        # A new session has no version read before the user was loaded, so it waits for the next request
+        if user_id is None or stored is None or usable_snapshot(stored.snapshot):
+            return
+        from flask_login import current_user
+        if current_user.is_authenticated and current_user.id == user_id:
+            self.store.set_user_snapshot(user_id, snapshot_user(current_user), stored.snapshot_version)
+
+
+def snapshot_user(user):
+    snapshot = {}
+    for column in User.__table__.columns:
+        if column.key in SNAPSHOT_EXCLUDED:
+            continue
+        value = getattr(user, column.key)
+        snapshot[column.key] = value.isoformat() if isinstance(value, datetime) else value
+    return snapshot
+
+
+def usable_snapshot(snapshot):
+    """Snapshots written before SNAPSHOT_EXCLUDED existed are ignored and replaced"""
+    return snapshot is not None and not any(key in snapshot for key in SNAPSHOT_EXCLUDED)
+
+
+def load_user_from_snapshot(user_id):
+    """Rebuild the logged-in user from the cached snapshot without querying, if there is one"""
+    stored = getattr(flask_session, 'stored', None)
+    if stored is None or stored.user_id != user_id or not usable_snapshot(stored.snapshot):
+        return None
+
+    # Excluded columns are left unloaded and load from the database if they are read
+    values = {}
+    for column in User.__table__.columns:
+        if column.key in SNAPSHOT_EXCLUDED:
+            continue
+        value = stored.snapshot.get(column.key)
+        if value is not None and isinstance(column.type, db.DateTime):
+            value = datetime.fromisoformat(value)
+        values[column.key] = value
+    user = User(**values)
+    make_transient_to_detached(user)
+    # load=False attaches the row as persistent without a SELECT
+    return db.session.merge(user, load=False)
+
+
+def revoke_user_sessions(user_id, keep_current=False):
+    """Log the user out everywhere, optionally re-issuing the current session under the new generation"""
+    if not isinstance(current_app.session_interface, ServerSessionInterface):
+        return
+    generation = current_app.session_interface.store.revoke_user(user_id)
+    if keep_current and flask_session.stored is not None:
+        flask_session.stored.generation = generation
+        flask_session.stored.snapshot = None
+        flask_session.stored.snapshot_version += 1
+        flask_session.regenerate = True
+        flask_session.modified = True
+
+
+def create_store(app):
+    kind = app.config['SESSION_STORE']
+    if kind == 'sql':
+        return SQLSessionStore()
+    if kind == 'filesystem':
+        return FilesystemSessionStore(app.config['SESSION_FILE_DIR'])
+    if kind == 'memory':
+        return MemorySessionStore()
+    raise ValueError(f'Unknown SESSION_STORE {kind!r}')
+
+
+def _track_user_changes(session, flush_context, instances):
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User) and session.is_modified(obj):
+            session.info.setdefault('changed_user_ids', set()).add(obj.id)
+
+
+def _track_bulk_user_changes(orm_execute_state):
+    """Bulk UPDATE/DELETE of user rows (follower counts, imports) skip the flush, so find the rows here"""
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    statement = orm_execute_state.statement
+    if getattr(statement.table, 'name', None) != User.__table__.name:
+        return
+    query = db.select(User.__table__.c.id)
+    if statement.whereclause is not None:
+        query = query.where(statement.whereclause)
+    user_ids = orm_execute_state.session.execute(query).scalars()
+    orm_execute_state.session.info.setdefault('changed_user_ids', set()).update(user_ids)
+
+
+def _invalidate_snapshots(session):
+    if session.in_nested_transaction():
+        # after_commit also fires when a savepoint is released; wait for the real commit
+        return
+    user_ids = session.info.pop('changed_user_ids', None)
+    if user_ids and has_app_context() and isinstance(current_app.session_interface, ServerSessionInterface):
+        current_app.session_interface.store.invalidate_user_snapshots(user_ids)
+
+
+def _forget_changes(session):
+    if not session.in_nested_transaction():
+        session.info.pop('changed_user_ids', None)
+
+
+def init_app(app, scheduler):
+    if not app.config.get('SESSION_STORE'):
+        return
+    store = create_store(app)
+    app.session_interface = ServerSessionInterface(store)
+
+    if not db.event.contains(db.session, 'before_flush', _track_user_changes):
+        db.event.listen(db.session, 'before_flush', _track_user_changes)
+        db.event.listen(db.session, 'do_orm_execute', _track_bulk_user_changes)
+        db.event.listen(db.session, 'after_commit', _invalidate_snapshots)
+        db.event.listen(db.session, 'after_rollback', _forget_changes)
+    scheduler.add_job('sessions.sweep', store.sweep, app.config['SESSION_SWEEP_INTERVAL'])
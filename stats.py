@@ -0,0 +1,79 @@
+import click
+from flask.cli import AppGroup
+
+import backfill
+from models import db, User, Post, Comment, Like, UserStats
+
+
+def stats_query(low=None, high=None):
+    """SELECT of user_id, the COUNTERS and last_post_at for users with low < id <= high (all if unbounded)"""
+    def in_range(column):
+        return [] if low is None else [column > low, column <= high]
+
+    # Hot tables only: archived posts, and the comments and likes on them, are not counted
+    posts, comments, likes = Post.__table__, Comment.__table__, Like.__table__
+
+    def counts(column, group_by, *joins):
+        query = db.select(group_by.label('user_id'), column.label('value'))
+        for target, on in joins:
+            query = query.join(target, on)
+        return query.where(*in_range(group_by)).group_by(group_by).subquery()
+
+    published = db.select(
+        posts.c.user_id, db.func.count().label('value'), db.func.max(posts.c.published_at).label('last_post_at')
+    ).where(posts.c.status == Post.PUBLISHED, *in_range(posts.c.user_id)).group_by(posts.c.user_id).subquery()
+    comments_written = counts(db.func.count(), comments.c.user_id)
+    likes_given = counts(db.func.count(), likes.c.user_id)
+    likes_received = counts(db.func.count(likes.c.id), posts.c.user_id, (likes, likes.c.post_id == posts.c.id))
+    comments_received = counts(db.func.count(comments.c.id), posts.c.user_id,
+                               (comments, comments.c.post_id == posts.c.id))
+
+    sources = [published, comments_written, likes_given, likes_received, comments_received]
+    query = db.select(
+        User.id,
+        *[db.func.coalesce(source.c.value, 0) for source in sources],
+        published.c.last_post_at,
+    ).select_from(User).where(*in_range(User.id))
+    for source in sources:
+        query = query.outerjoin(source, source.c.user_id == User.id)
+    return query
+
+
+def rebuild_stats():
+    """Recompute every user's counters from the source tables in one transaction"""
+    UserStats.query.delete()
+    db.session.execute(db.insert(UserStats).from_select(
+        ['user_id', *UserStats.COUNTERS, 'last_post_at'], stats_query()
+    ))
+    db.session.commit()
+    return UserStats.query.count()
+
+
+def rebuild_stats_range(connection, low, high):
+    stats = UserStats.__table__
+    connection.execute(stats.delete().where(stats.c.user_id > low, stats.c.user_id <= high))
+    connection.execute(stats.insert().from_select(
+        ['user_id', *UserStats.COUNTERS, 'last_post_at'], stats_query(low, high)
+    ))
+
+
+# The same rebuild in short per-user-range transactions, for tables too big to lock at once
+user_stats_backfill = backfill.register(backfill.Backfill('user-stats', User.__table__, rebuild_stats_range))
+
+
+stats_cli = AppGroup('stats', help='Maintain precomputed user statistics.')
+
+
+@stats_cli.command('rebuild')
+@click.option('--online', is_flag=True, help='Rebuild in throttled chunks of users instead of one transaction.')
+def rebuild_command(online):
+    """Recompute all user statistics from posts, comments and likes."""
+    if online:
+        count = user_stats_backfill.run(db.engine, report=click.echo, restart=True)
+    else:
+        count = rebuild_stats()
+    click.echo(f'Rebuilt statistics for {count} users')
+
+
+def init_app(app):
+    app.cli.add_command(stats_cli)
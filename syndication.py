@@ -0,0 +1,210 @@
+import glob
+import hashlib
+import os
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from xml.sax.saxutils import escape, quoteattr
+
+from flask import Response, current_app, request, send_file, stream_with_context, url_for
+
+from archive import with_archived
+from models import db, User, Post
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+
+
+def atom_date(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def rss_date(value):
+    return format_datetime(value.replace(tzinfo=timezone.utc), usegmt=True)
+
+
+def feed_posts_query(author=None):
+    query = Post.query.filter(Post.status == Post.PUBLISHED)
+    if author is not None:
+        query = query.filter(Post.user_id == author.id)
+    return query.order_by(Post.published_at.desc(), Post.id.desc()).limit(current_app.config['FEED_ENTRIES'])
+
+
+def feed_validators(author=None):
+    """ETag and Last-Modified from just the ids and timestamps of the entries in the feed"""
+    query = feed_posts_query(author).with_entities(Post.id, Post.updated_at)
+    rows = query.all()
+    digest = hashlib.sha1(repr([(id, updated_at) for id, updated_at in rows]).encode()).hexdigest()
+    last_modified = max((updated_at for _, updated_at in rows if updated_at), default=None)
+    return digest, last_modified
+
+
+def atom_entries(posts):
+    for post in posts:
+        link = url_for('blog.post', id=post.id, _external=True)
+        yield (
+            '<entry>'
+            f'<title>{escape(post.title)}</title>'
+            f'<id>{escape(link)}</id>'
+            f'<link rel="alternate" href={quoteattr(link)}/>'
+            f'<published>{atom_date(post.published_at)}</published>'
+            f'<updated>{atom_date(post.updated_at or post.published_at)}</updated>'
+            f'<author><name>{escape(post.author.username)}</name></author>'
+            f'<content type="text">{escape(post.content)}</content>'
+            '</entry>\n'
+        )
+
+
+def rss_items(posts):
+    for post in posts:
+        link = url_for('blog.post', id=post.id, _external=True)
+        yield (
+            '<item>'
+            f'<title>{escape(post.title)}</title>'
+            f'<link>{escape(link)}</link>'
+            f'<guid isPermaLink="true">{escape(link)}</guid>'
+            f'<pubDate>{rss_date(post.published_at)}</pubDate>'
+            f'<dc:creator>{escape(post.author.username)}</dc:creator>'
+            f'<description>{escape(post.content)}</description>'
+            '</item>\n'
+        )
+
+
+def feed_response(kind, title, self_url, author=None):
+    """Stream an Atom or RSS feed, answering 304 from the validators alone when possible"""
+    etag, last_modified = feed_validators(author)
+    site_url = url_for('main.index', _external=True)
+    updated = last_modified or datetime.utcnow()
+
+    def generate():
+        posts = feed_posts_query(author).options(db.joinedload(Post.author))
+        yield XML_HEADER
+        if kind == 'atom':
+            yield (
+                '<feed xmlns="http://www.w3.org/2005/Atom">'
+                f'<title>{escape(title)}</title><id>{escape(self_url)}</id>'
+                f'<link rel="self" href={quoteattr(self_url)}/><link rel="alternate" href={quoteattr(site_url)}/>'
+                f'<updated>{atom_date(updated)}</updated>\n'
+            )
+            yield from atom_entries(posts)
+            yield '</feed>\n'
+        else:
+            yield (
+                '<rss version="2.0" xmlns:dc="http://purl.org/dc/elements/1.1/"'
+                ' xmlns:atom="http://www.w3.org/2005/Atom"><channel>'
+                f'<title>{escape(title)}</title><link>{escape(site_url)}</link>'
+                f'<description>{escape(title)}</description>'
+                f'<atom:link rel="self" type="application/rss+xml" href={quoteattr(self_url)}/>'
+                f'<lastBuildDate>{rss_date(updated)}</lastBuildDate>\n'
+            )
+            yield from rss_items(posts)
+            yield '</channel></rss>\n'
+
+    mimetype = 'application/atom+xml' if kind == 'atom' else 'application/rss+xml'
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['FEED_MAX_AGE']
+    return response.make_conditional(request)
+
+
+def shard_signatures(only=None):
+    """{shard: (signature, lastmod)} for post-id ranges of SITEMAP_SHARD_SIZE.
+
+    Shards are fixed id ranges, so a new post only changes the last shard and an
+    edit or delete only its own. Count and id sum catch deletes, which leave no
+    timestamp behind.
+    """
+    size = current_app.config['SITEMAP_SHARD_SIZE']
+    posts = with_archived(Post.__table__, 'id', 'status', 'updated_at')
+    shard = ((posts.c.id - 1) // size).label('shard')
+    rows = db.session.query(
+        shard, db.func.count(), db.func.max(posts.c.updated_at), db.func.sum(posts.c.id)
+    ).filter(posts.c.status == Post.PUBLISHED)
+    if only is not None:
+        rows = rows.filter(posts.c.id > only * size, posts.c.id <= (only + 1) * size)
+    rows = rows.group_by(shard).order_by(shard)
+    return {
+        shard: (hashlib.sha1(f'{count}|{lastmod}|{id_sum}'.encode()).hexdigest()[:16], lastmod)
+        for shard, count, lastmod, id_sum in rows
+    }
+
+
+def shard_urls(shard):
+    size = current_app.config['SITEMAP_SHARD_SIZE']
+    # Archived posts stay listed; they are served read-only from the archive tables
+    rows = with_archived(Post.__table__, 'id', 'status', 'updated_at')
+    posts = db.session.query(rows.c.id, rows.c.updated_at).filter(
+        rows.c.id > shard * size, rows.c.id <= (shard + 1) * size, rows.c.status == Post.PUBLISHED
+    ).order_by(rows.c.id).yield_per(1000)
+    yield XML_HEADER
+    yield '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    for id, updated_at in posts:
+        link = url_for('blog.post', id=id, _external=True)
+        lastmod = f'<lastmod>{atom_date(updated_at)}</lastmod>' if updated_at else ''
+        yield f'<url><loc>{escape(link)}</loc>{lastmod}</url>\n'
+    yield '</urlset>\n'
+
+
+def sitemap_shard_response(shard):
+    """Serve a shard from the on-disk cache, rewriting it only when its signature changed"""
+    signature, lastmod = shard_signatures(only=shard).get(shard, (None, None))
+    if signature is None:
+        return None
+    directory = current_app.config['SITEMAP_CACHE_DIR']
+    # URLs in the file are absolute, so each host name gets its own copy
+    host = hashlib.sha1(request.host_url.encode()).hexdigest()[:8]
+    path = os.path.join(directory, f'posts-{shard}-{host}-{signature}.xml')
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.writelines(shard_urls(shard))
+        os.replace(tmp_path, path)
+        for stale in glob.glob(os.path.join(directory, f'posts-{shard}-{host}-*.xml')):
+            if stale != path:
+                os.remove(stale)
+
+    response = send_file(path, mimetype='application/xml', etag=signature, last_modified=lastmod,
+                         max_age=current_app.config['FEED_MAX_AGE'])
+    return response.make_conditional(request)
+
+
+def sitemap_index_response():
+    signatures = shard_signatures()
+    etag = hashlib.sha1(repr(sorted(signatures.items())).encode()).hexdigest()
+
+    def generate():
+        yield XML_HEADER
+        yield '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+        yield f'<sitemap><loc>{escape(url_for("main.sitemap_pages", _external=True))}</loc></sitemap>\n'
+        for shard, (_, lastmod) in signatures.items():
+            loc = url_for('main.sitemap_posts', shard=shard, _external=True)
+            lastmod = f'<lastmod>{atom_date(lastmod)}</lastmod>' if lastmod else ''
+            yield f'<sitemap><loc>{escape(loc)}</loc>{lastmod}</sitemap>\n'
+        yield '</sitemapindex>\n'
+
+    response = Response(stream_with_context(generate()), mimetype='application/xml')
+    response.set_etag(etag)
+    response.cache_control.max_age = current_app.config['FEED_MAX_AGE']
+    return response.make_conditional(request)
+
+
+def sitemap_pages_response():
+    """Static pages and public author profiles"""
+    def generate():
+        yield XML_HEADER
+        yield '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+        for endpoint in ('main.index', 'blog.index', 'blog.trending', 'main.about'):
+            yield f'<url><loc>{escape(url_for(endpoint, _external=True))}</loc></url>\n'
+        authors = db.session.query(User.username).filter(
+            User.profile_public.is_(True), User.posts.any()
+        ).order_by(User.id).yield_per(1000)
+        for username, in authors:
+            loc = url_for('auth.public_profile', username=username, _external=True)
+            yield f'<url><loc>{escape(loc)}</loc></url>\n'
+        yield '</urlset>\n'
+
+    response = Response(stream_with_context(generate()), mimetype='application/xml')
+    response.cache_control.max_age = current_app.config['FEED_MAX_AGE']
+    return response
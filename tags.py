@@ -0,0 +1,120 @@
+import math
+import re
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy.exc import IntegrityError
+
+from config import Config
+from models import db, Post, Tag, PostTag
+
+SEPARATOR_RE = re.compile(r'[^\w-]+')
+CLOUD_LEVELS = 5
+
+
+def normalize(name):
+    return SEPARATOR_RE.sub('-', name.strip().casefold()).strip('-_')
+
+
+def parse_tags(text):
+    """Normalized, de-duplicated tag names from a comma-separated string; ValueError if invalid"""
+    names = []
+    for part in (text or '').split(','):
+        name = normalize(part)
+        if not name or name in names:
+            continue
+        if len(name) > Config.TAG_MAX_LENGTH:
+            raise ValueError(f'Tags can be at most {Config.TAG_MAX_LENGTH} characters')
+        names.append(name)
+    if len(names) > Config.TAGS_PER_POST:
+        raise ValueError(f'A post can have at most {Config.TAGS_PER_POST} tags')
+    return names
+
+
+def get_or_create_tags(names):
+    tags = {tag.name: tag for tag in Tag.query.filter(Tag.name.in_(names))} if names else {}
+    for name in names:
+        if name in tags:
+            continue
+        try:
+            with db.session.begin_nested():
+                tag = Tag(name=name, post_count=0)
+                db.session.add(tag)
+        except IntegrityError:
+            # Created by a concurrent request
+            tag = Tag.query.filter_by(name=name).one()
+        tags[name] = tag
+    return [tags[name] for name in names]
+
+
+def set_post_tags(post, names):
+    """Make post's tags exactly names; counts follow through the PostTag events at flush"""
+    wanted = {tag.id: tag for tag in get_or_create_tags(names)}
+    for link in list(post.tag_links):
+        if link.tag_id not in wanted:
+            post.tag_links.remove(link)
+    current = {link.tag_id for link in post.tag_links}
+    for tag_id, tag in wanted.items():
+        if tag_id not in current:
+            post.tag_links.append(PostTag(tag=tag))
+
+
+def get_tag_page(tag, after=None, limit=10):
+    """Keyset page of a tag's posts, newest first, read from the (tag_id, post_id) index.
+
+    after is the cursor from the previous page; a malformed one raises ValueError.
+    """
+    query = Post.query.join(PostTag, PostTag.post_id == Post.id).filter(
+        PostTag.tag_id == tag.id, Post.status == Post.PUBLISHED
+    )
+    if after:
+        query = query.filter(PostTag.post_id < int(after))
+    posts = query.order_by(PostTag.post_id.desc()).limit(limit + 1).all()
+    next_cursor = posts[limit - 1].id if len(posts) > limit else None
+    return posts[:limit], next_cursor
+
+
+def filter_by_tags(query, names):
+    """Restrict a Post query to posts carrying every tag in names, one indexed join per tag"""
+    names = set(names)
+    tags = Tag.query.filter(Tag.name.in_(names)).all() if names else []
+    if len(tags) < len(names):
+        return query.filter(db.false())
+    for tag in tags:
+        link = db.aliased(PostTag)
+        query = query.join(link, db.and_(link.post_id == Post.id, link.tag_id == tag.id))
+    return query
+
+
+def tag_cloud(limit):
+    """The most used tags in name order, each with a size level from 1 to CLOUD_LEVELS"""
+    tags = Tag.query.filter(Tag.post_count > 0).order_by(Tag.post_count.desc()).limit(limit).all()
+    if not tags:
+        return []
+    low = math.log(tags[-1].post_count)
+    spread = math.log(tags[0].post_count) - low or 1
+    cloud = [(tag, 1 + round((math.log(tag.post_count) - low) / spread * (CLOUD_LEVELS - 1))) for tag in tags]
+    return sorted(cloud, key=lambda item: item[0].name)
+
+
+def rebuild_counts():
+    """Recompute every tag's published post count from post_tag; archived posts are not counted"""
+    counts = db.select(db.func.count()).select_from(PostTag).join(Post, Post.id == PostTag.post_id).where(
+        PostTag.tag_id == Tag.id, Post.status == Post.PUBLISHED
+    ).scalar_subquery()
+    updated = db.session.execute(db.update(Tag).values(post_count=counts)).rowcount
+    db.session.commit()
+    return updated
+
+
+tags_cli = AppGroup('tags', help='Maintain post tags.')
+
+
+@tags_cli.command('rebuild-counts')
+def rebuild_counts_command():
+    """Recompute tag counts from the post_tag table."""
+    click.echo(f'Rebuilt counts for {rebuild_counts()} tags')
+
+
+def init_app(app):
+    app.cli.add_command(tags_cli)
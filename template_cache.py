@@ -0,0 +1,38 @@
+import os
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from jinja2 import FileSystemBytecodeCache
+
+
+def init_app(app):
+    """Keep compiled templates on disk so new workers skip Jinja's parse/compile step"""
+    app.cli.add_command(templates_cli)
+    directory = app.config.get('TEMPLATE_CACHE_DIR')
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    # jinja_options only takes effect before app.jinja_env is first created
+    app.jinja_options = {**app.jinja_options, 'bytecode_cache': FileSystemBytecodeCache(directory)}
+
+
+def compile_templates(app):
+    """Load every template once so its bytecode is written to the cache; returns the names"""
+    env = app.jinja_env
+    names = env.list_templates(filter_func=lambda name: name.endswith('.html'))
+    for name in names:
+        env.get_template(name)
+    return names
+
+
+templates_cli = AppGroup('templates', help='Manage the compiled template cache.')
+
+
+@templates_cli.command('compile')
+def compile_command():
+    """Precompile all templates into TEMPLATE_CACHE_DIR (run at build time)."""
+    if not current_app.config.get('TEMPLATE_CACHE_DIR'):
+        raise click.ClickException('TEMPLATE_CACHE_DIR is not set')
+    names = compile_templates(current_app)
+    click.echo(f'Compiled {len(names)} templates into {current_app.config["TEMPLATE_CACHE_DIR"]}')
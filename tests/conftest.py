@@ -0,0 +1,39 @@
+import pytest
+
+from app import create_app
+from config import Config
+from models import db, User
+
+
+@pytest.fixture
+def app(tmp_path):
+    class TestConfig(Config):
+        TESTING = True
+        SECRET_KEY = 'test'
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(tmp_path / 'blog.db')
+        SCHEDULER_ENABLED = False
+        WTF_CSRF_ENABLED = False
+        ASSETS_BUILD_ON_STARTUP = False
+        TEMPLATE_CACHE_DIR = None
+        UPLOAD_FOLDER = str(tmp_path / 'uploads')
+        PROFILE_DIR = str(tmp_path / 'profiles')
+        METRICS_DIR = str(tmp_path / 'metrics')
+        SITEMAP_CACHE_DIR = str(tmp_path / 'sitemaps')
+        SESSION_STORE = 'memory'
+        RATELIMIT_STORE = ''
+        IDEMPOTENCY_STORE = ''
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def user(app):
+    user = User(username='author', email='author@example.com')
+    user.set_password('password')
+    db.session.add(user)
+    db.session.commit()
+    return user
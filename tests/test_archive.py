@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import analytics
+import archive
+import revisions
+import tags
+from models import db, Post, Comment, Like, PostViewStats, ArchivedPost
+
+
+@pytest.fixture
+def archived_post(app, user):
+    old = datetime.utcnow() - timedelta(days=app.config['ARCHIVE_AFTER_DAYS'] + 30)
+    post = Post(title='Old post', content='Old text', author=user, created_at=old, updated_at=old, published_at=old)
+    db.session.add(post)
+    revisions.record_revision(post)
+    db.session.flush()
+    tags.set_post_tags(post, ['history'])
+    comment = Comment(content='First comment', user_id=user.id, post_id=post.id, created_at=old, updated_at=old)
+    db.session.add(comment)
+    db.session.flush()
+    db.session.add(Comment(content='A reply', user_id=user.id, post_id=post.id, parent_id=comment.id,
+                           created_at=old, updated_at=old))
+    db.session.add(Like(user_id=user.id, post_id=post.id, created_at=old))
+    db.session.commit()
+    ids = post.id, comment.id
+    assert archive.archive_cold_posts() == 1
+    db.session.expunge_all()
+    return ids
+
+
+def login(client):
+    client.post('/auth/login', data={'username': 'author', 'password': 'password'})
+
+
+def test_reading_an_archived_post_writes_nothing(app, archived_post):
+    post_id, comment_id = archived_post
+    client = app.test_client()
+
+    response = client.get(f'/blog/post/{post_id}')
+    assert response.status_code == 200
+    for text in (b'Old post', b'Old text', b'#history', b'First comment', b'A reply', b'1 like'):
+        assert text in response.data
+    comments = client.get(f'/blog/post/{post_id}/comments').get_json()
+    assert [c['content'] for c in comments['comments']] == ['First comment']
+    replies = client.get(f'/blog/comment/{comment_id}/replies').get_json()
+    assert [r['content'] for r in replies['replies']] == ['A reply']
+
+    analytics.flush()
+    db.session.expunge_all()
+    assert archive.is_archived(post_id)
+    assert db.session.get(Post, post_id) is None
+    assert PostViewStats.query.count() == 0
+
+
+def test_author_can_read_history_of_an_archived_post(app, archived_post):
+    post_id, _ = archived_post
+    client = app.test_client()
+    login(client)
+    assert client.get(f'/blog/post/{post_id}/history').status_code == 200
+    revision = client.get(f'/blog/post/{post_id}/revisions/1')
+    assert revision.status_code == 200 and b'Old text' in revision.data
+    assert client.get(f'/blog/post/{post_id}/edit').status_code == 200
+    assert archive.is_archived(post_id)
+
+
+def test_writing_to_an_archived_post_restores_it(app, archived_post):
+    post_id, _ = archived_post
+    client = app.test_client()
+    login(client)
+    response = client.post(f'/blog/post/{post_id}/comment', data={'content': 'New comment'})
+    assert response.status_code == 302
+    db.session.expunge_all()
+    assert not archive.is_archived(post_id)
+    post = db.session.get(Post, post_id)
+    assert not isinstance(post, ArchivedPost)
+    assert post.get_all_comments_count() == 3
+    assert post.get_like_count() == 1
@@ -0,0 +1,70 @@
+import sqlite3
+
+import pytest
+
+import ratelimit
+
+NOW = 1_000_000.0
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return ratelimit.MemoryRateLimitStore()
+    return ratelimit.SQLiteRateLimitStore(str(tmp_path / 'ratelimit.db'))
+
+
+def test_parse_rule():
+    assert ratelimit.parse_rule('10/minute') == (10, 10 / 60)
+    assert ratelimit.parse_rule('3/ second') == (3, 3)
+
+
+def test_burst_up_to_capacity(store):
+    results = [store.hit('k', 3, 1.0, now=NOW) for _ in range(4)]
+    assert results[:3] == [(True, 0)] * 3
+    allowed, retry_after = results[3]
+    assert not allowed
+    assert retry_after == pytest.approx(1.0)
+
+
+def test_refill_and_retry_after(store):
+    for _ in range(2):
+        assert store.hit('k', 2, 0.5, now=NOW)[0]
+    allowed, retry_after = store.hit('k', 2, 0.5, now=NOW + 0.5)
+    assert not allowed
+    assert retry_after == pytest.approx(1.5)  # 0.25 tokens refilled, 0.75 more at 0.5 per second
+    # Rejected hits take nothing, so 1.125 tokens are there by now
+    assert store.hit('k', 2, 0.5, now=NOW + 2.25) == (True, 0)
+    allowed, retry_after = store.hit('k', 2, 0.5, now=NOW + 2.25)
+    assert not allowed
+    assert retry_after == pytest.approx(1.75)
+
+
+def test_refill_is_capped_at_capacity(store):
+    store.hit('k', 2, 1.0, now=NOW)
+    results = [store.hit('k', 2, 1.0, now=NOW + 3600)[0] for _ in range(3)]
+    assert results == [True, True, False]
+
+
+def test_buckets_are_separate(store):
+    assert store.hit('a', 1, 1.0, now=NOW)[0]
+    assert not store.hit('a', 1, 1.0, now=NOW)[0]
+    assert store.hit('b', 1, 1.0, now=NOW)[0]
+
+
+def test_sweep_drops_only_full_buckets(store):
+    store.hit('short', 1, 1.0, now=NOW)
+    store.hit('long', 2, 0.1, now=NOW)
+    assert store.sweep(now=NOW + 0.5) == 0
+    assert store.sweep(now=NOW + 1) == 1
+    # A swept bucket starts full again
+    assert store.hit('short', 1, 1.0, now=NOW + 1) == (True, 0)
+    assert store.sweep(now=NOW + 1.5) == 0
+    assert store.sweep(now=NOW + 10) == 2
+
+
+def test_sqlite_store_needs_returning(app, monkeypatch):
+    app.config['RATELIMIT_STORE'] = 'sqlite'
+    monkeypatch.setattr(sqlite3, 'sqlite_version_info', (3, 34, 1))
+    with pytest.raises(RuntimeError, match='3.35'):
+        ratelimit.create_store(app)
@@ -0,0 +1,103 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import revisions
+from models import db, Post, PostRevision
+
+WORDS = ['alpha', 'beta', 'gamma', 'café', 'naïve', 'Straße', '日本語', 'ελληνικά', '🙂', '']
+
+
+def random_line(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(0, 6)))
+
+
+def random_edit(rng, content):
+    lines = content.splitlines(keepends=True)
+    edit = rng.choice(['insert', 'delete', 'replace', 'append', 'same', 'clear', 'no_newline'])
+    if edit == 'insert':
+        lines.insert(rng.randint(0, len(lines)), random_line(rng) + '\n')
+    elif edit == 'delete' and lines:
+        del lines[rng.randrange(len(lines))]
+    elif edit == 'replace' and lines:
+        lines[rng.randrange(len(lines))] = random_line(rng) + '\n'
+    elif edit == 'append':
+        lines.extend(random_line(rng) + '\n' for _ in range(rng.randint(1, 5)))
+    elif edit == 'clear':
+        lines = []
+    elif edit == 'no_newline':
+        lines.append(random_line(rng))
+    return ''.join(lines)
+
+
+@pytest.mark.parametrize('old, new', [
+    ('', ''),
+    ('', 'new\n'),
+    ('one\ntwo\n', ''),
+    ('same\n', 'same\n'),
+    ('no newline', 'no newline\nafter'),
+    ('crlf\r\nline\r\n', 'crlf\r\nchanged\r\n'),
+    ('café\n日本語\n', '日本語\ncafé\n🙂'),
+])
+def test_delta_round_trip(old, new):
+    ops = revisions.make_delta(old, new)
+    assert revisions.apply_delta(old, ops) == new
+    if not new:
+        assert ops == []
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_random_edits_survive_recording_and_compaction(app, user, seed):
+    rng = random.Random(seed)
+    app.config['REVISION_SNAPSHOT_INTERVAL'] = 4
+    post = Post(title='Title', content='first line\n', author=user)
+    db.session.add(post)
+    revisions.record_revision(post)
+    db.session.commit()
+
+    expected = {1: ('Title', 'first line\n')}
+    for i in range(40):
+        content = random_edit(rng, post.content)
+        title = f'Title {i}' if rng.random() < 0.2 else post.title
+        if (title, content) == (post.title, post.content):
+            assert revisions.record_revision(post) is None
+            continue
+        post.title, post.content = title, content
+        revision = revisions.record_revision(post)
+        db.session.commit()
+        expected[revision.number] = (title, content)
+
+    stored = post.revisions.order_by(PostRevision.number).all()
+    assert [r.number for r in stored] == sorted(expected)
+    assert any(not r.is_snapshot for r in stored)
+    for revision in stored:
+        assert (revision.title, revisions.revision_content(revision)) == expected[revision.number]
+
+    # Spread the revisions over days so compaction keeps the last one of each day
+    start = datetime(2020, 1, 1)
+    for i, revision in enumerate(stored):
+        revision.created_at = start + timedelta(days=i // 3, minutes=i)
+    db.session.commit()
+    kept_numbers = {stored[0].number} | {
+        revision.number for i, revision in enumerate(stored)
+        if i + 1 == len(stored) or stored[i + 1].created_at.date() != revision.created_at.date()
+    }
+
+    app.config['REVISION_SNAPSHOT_INTERVAL'] = 3
+    removed = revisions.compact_post(post.id, datetime(2030, 1, 1))
+    db.session.commit()
+    db.session.expire_all()
+
+    kept = post.revisions.order_by(PostRevision.number).all()
+    assert removed == len(stored) - len(kept_numbers)
+    assert {r.number for r in kept} == kept_numbers
+    for revision in kept:
+        assert (revision.title, revisions.revision_content(revision)) == expected[revision.number]
+    assert revisions.replay(revisions.latest_chain(post)) == post.content
+
+    # Editing after compaction continues the re-encoded chain
+    post.content += 'after compaction ✓\n'
+    revision = revisions.record_revision(post)
+    db.session.commit()
+    assert revisions.revision_content(revision) == post.content
@@ -0,0 +1,31 @@
+import pytest
+
+import tags
+from models import db, Post
+
+
+@pytest.fixture
+def tagged_posts(app, user):
+    posts = [Post(title=f'Post {i}', content='Text', author=user) for i in range(7)]
+    db.session.add_all(posts)
+    db.session.flush()
+    for post in posts:
+        tags.set_post_tags(post, ['python'])
+    db.session.commit()
+    return posts
+
+
+def test_tag_pages_follow_the_cursor(app, tagged_posts):
+    client = app.test_client()
+    first = client.get('/blog/tag/python')
+    assert first.status_code == 200
+    cursor = tagged_posts[-app.config['POSTS_PER_PAGE']].id
+    assert f'after={cursor}'.encode() in first.data
+    second = client.get(f'/blog/tag/python?after={cursor}')
+    assert second.status_code == 200
+    assert b'Post 0' in second.data and b'Post 6' not in second.data
+
+
+@pytest.mark.parametrize('cursor', ['abc', '1.5', '2|3'])
+def test_malformed_tag_cursor_is_rejected(app, tagged_posts, cursor):
+    assert app.test_client().get(f'/blog/tag/python?after={cursor}').status_code == 400
@@ -0,0 +1,143 @@
+import math
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Post, Like, Comment, PostScore, JobCheckpoint
+
+# Every contribution is expressed relative to this fixed instant (see PostScore)
+SCORE_EPOCH = datetime(2025, 1, 1)
+
+# (checkpoint name, activity model, config key of its weight)
+SOURCES = (
+    ('trending.likes', Like, 'TRENDING_LIKE_WEIGHT'),
+    ('trending.comments', Comment, 'TRENDING_COMMENT_WEIGHT'),
+)
+
+
+def logaddexp(a, b):
+    """log(e^a + e^b) without overflowing"""
+    if a < b:
+        a, b = b, a
+    return a + math.log1p(math.exp(b - a))
+
+
+def contribution(weight, created_at):
+    """Log-space score of one like or comment"""
+    tau = current_app.config['TRENDING_HALF_LIFE_HOURS'] * 3600 / math.log(2)
+    return math.log(weight) + (created_at - SCORE_EPOCH).total_seconds() / tau
+
+
+def add_contribution(deltas, post_id, value):
+    deltas[post_id] = logaddexp(deltas[post_id], value) if post_id in deltas else value
+
+
+def get_checkpoint(name):
+    checkpoint = db.session.get(JobCheckpoint, name)
+    if checkpoint is None:
+        try:
+            db.session.add(JobCheckpoint(name=name, position=0))
+            db.session.commit()
+        except IntegrityError:
+            # Another worker created it first
+            db.session.rollback()
+        checkpoint = db.session.get(JobCheckpoint, name)
+    return checkpoint
+
+
+def merge_scores(deltas):
+    """Fold per-post log-space deltas into the stored scores"""
+    existing = dict(db.session.query(PostScore.post_id, PostScore.score).filter(
+        PostScore.post_id.in_(list(deltas))
+    ))
+    updates = [{'post_id': post_id, 'score': logaddexp(existing[post_id], delta)}
+               for post_id, delta in deltas.items() if post_id in existing]
+    inserts = [{'post_id': post_id, 'score': delta}
+               for post_id, delta in deltas.items() if post_id not in existing]
+    if updates:
+        db.session.execute(db.update(PostScore), updates)
+    if inserts:
+        db.session.execute(db.insert(PostScore), inserts)
+
+
+def update_scores():
+    """Add likes and comments created since the previous run to the stored scores.
+
+    Runs in batches of TRENDING_BATCH_SIZE rows. The checkpoint is advanced with a
+    compare-and-set in the same transaction as the score writes, so a batch is never
+    applied twice when several workers run the job at once. Returns the rows processed.
+    """
+    batch_size = current_app.config['TRENDING_BATCH_SIZE']
+    processed = 0
+    for name, model, weight_key in SOURCES:
+        weight = current_app.config[weight_key]
+        while True:
+            position = get_checkpoint(name).position
+            rows = db.session.query(model.id, model.post_id, model.created_at).filter(
+                model.id > position
+            ).order_by(model.id.asc()).limit(batch_size).all()
+            if not rows:
+                break
+
+            claimed = JobCheckpoint.query.filter_by(name=name, position=position).update(
+                {'position': rows[-1].id}, synchronize_session=False
+            )
+            if not claimed:
+                db.session.rollback()
+                break
+
+            deltas = {}
+            for row in rows:
+                add_contribution(deltas, row.post_id, contribution(weight, row.created_at))
+            merge_scores(deltas)
+            db.session.commit()
+            processed += len(rows)
+
+            if len(rows) < batch_size:
+                break
+    return processed
+
+
+def rebuild_scores():
+    """Recompute every score from the activity window, dropping unliked and deleted activity"""
+    cutoff = datetime.utcnow() - timedelta(days=current_app.config['TRENDING_WINDOW_DAYS'])
+    deltas = {}
+    positions = {}
+    for name, model, weight_key in SOURCES:
+        weight = current_app.config[weight_key]
+        positions[name] = db.session.query(db.func.coalesce(db.func.max(model.id), 0)).scalar()
+        rows = db.session.query(model.post_id, model.created_at).filter(
+            model.id <= positions[name], model.created_at >= cutoff
+        ).execution_options(yield_per=5000)
+        for post_id, created_at in rows:
+            add_contribution(deltas, post_id, contribution(weight, created_at))
+
+    for name in positions:
+        get_checkpoint(name)
+    PostScore.query.delete()
+    if deltas:
+        db.session.execute(db.insert(PostScore), [
+            {'post_id': post_id, 'score': score} for post_id, score in deltas.items()
+        ])
+    for name, position in positions.items():
+        JobCheckpoint.query.filter_by(name=name).update({'position': position})
+    db.session.commit()
+    return len(deltas)
+
+
+def get_trending_page(after=None, limit=10):
+    """Keyset page of posts by stored score, reading only the top of the score index"""
+    query = Post.query.join(Post.trending_score).options(db.contains_eager(Post.trending_score)).filter(
+        Post.status == Post.PUBLISHED
+    )
+    if after:
+        query = query.filter(db.tuple_(PostScore.score, PostScore.post_id) < PostScore.parse_cursor(after))
+    posts = query.order_by(PostScore.score.desc(), PostScore.post_id.desc()).limit(limit + 1).all()
+    next_cursor = posts[limit - 1].trending_score.get_cursor() if len(posts) > limit else None
+    return posts[:limit], next_cursor
+
+
+def init_app(app, scheduler):
+    scheduler.add_job('trending.update', update_scores, app.config['TRENDING_UPDATE_INTERVAL'])
+    scheduler.add_job('trending.rebuild', rebuild_scores, app.config['TRENDING_REBUILD_INTERVAL'])
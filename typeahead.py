@@ -0,0 +1,213 @@
+import heapq
+import json
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+from flask import current_app
+
+from models import db, User, Post, Like, ChangeLog
+
+TOKEN_RE = re.compile(r'\w+')
+MAX_RESULTS = 20  # cached lists hold this many, so any limit up to it is served from the cache
+
+
+def tokens(text):
+    return {token.casefold() for token in TOKEN_RE.findall(text or '')}
+
+
+class PrefixIndex:
+    """Sorted (token, kind, id) entries searched with bisect, plus top-k lists for short prefixes.
+
+    Short prefixes match too many entries to scan per keystroke, so their
+    top-k lists are computed at build time and adjusted in place as items and
+    scores change.
+
+    Each worker keeps its own copy. It is built on first use and follows post
+    and like changes through the change log. Users are not in the change log, so
+    new users, username changes and follower counts only show up at the periodic
+    rebuild. Syncs keep to the memory cap by dropping the least popular items.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = []
+        self.items = {}  # (kind, id) -> [label, score, tokens]
+        self.cache = {}
+        self.cursor = 0
+        self.built = False
+
+    def configure(self, config):
+        self.max_items = config['TYPEAHEAD_MAX_ITEMS']
+        self.cache_prefix_length = config['TYPEAHEAD_CACHE_PREFIX_LENGTH']
+
+    def build(self):
+        """Load the most popular posts and users, up to TYPEAHEAD_MAX_ITEMS in total"""
+        # Read the cursor first, in the same transaction, so no change is missed or applied twice
+        cursor = db.session.query(db.func.coalesce(db.func.max(ChangeLog.id), 0)).scalar()
+        likes = db.select(Like.post_id, db.func.count().label('likes')).group_by(Like.post_id).subquery()
+        score = db.func.coalesce(likes.c.likes, 0)
+        posts = db.session.query(Post.id, Post.title, score).outerjoin(
+            likes, likes.c.post_id == Post.id
+        ).filter(Post.status == Post.PUBLISHED).order_by(score.desc()).limit(self.max_items).all()
+        users = db.session.query(User.id, User.username, User.follower_count).order_by(
+            User.follower_count.desc()
+        ).limit(self.max_items).all()
+        db.session.rollback()
+
+        candidates = [('post', id, title, likes) for id, title, likes in posts]
+        candidates += [('user', id, username, followers) for id, username, followers in users]
+        candidates = heapq.nlargest(self.max_items, candidates, key=lambda candidate: candidate[3])
+
+        items = {}
+        entries = []
+        for kind, id, label, score in candidates:
+            item_tokens = tokens(label)
+            items[(kind, id)] = [label, score, item_tokens]
+            entries.extend((token, kind, id) for token in item_tokens)
+        entries.sort()
+
+        buckets = defaultdict(set)
+        for token, kind, id in entries:
+            for prefix in self._short_prefixes(token):
+                buckets[prefix].add((kind, id))
+        rank = lambda key: (items[key][1], key[1])
+        cache = {prefix: heapq.nlargest(MAX_RESULTS, keys, key=rank) for prefix, keys in buckets.items()}
+
+        with self.lock:
+            self.items, self.entries, self.cache = items, entries, cache
+            self.cursor = cursor
+            self.built = True
+
+    def ensure_built(self):
+        if not self.built:
+            self.build()
+
+    def put(self, kind, id, label):
+        """Add an item or re-index it under a new label, keeping its popularity"""
+        key = (kind, id)
+        with self.lock:
+            previous = self.items.get(key)
+            if previous is not None:
+                self._demote(key)
+                self._remove_entries(key)
+            item_tokens = tokens(label)
+            self.items[key] = [label, previous[1] if previous else 0, item_tokens]
+            for token in item_tokens:
+                insort(self.entries, (token, kind, id))
+            self._promote(key)
+
+    def remove(self, kind, id):
+        key = (kind, id)
+        with self.lock:
+            if key in self.items:
+                self._demote(key)
+                self._remove_entries(key)
+                del self.items[key]
+
+    def add_score(self, kind, id, delta):
+        key = (kind, id)
+        with self.lock:
+            if key in self.items:
+                self.items[key][1] += delta
+                self._promote(key) if delta > 0 else self._demote(key)
+
+    def _short_prefixes(self, token):
+        return [token[:n] for n in range(1, min(len(token), self.cache_prefix_length) + 1)]
+
+    def _rank(self, key):
+        return self.items[key][1], key[1]
+
+    def _promote(self, key):
+        """Key was added or gained score: it can only move up in the cached lists"""
+        for token in self.items[key][2]:
+            for prefix in self._short_prefixes(token):
+                top = self.cache.get(prefix)
+                if top is None:
+                    continue
+                if key not in top:
+                    if len(top) == MAX_RESULTS and self._rank(key) <= self._rank(top[-1]):
+                        continue
+                    top.append(key)
+                top.sort(key=self._rank, reverse=True)
+                del top[MAX_RESULTS:]
+
+    def _demote(self, key):
+        """Key is leaving or lost score: lists holding it are recomputed on their next read"""
+        for token in self.items[key][2]:
+            for prefix in self._short_prefixes(token):
+                top = self.cache.get(prefix)
+                if top is not None and key in top:
+                    del self.cache[prefix]
+
+    def _remove_entries(self, key):
+        for token in self.items[key][2]:
+            i = bisect_left(self.entries, (token,) + key)
+            if i < len(self.entries) and self.entries[i] == (token,) + key:
+                del self.entries[i]
+
+    def search(self, text, limit):
+        """Top `limit` (kind, id, label) by popularity whose label has a word starting with the last word of text"""
+        words = TOKEN_RE.findall(text.casefold())
+        if not words:
+            return []
+        prefix = words[-1]
+        with self.lock:
+            top = self.cache.get(prefix)
+            if top is None:
+                matches = set()
+                i = bisect_left(self.entries, (prefix,))
+                while i < len(self.entries) and self.entries[i][0].startswith(prefix):
+                    matches.add(self.entries[i][1:])
+                    i += 1
+                top = heapq.nlargest(max(limit, MAX_RESULTS), matches, key=self._rank)
+                if len(prefix) <= self.cache_prefix_length:
+                    self.cache[prefix] = top[:MAX_RESULTS]
+            return [(kind, id, self.items[(kind, id)][0]) for kind, id in top[:limit]]
+
+    def sync(self):
+        """Apply post and like changes recorded since the last sync or build (users wait for the rebuild)"""
+        if not self.built:
+            return 0
+        changes = ChangeLog.query.filter(
+            ChangeLog.id > self.cursor, ChangeLog.entity.in_(('post', 'like'))
+        ).order_by(ChangeLog.id).limit(current_app.config['TYPEAHEAD_SYNC_BATCH']).all()
+        db.session.rollback()
+        for change in changes:
+            data = json.loads(change.payload)
+            if change.entity == 'post':
+                if change.op == 'delete' or data.get('status', Post.PUBLISHED) != Post.PUBLISHED:
+                    self.remove('post', change.entity_id)
+                else:
+                    self.put('post', change.entity_id, data['title'])
+            elif change.op in ('insert', 'delete'):
+                self.add_score('post', data['post_id'], 1 if change.op == 'insert' else -1)
+        if changes:
+            self.cursor = changes[-1].id
+            self.enforce_cap()
+        return len(changes)
+
+    def enforce_cap(self):
+        """Drop the least popular items once syncs have grown the index past TYPEAHEAD_MAX_ITEMS"""
+        excess = len(self.items) - self.max_items
+        if excess <= 0:
+            return
+        with self.lock:
+            evicted = heapq.nsmallest(excess, self.items, key=self._rank)
+        for kind, id in evicted:
+            self.remove(kind, id)
+
+
+index = PrefixIndex()
+
+
+def search(prefix, limit):
+    index.ensure_built()
+    return index.search(prefix, limit)
+
+
+def init_app(app, scheduler):
+    index.configure(app.config)
+    scheduler.add_job('typeahead.sync', index.sync, app.config['TYPEAHEAD_SYNC_INTERVAL'])
+    scheduler.add_job('typeahead.rebuild', index.build, app.config['TYPEAHEAD_REBUILD_INTERVAL'])
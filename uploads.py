@@ -0,0 +1,140 @@
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import Request, current_app
+from sqlalchemy.exc import IntegrityError
+from werkzeug.utils import secure_filename
+
+from models import db, Upload
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; without it only originals are served
+    Image = None
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+FILENAME_RE = re.compile(r'^(?P<sha256>[0-9a-f]{64})(?:_(?P<variant>[a-z]+))?\.(?P<ext>[a-z0-9]+)$')
+
+
+class HashingFile:
+    """Temporary file that hashes bytes as Werkzeug's multipart parser writes them"""
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.file = tempfile.NamedTemporaryFile(dir=directory, prefix='upload-', delete=False)
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+class UploadRequest(Request):
+    """Streams uploaded files straight to disk under UPLOAD_FOLDER instead of buffering them"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        stream = HashingFile(os.path.join(current_app.config['UPLOAD_FOLDER'], 'tmp'))
+        self.__dict__.setdefault('_upload_streams', []).append(stream)
+        return stream
+
+    def close(self):
+        super().close()
+        # Anything not claimed by store_upload is a rejected or abandoned upload
+        for stream in self.__dict__.get('_upload_streams', []):
+            stream.file.close()
+            if os.path.exists(stream.file.name):
+                os.remove(stream.file.name)
+
+
+def upload_path(sha256, ext, variant=None):
+    name = f'{sha256}_{variant}.{ext}' if variant else f'{sha256}.{ext}'
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], sha256[:2], name)
+
+
+def store_upload(file_storage):
+    """Move an uploaded file to its content-addressed location, storing duplicates once"""
+    stream = file_storage.stream
+    ext = secure_filename(file_storage.filename).rsplit('.', 1)[-1].lower()
+    if not isinstance(stream, HashingFile):
+        # Uploads that did not come through UploadRequest (e.g. tests) are hashed here
+        hashing = HashingFile(os.path.join(current_app.config['UPLOAD_FOLDER'], 'tmp'))
+        for chunk in iter(lambda: stream.read(64 * 1024), b''):
+            hashing.write(chunk)
+        stream = hashing
+    stream.file.close()
+    sha256 = stream.sha256.hexdigest()
+
+    upload = Upload.query.filter_by(sha256=sha256, ext=ext).first()
+    if upload is None:
+        upload = Upload(sha256=sha256, ext=ext, size=stream.size, content_type=file_storage.mimetype)
+        try:
+            with db.session.begin_nested():
+                db.session.add(upload)
+        except IntegrityError:
+            # The same file was uploaded concurrently and its row inserted first
+            upload = Upload.query.filter_by(sha256=sha256, ext=ext).one()
+
+    # The file goes in place only once the row exists: if the request then rolls back, the file is
+    # left without a row, which the next identical upload simply reuses
+    path = upload_path(sha256, ext)
+    if os.path.exists(path):
+        os.remove(stream.file.name)
+        return upload
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(stream.file.name, path)
+
+    if ext in IMAGE_EXTENSIONS:
+        schedule_variants(path, current_app.config['UPLOAD_IMAGE_VARIANTS'])
+    return upload
+
+
+def make_variants(path, variants):
+    """Write resized copies of an image next to it. Runs in a worker process."""
+    base, ext = os.path.splitext(path)
+    with Image.open(path) as image:
+        for name, size in variants.items():
+            variant = image.copy()
+            variant.thumbnail(size)
+            variant.save(f'{base}_{name}{ext}')
+    return path
+
+
+_executor = None
+_executor_slots = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor, _executor_slots
+    with _executor_lock:
+        if _executor is None:
+            workers = current_app.config['UPLOAD_IMAGE_WORKERS']
+            _executor = ProcessPoolExecutor(max_workers=workers)
+            _executor_slots = threading.BoundedSemaphore(current_app.config['UPLOAD_IMAGE_QUEUE_SIZE'])
+    return _executor, _executor_slots
+
+
+def schedule_variants(path, variants):
+    """Queue resizing off the request thread; when the queue is full the original is served instead"""
+    if Image is None or not variants:
+        return None
+    executor, slots = get_executor()
+    if not slots.acquire(blocking=False):
+        current_app.logger.warning('Image variant queue full, skipping %s', path)
+        return None
+    future = executor.submit(make_variants, path, variants)
+    future.add_done_callback(lambda _: slots.release())
+    return future
+
+
+def init_app(app):
+    app.request_class = UploadRequest
@@ -0,0 +1,10 @@
+"""WSGI entry point for production servers, e.g. ``gunicorn wsgi:app``.
+
+``flask serve`` runs gunicorn with settings sized from the config; this
+module is for running any other WSGI server directly. With gevent or
+eventlet workers do not pass ``--preload``: the app has to be imported after
+the worker patches the standard library.
+"""
+from app import create_app
+
+app = create_app()